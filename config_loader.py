@@ -5,8 +5,25 @@ Supports Docker-style ${VARIABLE:default} syntax
 """
 import os
 import re
+import threading
 import yaml
 
+# libyaml-backed loader is ~6x faster than the pure Python one when available
+_Loader = getattr(yaml, 'CSafeLoader', yaml.SafeLoader)
+
+_ENV_VAR_PATTERN = re.compile(r'\$\{([^}:]+)(?::[^}]*)?\}')
+
+# Keys that must be present for the gateway to start
+REQUIRED_KEYS = {
+    'config': ('device', 'modbus_address', 't_delay_ms'),
+    'mqtt': ('broker', 'port', 'topic'),
+}
+
+VALUE_TYPES = ('INT16', 'UINT16', 'INT32', 'UINT32', 'INT64', 'UINT64')
+
+class ConfigError(Exception):
+    """Configuration file is missing, unreadable or invalid"""
+
 def substitute_env_vars(text):
     """
     Substitute environment variables in text using ${VAR:default} syntax.
@@ -50,6 +67,92 @@ def load_yaml_with_env(config_file):
     except Exception as e:
         raise Exception(f'Error loading YAML file {config_file}: {e}')
 
+def validate_config(config):
+    """
+    Check that a loaded configuration has everything the gateway needs.
+
+    Raises:
+        ConfigError: Describing the first problem found
+    """
+    if not isinstance(config, dict):
+        raise ConfigError('Configuration must be a YAML mapping')
+    for section, keys in REQUIRED_KEYS.items():
+        if not isinstance(config.get(section), dict):
+            raise ConfigError(f"Missing '{section}' section")
+        for key in keys:
+            if config[section].get(key) is None:
+                raise ConfigError(f"Missing '{section}.{key}'")
+    sensors = config.get('sensor')
+    if not isinstance(sensors, list):
+        raise ConfigError("Missing 'sensor' list")
+    for index, sensor in enumerate(sensors):
+        if sensor.get('skip', False):
+            continue
+        for key in ('id', 'address', 'value_type', 'multiply'):
+            if key not in sensor:
+                raise ConfigError(f"Sensor #{index} ({sensor.get('id', '?')}) is missing '{key}'")
+        if sensor['value_type'] not in VALUE_TYPES:
+            raise ConfigError(f"Sensor {sensor['id']} has unknown value_type {sensor['value_type']}")
+    return config
+
+class _ConfigCache:
+    """Compiled configurations keyed on file identity, mtime and referenced environment variables"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.entries = {}  # path -> (key, env var names, config)
+
+    @staticmethod
+    def _key(stat, env_names):
+        return (stat.st_mtime_ns, stat.st_size, stat.st_ino,
+                tuple((name, os.environ.get(name)) for name in env_names))
+
+    def get(self, config_file):
+        path = os.path.abspath(config_file)
+        try:
+            stat = os.stat(path)
+        except OSError as e:
+            raise ConfigError(f'Error loading YAML file {config_file}: {e}')
+
+        with self.lock:
+            entry = self.entries.get(path)
+            if entry is not None and entry[0] == self._key(stat, entry[1]):
+                return entry[2]
+
+            try:
+                with open(path, 'r') as f:
+                    content = f.read()
+                env_names = tuple(sorted(set(_ENV_VAR_PATTERN.findall(content))))
+                config = yaml.load(substitute_env_vars(content), Loader=_Loader)
+            except Exception as e:
+                raise ConfigError(f'Error loading YAML file {config_file}: {e}')
+            validate_config(config)
+            self.entries[path] = (self._key(stat, env_names), env_names, config)
+            return config
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+_cache = _ConfigCache()
+
+def get_config(config_file='em340.yaml'):
+    """
+    Return the validated configuration, parsing the file only when needed.
+
+    The result is cached per file and reused until the file's mtime/size or any
+    environment variable it references changes, so every module and tool in a
+    process shares one parse. The returned dictionary is shared - do not modify it.
+
+    Raises:
+        ConfigError: File missing, unreadable or failing validation
+    """
+    return _cache.get(config_file)
+
+def clear_config_cache():
+    """Forget all cached configurations (mainly for tests)."""
+    _cache.clear()
+
 # Backward compatibility function
 def load_config(config_file):
     """Load configuration with environment variable support"""
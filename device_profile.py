@@ -0,0 +1,91 @@
+#!/usr/bin/env python
+"""
+Meter capability probe and sensor profiles
+Reads the identification and wiring configuration of the meter once and derives
+which measurement registers carry a value for its measuring system, so the
+poller does not spend bus time on phases that are not wired
+"""
+import minimalmodbus
+
+# Identification and configuration registers (EM330/EM340 communication protocol)
+FIRMWARE_REGISTER = 0x0302         # version code (0 = "A") followed by revision code
+SERIAL_NUMBER_REGISTER = 0x5000    # 7 registers, ASCII in the low byte
+SERIAL_NUMBER_LENGTH = 7
+MEASURING_SYSTEM_REGISTER = 0x1002
+MEASUREMENT_MODE_REGISTER = 0x1103
+
+MEASURING_SYSTEMS = {
+    0: '3-phase 4-wire with neutral',
+    1: '3-phase 3-wire without neutral',
+    2: '2-phase 3-wire',
+    3: '1-phase',  # EM330 only
+}
+
+# Measurement registers that only carry a value when the phase (or the neutral) is wired
+PHASE_TO_NEUTRAL = frozenset({
+    0x0000, 0x0002, 0x0004,  # V L1-N, V L2-N, V L3-N
+    0x0012, 0x0014, 0x0016,  # W L1..L3
+    0x0018, 0x001A, 0x001C,  # VA L1..L3
+    0x001E, 0x0020, 0x0022,  # var L1..L3
+    0x0024,                  # V L-N sys
+    0x002E, 0x002F, 0x0030,  # PF L1..L3
+})
+PHASE_L2 = frozenset({0x0002, 0x0006, 0x0008, 0x000E, 0x0014, 0x001A, 0x0020, 0x002F})
+PHASE_L3 = frozenset({0x0004, 0x0008, 0x000A, 0x0010, 0x0016, 0x001C, 0x0022, 0x0030})
+LINE_TO_LINE = frozenset({0x0006, 0x0008, 0x000A, 0x0026})
+
+# Sensor addresses without a meaningful value per measuring system
+NOT_MEASURED = {
+    0: frozenset(),
+    1: PHASE_TO_NEUTRAL,
+    2: PHASE_L3,
+    3: PHASE_L2 | PHASE_L3 | LINE_TO_LINE,
+}
+
+def read_device_serial(read):
+    """
+    Read the serial number the meter reports (one 7-register read).
+
+    Returns:
+        The serial number, or None on meters without the register
+    """
+    try:
+        letters = read(SERIAL_NUMBER_REGISTER, SERIAL_NUMBER_LENGTH)
+    except minimalmodbus.IllegalRequestError:
+        return None
+    return ''.join(chr(word & 0xFF) for word in letters).strip()
+
+def probe_capabilities(read):
+    """
+    Read identification and wiring configuration from the meter.
+
+    Args:
+        read: Callable(address, count) returning the register values
+
+    Returns:
+        Dictionary with firmware, device_serial (None on meters without it),
+        measuring_system and measurement_mode
+
+    Raises:
+        minimalmodbus.ModbusException, IOError: The meter could not be read
+    """
+    version, revision = read(FIRMWARE_REGISTER, 2)
+    return {
+        'firmware': f'{chr(ord("A") + version)}{revision}',
+        'device_serial': read_device_serial(read),
+        'measuring_system': read(MEASURING_SYSTEM_REGISTER, 1)[0],
+        'measurement_mode': read(MEASUREMENT_MODE_REGISTER, 1)[0],
+    }
+
+def not_measured(capabilities):
+    """Sensor addresses the meter's measuring system leaves without a value."""
+    return NOT_MEASURED.get((capabilities or {}).get('measuring_system'), frozenset())
+
+def describe_capabilities(capabilities):
+    """One log line summarising probed capabilities."""
+    system = capabilities.get('measuring_system')
+    mode = capabilities.get('measurement_mode')
+    return (f'Meter {capabilities.get("device_serial") or "(serial not reported)"}, '
+            f'firmware {capabilities.get("firmware")}, '
+            f'{MEASURING_SYSTEMS.get(system, f"measuring system {system}")}, '
+            f'measurement mode {chr(ord("A") + mode) if isinstance(mode, int) else mode}')
@@ -0,0 +1,66 @@
+#!/usr/bin/env python
+"""
+Per-meter state kept across restarts
+One JSON file per meter serial number in the configured state directory, holding
+named sections such as the learned block limits. Files are replaced atomically,
+so a power cut never leaves a half-written file behind
+"""
+import json
+import os
+import tempfile
+
+from logger import log
+
+class DeviceStore:
+    """Reads and writes the sections of <directory>/<serial number>.json."""
+
+    def __init__(self, directory):
+        self.directory = directory
+
+    def path(self, serial_number):
+        name = ''.join(c if c.isalnum() or c in '-_' else '_' for c in str(serial_number))
+        return os.path.join(self.directory, f'{name}.json')
+
+    def _read(self, serial_number):
+        path = self.path(serial_number)
+        try:
+            with open(path) as f:
+                document = json.load(f)
+        except FileNotFoundError:
+            return {}
+        except (OSError, ValueError) as e:
+            log.warning(f'Ignoring unreadable device state {path}: {e}')
+            return {}
+        return document if isinstance(document, dict) else {}
+
+    def load(self, serial_number, section):
+        """Return the stored section for a meter, or an empty dict."""
+        return self._read(serial_number).get(section, {})
+
+    def save(self, serial_number, section, data):
+        """
+        Store one section for a meter, keeping the other sections.
+
+        Returns:
+            True if the file was written
+        """
+        document = self._read(serial_number)
+        document[section] = data
+        path = self.path(serial_number)
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            handle, temp_path = tempfile.mkstemp(dir=self.directory, prefix='.tmp-', suffix='.json')
+            try:
+                with os.fdopen(handle, 'w') as f:
+                    json.dump(document, f, indent=2, sort_keys=True)
+                    f.write('\n')
+                    f.flush()
+                    os.fsync(f.fileno())
+                os.replace(temp_path, path)
+            except BaseException:
+                os.unlink(temp_path)
+                raise
+        except OSError as e:
+            log.error(f'Could not save device state to {path}: {e}')
+            return False
+        return True
@@ -0,0 +1,185 @@
+#!/usr/bin/env python
+"""
+Serial device hotplug watcher
+Watches the directory holding the configured device node (e.g. /dev or
+/dev/serial/by-id) with inotify and wakes waiting threads the moment the node
+appears or disappears. Falls back to polling where inotify is not available
+"""
+import ctypes
+import ctypes.util
+import os
+import select
+import struct
+import threading
+
+from logger import log
+
+# inotify event masks (linux/inotify.h)
+IN_ATTRIB = 0x00000004
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_ONLYDIR = 0x01000000
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+
+WATCH_MASK = (IN_CREATE | IN_DELETE | IN_MOVED_FROM | IN_MOVED_TO | IN_ATTRIB |
+              IN_DELETE_SELF | IN_MOVE_SELF | IN_ONLYDIR)
+EVENT_HEADER = struct.Struct('iIII')  # wd, mask, cookie, name length
+
+class _Inotify:
+    """Minimal ctypes binding for inotify(7)."""
+
+    def __init__(self):
+        libc = ctypes.CDLL(ctypes.util.find_library('c') or None, use_errno=True)
+        self._add_watch = libc.inotify_add_watch
+        self._add_watch.argtypes = (ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32)
+        self._rm_watch = libc.inotify_rm_watch
+        self._rm_watch.argtypes = (ctypes.c_int, ctypes.c_int)
+        self.fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), 'inotify_init1 failed')
+
+    def add_watch(self, path, mask):
+        wd = self._add_watch(self.fd, os.fsencode(path), mask)
+        if wd < 0:
+            raise OSError(ctypes.get_errno(), f'inotify_add_watch({path}) failed')
+        return wd
+
+    def rm_watch(self, wd):
+        self._rm_watch(self.fd, wd)  # fails harmlessly if the directory is already gone
+
+    def read_events(self):
+        """Drain pending events; returns the number of events read."""
+        count = 0
+        while True:
+            try:
+                data = os.read(self.fd, 4096)
+            except BlockingIOError:
+                return count
+            position = 0
+            while position + EVENT_HEADER.size <= len(data):
+                _, _, _, name_length = EVENT_HEADER.unpack_from(data, position)
+                position += EVENT_HEADER.size + name_length
+                count += 1
+
+    def close(self):
+        os.close(self.fd)
+
+class DeviceWatcher(threading.Thread):
+    """
+    Tracks whether a device path exists and notifies waiters on every change.
+
+    The nearest existing parent directory of the path is watched (so a missing
+    /dev/serial/by-id is followed once it is created), plus the directory of the
+    symlink target, which disappears before udev removes the link itself.
+    """
+
+    def __init__(self, path, poll_interval=1.0, on_change=None):
+        """
+        Args:
+            path: Device node or symlink to watch, e.g. /dev/ttyUSB0
+            poll_interval: Re-check interval; the only source of updates without inotify
+            on_change: Optional callable(present) run on the watcher thread after each change
+        """
+        super().__init__(name='em340-device-watcher', daemon=True)
+        self.path = os.path.abspath(path)
+        self.poll_interval = poll_interval
+        self.on_change = on_change
+        self.changes = 0
+        self._condition = threading.Condition()
+        self._present = os.path.exists(self.path)
+        self._stop_event = threading.Event()
+        self._watches = {}  # directory -> watch descriptor
+        self._wake_r, self._wake_w = os.pipe()
+        self._closed = False
+        try:
+            self._inotify = _Inotify()
+        except (OSError, AttributeError) as e:
+            log.info(f'inotify not available ({e}), polling {self.path} every {poll_interval}s')
+            self._inotify = None
+
+    @property
+    def present(self):
+        return self._present
+
+    @property
+    def uses_inotify(self):
+        return self._inotify is not None
+
+    def wait_for(self, present=True, timeout=None):
+        """
+        Block until the device presence matches, or the timeout expires.
+
+        Returns:
+            True if the device is in the requested state
+        """
+        with self._condition:
+            return self._condition.wait_for(lambda: self._present == present, timeout)
+
+    def stop(self):
+        """Stop the thread and release its descriptors; the watcher owns them, not run()."""
+        if self._closed:
+            return
+        self._closed = True
+        self._stop_event.set()
+        os.write(self._wake_w, b'x')
+        if self.is_alive():
+            self.join()
+        if self._inotify:
+            self._inotify.close()
+        os.close(self._wake_r)
+        os.close(self._wake_w)
+
+    def _directories(self):
+        """Directories whose entries decide whether the path exists."""
+        directories = set()
+        directory = os.path.dirname(self.path)
+        while directory != os.path.dirname(directory) and not os.path.isdir(directory):
+            directory = os.path.dirname(directory)
+        directories.add(directory)
+        target = os.path.realpath(self.path)
+        if target != self.path and os.path.isdir(os.path.dirname(target)):
+            directories.add(os.path.dirname(target))
+        return directories
+
+    def _update_watches(self):
+        wanted = self._directories()
+        for directory in set(self._watches) - wanted:
+            self._inotify.rm_watch(self._watches.pop(directory))
+        for directory in wanted - set(self._watches):
+            try:
+                self._watches[directory] = self._inotify.add_watch(directory, WATCH_MASK)
+            except OSError as e:
+                log.debug(f'Cannot watch {directory}: {e}')
+
+    def _check(self):
+        present = os.path.exists(self.path)
+        if present == self._present:
+            return
+        with self._condition:
+            self._present = present
+            self.changes += 1
+            self._condition.notify_all()
+        log.info(f'Serial device {self.path} {"appeared" if present else "disappeared"}')
+        if self.on_change:
+            try:
+                self.on_change(present)
+            except Exception as e:
+                log.error(f'Device change callback failed: {e}')
+
+    def run(self):
+        while not self._stop_event.is_set():
+            descriptors = [self._wake_r]
+            if self._inotify:
+                self._update_watches()
+                descriptors.append(self._inotify.fd)
+            # The path may have changed while the watches were being set up
+            self._check()
+            readable, _, _ = select.select(descriptors, [], [], self.poll_interval)
+            if self._inotify and self._inotify.fd in readable:
+                self._inotify.read_events()
+            self._check()
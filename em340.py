@@ -5,20 +5,42 @@ import time
 import yaml # pip install PyYAML
 import sys
 import os
+import termios
 import json
 import paho.mqtt.client as mqtt
 from datetime import date, datetime, timedelta
 from dateutil import tz
-from logger import log
-from config_loader import load_yaml_with_env
+from logger import log, setup_logging
+from config_loader import get_config
 from em340_config_manager import EM340ConfigManager
+from frame_capture import CaptureWriter, CapturingSerial
+from poll_plan import PlanLimits, PollPlan
+from modbus_bus import CircuitBreaker, ModbusBus, PRIORITY_CONFIG_WRITE, PRIORITY_ON_DEMAND
+from device_watcher import DeviceWatcher
+from device_store import DeviceStore
+from hybrid_mode import HybridPoller
+from status_file import DEFAULT_STATUS_FILE, StatusFile
+from service_watchdog import ServiceWatchdog
+from serial_latency import find_adapter, tune_adapter
+from device_profile import (MEASURING_SYSTEM_REGISTER, MEASURING_SYSTEMS, describe_capabilities,
+                            not_measured, probe_capabilities, read_device_serial)
+
 
 class EM340:
+    # Device node re-check interval when inotify is unavailable (inotify reports changes immediately)
+    DEVICE_POLL_INTERVAL = 0.5
+    # Longest wait for sniffed bytes in hybrid mode before the read schedule is checked again
+    HYBRID_LISTEN_SLICE = 0.02
+    # Reads timed before and after tuning the USB-serial adapter's latency
+    LATENCY_SAMPLES = 5
+
     def __init__(self, config_file):
         log.info(f'Initializing EM340 with config file: {config_file}')
         try:
-            self.em340_config = load_yaml_with_env(config_file)
+            self.em340_config = get_config(config_file)
             log.info('Configuration loaded successfully')
+            self.config_file = config_file
+            self._config_signature_seen = self._config_signature()
         except Exception as e:
             log.error(f'Error loading YAML file: {e}')
             sys.exit()
@@ -29,11 +51,84 @@ class EM340:
         
         log.info(f'ModBus configuration: device={self.device}, address={self.modbus_address}, delay={self.t_delay_seconds}s')
 
+        # Error policy: retry a failed block in place within a latency budget, then
+        # mark it stale for the cycle; only several failed blocks in a row reopen
+        # the transport and open the circuit breaker
+        config = self.em340_config['config']
+        self.block_retries = int(config.get('block_retries', 1))
+        self.retry_budget_seconds = float(config.get('retry_budget_ms', 300)) / 1000.0
+        self.breaker = CircuitBreaker(failure_threshold=int(config.get('reconnect_after_failures', 3)),
+                                      cooldown=float(config.get('breaker_cooldown_s', 5.0)))
+        self.block_retry_count = 0
+
+        # Meter profile and block limits learned from illegal-request exceptions are kept across restarts
+        state_dir = config.get('state_dir')
+        self.device_store = DeviceStore(state_dir) if state_dir else None
+
+        # Optional raw frame capture for offline reproduction of field problems
+        self.capture = None
+        capture_file = self.em340_config['config'].get('capture_file')
+        if capture_file:
+            self.capture = CaptureWriter(capture_file)
+            log.info(f'Capturing raw ModBus frames to {capture_file}')
+
+        # Heartbeat record for health checks, rewritten after every cycle
+        self.status_file = None
+        # configurations older than the key still write the file the health check reads
+        status_file = config.get('status_file', DEFAULT_STATUS_FILE)
+        if status_file:
+            self.status_file = StatusFile(status_file)
+            log.info(f'Writing the status heartbeat to {status_file}')
+        self.started = time.time()
+        self.cycle_count = 0
+        self.stale_block_count = 0
+        self.publish_error_count = 0
+        self.reconnect_count = 0
+        self.last_read = None
+        self.last_publish = None
+
+        # All ModBus traffic (polling and config commands) goes through one bus owner
+        self.bus = None
+
+        # Hotplug events for the device node wake the poller instead of I/O timeouts
+        self.device_watcher = DeviceWatcher(self.device, poll_interval=self.DEVICE_POLL_INTERVAL)
+        self.device_watcher.start()
+
         # Initialize serial connection with retry support
+        self.latency_report = None
         self._initialize_serial_connection()
+        self._tune_serial_latency(measure=True)
+
+        # Identification and wiring of the meter decide which sensors are worth reading
+        self.capabilities = self._probe_capabilities()
+        self._load_plan_limits()
+
+        # Hybrid mode: another master (e.g. a GoodWe inverter) polls the meter; listen
+        # to its reads and only read what it leaves stale, in the idle windows of the bus
+        self.hybrid = None
+        if config.get('poll_mode', 'active') == 'hybrid':
+            self.hybrid_interval = float(config.get('hybrid_publish_ms', 1000)) / 1000.0
+            self.hybrid = HybridPoller(self.bus, self.modbus_address,
+                                       max_age=float(config.get('hybrid_max_age_ms', 5000)) / 1000.0,
+                                       idle_guard=float(config.get('hybrid_idle_ms', 50)) / 1000.0)
+            log.info(f'Hybrid poll mode: publishing every {self.hybrid_interval}s, '
+                     f'own reads for registers older than {self.hybrid.max_age / 2}s')
+
+        # Liveness for systemd: the watchdog is fed only by cycles completing in time,
+        # and a stall detector dumps the thread stacks when the loop stops moving
+        default_target_ms = config.get('hybrid_publish_ms', 1000) if self.hybrid else 1000
+        self.watchdog = ServiceWatchdog(target_period=float(config.get('cycle_target_ms', default_target_ms)) / 1000.0,
+                                        multiple=float(config.get('watchdog_multiple', 3)),
+                                        stall_timeout=float(config.get('stall_timeout_s', 20)),
+                                        stall_exit=bool(config.get('stall_exit', True)))
 
     def _initialize_serial_connection(self):
-        """Initialize or reinitialize the serial connection to the ModBus device."""
+        """Initialize the serial connection, the MQTT client and the configuration manager."""
+        self._open_serial_transport()
+        self._initialize_mqtt()
+
+    def _open_serial_transport(self):
+        """Open (or reopen) the ModBus instrument and hand it to the bus; nothing else is touched."""
         self.em340 = minimalmodbus.Instrument(self.device, self.modbus_address) # port name, slave address (in decimal)
         self.em340.serial.port # this is the serial port name
         self.em340.serial.baudrate = 9600 # Baud
@@ -43,9 +138,60 @@ class EM340:
         #self.em340.serial.timeout = 0.05 # seconds
         self.em340.serial.timeout = 0.5 # seconds
         self.em340.mode = minimalmodbus.MODE_RTU # rtu or ascii mode
+        if self.capture:
+            self.em340.serial = CapturingSerial(self.em340.serial, self.capture)
+        if self.bus is None:
+            self.bus = ModbusBus(self.em340, inter_frame_delay=self.t_delay_seconds)
+        else:
+            self.bus.replace_instrument(self.em340)
+            # a replugged adapter starts again with its default latency
+            self._tune_serial_latency()
         
         log.info(f'ModBus instrument configured: port={self.device}, baudrate=9600, timeout=0.5s')
 
+    def _transaction_latency(self):
+        """Median seconds of a one-register read, or None if the meter does not answer."""
+        samples = []
+        for _ in range(self.LATENCY_SAMPLES):
+            with self.bus.transaction(PRIORITY_ON_DEMAND) as instrument:
+                start = time.perf_counter()
+                try:
+                    instrument.read_register(MEASURING_SYSTEM_REGISTER)
+                except (minimalmodbus.ModbusException, IOError, serial.SerialException, termios.error):
+                    return None
+                samples.append(time.perf_counter() - start)
+        return sorted(samples)[len(samples) // 2]
+
+    def _tune_serial_latency(self, measure=False):
+        """
+        Lower the receive latency of the USB-serial adapter behind the device.
+
+        With measure the per-transaction latency is timed before and after, and
+        both settings and timings are kept in latency_report.
+        """
+        config = self.em340_config['config']
+        latency_timer_ms = config.get('latency_timer_ms', 1)
+        low_latency = bool(config.get('low_latency', True))
+        if latency_timer_ms in (None, '') and not low_latency:
+            return
+        adapter = find_adapter(self.device)
+        if adapter is None:
+            log.debug('%s is not a hardware serial port, latency left alone', self.device)
+            return
+        before = self._transaction_latency() if measure else None
+        changes = tune_adapter(adapter, self.em340.serial.fileno(),
+                                      None if latency_timer_ms in (None, '') else int(latency_timer_ms), low_latency)
+        if not measure:
+            return
+        after = self._transaction_latency()
+        self.latency_report = {'adapter': adapter.describe(), 'settings': changes,
+                               'transaction_ms': [None if t is None else round(t * 1000, 2) for t in (before, after)]}
+        settings = ', '.join(f'{name} {old} -> {new}' for name, (old, new) in changes.items()) or 'nothing to change'
+        timings = ' -> '.join('n/a' if t is None else f'{t * 1000:.1f} ms' for t in (before, after))
+        log.info(f'Serial adapter {adapter.describe()}: {settings}; read transaction {timings}')
+
+    def _initialize_mqtt(self):
+        """Create the MQTT client and the configuration manager; done once per process."""
         # MQTT client setup with automatic reconnection
         log.info(f'Setting up MQTT client for broker: {self.em340_config["mqtt"]["broker"]}:{self.em340_config["mqtt"]["port"]}')
         self.mqtt_client = mqtt.Client(callback_api_version=mqtt.CallbackAPIVersion.VERSION2)
@@ -55,14 +201,15 @@ class EM340:
         self.mqtt_client.reconnect_delay_set(min_delay=2, max_delay=30)
         self.topic = self.em340_config['mqtt']['topic'] + '/' + self.em340_config['config']['serial_number']
         log.info(f'MQTT topic configured: {self.topic}')
-        # Start network loop in background thread
-        self.mqtt_client.loop_start()
-        # Try initial connection
+        # Queue the initial connection before starting the network loop, so the loop
+        # thread connects immediately instead of waiting out a reconnect delay first
         try:
-            self.mqtt_client.connect(self.em340_config['mqtt']['broker'], self.em340_config['mqtt']['port'])
+            self.mqtt_client.connect_async(self.em340_config['mqtt']['broker'], self.em340_config['mqtt']['port'])
             log.info('MQTT initial connection attempt initiated')
         except Exception as e:
             log.error(f'Initial MQTT connection failed: {e}')
+        # Start network loop in background thread
+        self.mqtt_client.loop_start()
 
         # Initialize configuration manager
         self._initialize_config_manager()
@@ -81,7 +228,8 @@ class EM340:
         self.config_manager = EM340ConfigManager(
             config_mqtt_config, 
             self.device, 
-            self.modbus_address
+            self.modbus_address,
+            bus=self.bus
         )
         
         # Start configuration service
@@ -103,9 +251,38 @@ class EM340:
         else:
             log.info('MQTT client disconnected.')
 
+    def _wait_for_device(self, timeout):
+        """
+        Wait up to timeout seconds for the device node to exist, keeping the watchdog fed.
+
+        Returns:
+            True as soon as the device exists, False on timeout
+        """
+        deadline = time.monotonic() + timeout
+        while True:
+            step = min(max(0.0, deadline - time.monotonic()), self.watchdog.keepalive_interval)
+            self.watchdog.keep_alive(step)
+            if self.device_watcher.wait_for(present=True, timeout=step):
+                return True
+            if time.monotonic() >= deadline:
+                return False
+
+    def _close_serial(self):
+        try:
+            self.em340.serial.close()
+        except Exception:
+            pass  # Ignore errors closing a broken connection
+
     def _reconnect_serial_device(self, max_retries=None, base_delay=2.0, max_delay=60.0):
         """
-        Attempt to reconnect to the serial device with exponential backoff.
+        Reopen the serial transport after the device failed.
+
+        Only the instrument is replaced: MQTT sessions, the configuration manager
+        and the block plan are kept. While the device node is missing the device
+        watcher wakes the reconnect as soon as the adapter reappears; the
+        exponential backoff only bounds how long one
+        attempt waits and spaces out retries when the device exists but does
+        not answer.
         
         Args:
             max_retries: Maximum number of retry attempts (None for infinite)
@@ -117,255 +294,442 @@ class EM340:
         """
         retry_count = 0
         delay = base_delay
+
+        # Close the old connection; holding the bus keeps config commands off the dead port
+        with self.bus.transaction(PRIORITY_CONFIG_WRITE) as instrument:
+            try:
+                if instrument.serial.is_open:
+                    instrument.serial.close()
+                    log.info('Closed old serial connection')
+            except Exception:
+                pass  # Ignore errors closing old connection
         
         while max_retries is None or retry_count < max_retries:
             retry_count += 1
             log.warning(f'Serial device disconnected. Attempting reconnection (attempt {retry_count})...')
+
+            if not self._wait_for_device(delay):
+                log.error(f'Device file {self.device} does not exist')
+                # Increase delay for next attempt (exponential backoff)
+                delay = min(delay * 1.5, max_delay)
+                continue
             
             try:
-                # Close the old connection if it exists
-                if hasattr(self.em340, 'serial') and hasattr(self.em340.serial, 'is_open'):
-                    try:
-                        if self.em340.serial.is_open:
-                            self.em340.serial.close()
-                            log.info('Closed old serial connection')
-                    except:
-                        pass  # Ignore errors closing old connection
-                
-                # Wait before attempting reconnection
-                log.info(f'Waiting {delay:.1f}s before reconnection attempt...')
-                time.sleep(delay)
-                
-                # Check if device file exists
-                import os
-                if not os.path.exists(self.device):
-                    log.error(f'Device file {self.device} does not exist')
-                    # Increase delay for next attempt (exponential backoff)
-                    delay = min(delay * 1.5, max_delay)
-                    continue
-                
-                # Reinitialize the serial connection
-                self._initialize_serial_connection()
-                
-                # Test the connection by reading a register
-                log.info('Testing connection by reading device measurement mode...')
-                measurement_mode = self.em340.read_register(0x1103)
-                measurement_mode_type = chr(measurement_mode + 65)
-                log.info(f'Connection successful! Measurement mode: {measurement_mode_type}')
+                # Reopen only the serial transport
+                self._open_serial_transport()
                 
-                # Reset delay for future disconnections
+                # Test the connection by reading the measuring system, which also
+                # tells whether the sensor profile still fits the meter
+                log.info('Testing connection by reading the measuring system...')
+                measuring_system = self.bus.read_register(MEASURING_SYSTEM_REGISTER)
+                log.info(f'Connection successful! Measuring system: '
+                         f'{MEASURING_SYSTEMS.get(measuring_system, measuring_system)}')
+
+                # The adapter may now lead to a different meter
+                self.config_manager.invalidate_cache()
+                device_serial = read_device_serial(self._read_on_demand)
+                known = self.capabilities or {}
+                if (measuring_system, device_serial) != (known.get('measuring_system'), known.get('device_serial')):
+                    log.warning('Meter serial number or measuring system differs from the probed one - '
+                                'probing the meter again')
+                    self.capabilities = self._probe_capabilities()
+                    self._load_plan_limits()
+                    self._build_plan()
+                self.reconnect_count += 1
                 return True
                 
             except serial.SerialException as e:
                 log.error(f'Serial connection failed: {e}')
+                self._close_serial()
+            except minimalmodbus.ModbusException as e:
+                # The port is open but the meter did not answer - keep the port open
+                log.error(f'ModBus communication failed: {e}')
             except IOError as e:
                 log.error(f'ModBus communication failed: {e}')
+                self._close_serial()
             except Exception as e:
                 log.error(f'Unexpected error during reconnection: {e}')
+                self._close_serial()
             
-            # Increase delay for next attempt (exponential backoff)
+            # The device exists but does not work (yet) - back off before the next attempt
+            log.info(f'Waiting {delay:.1f}s before next reconnection attempt...')
+            self.watchdog.sleep(delay)
             delay = min(delay * 1.5, max_delay)
         
         log.error(f'Failed to reconnect after {retry_count} attempts')
         return False
 
-        # TODO send to MQTT to a different subtopic
-        measurement_mode = self.em340.read_register(0x1103)
-        measurement_mode_type = chr(measurement_mode + 65)
-        log.info(f'Measurement mode: {measurement_mode_type}')
-        time.sleep(0.1)
-
-        # TODO send to MQTT to a different subtopic
-        measuring_system = self.em340.read_register(0x1002)
-        measurement_system_text = ''
-        if measuring_system == 0:
-            measurement_system_text = '3-phase 4-wire with neutral'
-        elif measuring_system == 1:
-            measurement_system_text = '3-phase 3-wire without neutral'
-        elif measuring_system == 2:
-            measurement_system_text = '2-phase 3-wire'
-        elif measuring_system == 3:
-            measurement_system_text = '1-phase - only for EM330'
-        log.info(f'Measurement system: {measurement_system_text}')
-        time.sleep(0.1)
-
-        # change EM340 measurement mode to B
-        #self.em340.write_register(0x1103, 1)
-        #time.sleep(0.1)
-        
-        # Measuring system = 3-phase 4-wire with neutral
-        #self.em340.write_register(0x1002, 0)
-        #time.sleep(0.1)
+    def _load_state(self, section, serial_number=None):
+        """Stored section for serial_number, by default the configured serial_number."""
+        if self.device_store is None:
+            return {}
+        return self.device_store.load(serial_number or self.em340_config['config']['serial_number'], section)
 
-    def read_sensors(self):
-        # Group contiguous registers into blocks for efficient reading
-        sensors = [r for r in self.em340_config['sensor'] if not r.get('skip', False)]
-        sensors.sort(key=lambda r: r['address'])
-
-        # Build blocks of contiguous registers
-        blocks = []
-        current_block = []
-        max_block_size = 20  # EM340 typically allows up to 20 registers per read
-        max_gap = 5  # Maximum gap between registers to still consider them in the same block
-        
-        for sensor in sensors:
-            if not current_block:
-                current_block = [sensor]
-                continue
-                
-            prev_sensor = current_block[-1]
-            prev_end_addr = prev_sensor['address'] + prev_sensor.get('register_count', 1)
-            current_start_addr = sensor['address']
-            gap = current_start_addr - prev_end_addr
-            
-            # Calculate total registers needed if we add this sensor to current block
-            total_regs_needed = sensor['address'] + sensor.get('register_count', 1) - current_block[0]['address']
-            
-            # Start new block if:
-            # - Gap is too large (inefficient to read empty registers)
-            # - Block would exceed max size
-            # - Gap is negative (overlapping - shouldn't happen but safety check)
-            if gap < 0 or gap > max_gap or total_regs_needed > max_block_size:
-                blocks.append(current_block)
-                current_block = [sensor]
+    def _save_state(self, section, data, serial_number=None):
+        if self.device_store is not None:
+            self.device_store.save(serial_number or self.em340_config['config']['serial_number'], section, data)
+
+    def _meter_serial(self):
+        """Serial number the meter reported, or the configured one if it reports none."""
+        return (self.capabilities or {}).get('device_serial') or self.em340_config['config']['serial_number']
+
+    def _load_plan_limits(self):
+        """
+        Use the block limits learned for the meter on the line.
+
+        They are kept under the serial number read from the meter, so a swapped
+        meter or a shared default configuration never inherits another meter's limits.
+        """
+        self.plan_limits = PlanLimits.from_dict(self._load_state('plan_limits', self._meter_serial()))
+        if self.plan_limits.max_block_size or self.plan_limits.unreadable:
+            log.info(f'Using learned block limits: {self.plan_limits.to_dict()}')
+
+    def _read_on_demand(self, address, count):
+        return self.bus.read_registers(address, count, priority=PRIORITY_ON_DEMAND)
+
+    def _probe_capabilities(self):
+        """
+        Identify the meter and its wiring; the result is cached per serial number.
+
+        The cache is keyed on the serial number the meter reports (the configured
+        one for meters without it), like the learned block limits, so gateways
+        sharing a default configuration keep separate entries. A cached result is
+        confirmed by reading the measuring system, so a restart costs two
+        requests. If the meter cannot be read every configured sensor is read.
+
+        Returns:
+            Capabilities as returned by probe_capabilities(), or an empty dict
+        """
+        cached = {}
+        read = self._read_on_demand
+        try:
+            device_serial = read_device_serial(read)
+            cached = self._load_state('capabilities', device_serial)
+            if cached and read(MEASURING_SYSTEM_REGISTER, 1)[0] == cached.get('measuring_system'):
+                capabilities = cached
             else:
-                current_block.append(sensor)
-                
-        if current_block:
-            blocks.append(current_block)
-
-        # Log block organization for debugging
-        log.info(f'Organized {len(sensors)} sensors into {len(blocks)} blocks:')
-        for i, block in enumerate(blocks):
-            start_addr = block[0]['address']
-            end_addr = block[-1]['address'] + block[-1].get('register_count', 1)
-            total_regs = end_addr - start_addr
-            sensor_names = [s['name'] for s in block]
-            log.info(f'  Block {i+1}: 0x{start_addr:04X}-0x{end_addr-1:04X} ({total_regs} regs) - {", ".join(sensor_names)}')
+                capabilities = probe_capabilities(read)
+                self._save_state('capabilities', capabilities, capabilities.get('device_serial'))
+        except (minimalmodbus.ModbusException, IOError, serial.SerialException, termios.error) as err:
+            log.warning(f'Could not probe the meter capabilities: {err}')
+            capabilities = cached
+        if capabilities:
+            log.info(describe_capabilities(capabilities))
+        return capabilities
 
+    def _not_measured(self, config):
+        """Sensor addresses to leave out for the probed wiring (sensor_profile: auto)."""
+        if config['config'].get('sensor_profile', 'auto') != 'auto':
+            return frozenset()
+        return not_measured(self.capabilities)
+
+    def _build_plan(self):
+        """Compile the block plan from the current configuration and log it."""
+        self.plan = PollPlan.from_config(self.em340_config, limits=self.plan_limits,
+                                         excluded=self._not_measured(self.em340_config))
+        for line in self.plan.describe():
+            log.info(line)
+        return self.plan
+
+    def _learn_from_rejected_block(self, plan, index):
+        """
+        Probe a block the meter rejected and switch to a corrected plan.
+
+        The learned limits are persisted, so the next start uses the corrected
+        plan from its first cycle.
+        """
+        start_addr = plan.ranges[index][0]
+        log.warning(f'Block 0x{start_addr:04X} rejected by the meter - probing its registers')
+        try:
+            learned = self.plan_limits.diagnose(self.bus.read_registers, plan, index)
+        except (minimalmodbus.ModbusException, IOError, serial.SerialException, termios.error) as err:
+            # an adapter unplugged mid-probe is handled by the next block read
+            log.error(f'Probing block 0x{start_addr:04X} failed: {err}')
+            return
+        if not learned:
+            log.info(f'Block 0x{start_addr:04X} reads again, no limits learned')
+            return
+        self._save_state('plan_limits', self.plan_limits.to_dict(), self._meter_serial())
+        self._build_plan()
+
+    @property
+    def blocks(self):
+        return self.plan.blocks
+
+    def _config_signature(self):
+        try:
+            stat = os.stat(self.config_file)
+        except OSError:
+            return None
+        return (stat.st_mtime_ns, stat.st_size, stat.st_ino)
+
+    def reload_config_if_changed(self):
+        """
+        Swap in a rebuilt block plan when the configuration file has changed.
+
+        Called between cycles. An invalid file is rejected and the current plan
+        keeps running; the same broken version is not retried until it changes again.
+
+        Returns:
+            True if a new plan was installed
+        """
+        if not self.em340_config['config'].get('hot_reload', True):
+            return False
+        signature = self._config_signature()
+        if signature is None or signature == self._config_signature_seen:
+            return False
+        self._config_signature_seen = signature
+
+        log.info(f'Configuration file {self.config_file} changed - reloading')
+        try:
+            config = get_config(self.config_file)
+            plan = PollPlan.from_config(config, limits=self.plan_limits, excluded=self._not_measured(config))
+        except Exception as e:
+            log.error(f'Rejected new configuration, keeping the current plan: {e}')
+            return False
+
+        # Connection settings are bound to open serial/MQTT sessions
+        for section, key in (('config', 'device'), ('config', 'modbus_address'), ('config', 'serial_number'),
+                             ('config', 'poll_mode'),
+                             ('mqtt', 'broker'), ('mqtt', 'port'), ('mqtt', 'topic')):
+            if config[section].get(key) != self.em340_config[section].get(key):
+                log.warning(f'Change of {section}.{key} takes effect only after a restart')
+
+        self.em340_config = config
+        self.t_delay_seconds = config['config']['t_delay_ms'] / 1000.0
+        self.bus.inter_frame_delay = self.t_delay_seconds
+        self.plan = plan
+        log.info('New configuration applied')
+        for line in plan.describe():
+            log.info(line)
+        return True
+
+    def _read_block(self, start_addr, total_regs):
+        """
+        Read one block, retrying in place on ModBus-level errors (CRC, no answer, busy).
+
+        Retries stop after block_retries or once the retry budget for the block is
+        used up; illegal requests are not retried since the answer will not change.
+        """
+        deadline = time.monotonic() + self.retry_budget_seconds
+        attempt = 0
         while True:
-            log.debug('Reading EM340...')
-            data = {}
-            for block in blocks:
-                start_addr = block[0]['address']
-                end_addr = block[-1]['address'] + block[-1].get('register_count', 1)
-                total_regs = end_addr - start_addr
-                
-                try:
-                    log.debug(f'Reading block: 0x{start_addr:04X} to 0x{end_addr-1:04X} ({total_regs} registers)')
-                    values = self.em340.read_registers(start_addr, number_of_registers=total_regs)
-                    if values is None or len(values) != total_regs:
-                        raise ValueError(f"Expected {total_regs} values for block starting at {hex(start_addr)}, got {len(values) if values else 0}")
-                    
-                    # Process each sensor in the block
-                    for sensor in block:
-                        sensor_start = sensor['address'] - start_addr  # Offset within the block
-                        reg_count = sensor.get('register_count', 1)
-                        sensor_values = values[sensor_start:sensor_start + reg_count]
-                        
-                        if len(sensor_values) != reg_count:
-                            log.warning(f'Sensor {sensor["name"]} expected {reg_count} registers, got {len(sensor_values)}')
-                            continue
-                            
-                        value = None
-                        vt = sensor['value_type']
-                        if vt == "INT16":
-                            value = sensor_values[0]
-                            if value & 0x8000:
-                                value = -0x10000 + value
-                        elif vt == "UINT16":
-                            value = sensor_values[0]
-                        elif vt == "INT32":
-                            if len(sensor_values) >= 2:
-                                value = sensor_values[0] + (sensor_values[1] << 16)
-                                if value & 0x80000000:
-                                    value = -0x100000000 + value
-                            else:
-                                log.error(f'INT32 sensor {sensor["name"]} needs 2 registers, got {len(sensor_values)}')
-                                continue
-                        elif vt == "UINT32":
-                            if len(sensor_values) >= 2:
-                                value = sensor_values[0] + (sensor_values[1] << 16)
-                            else:
-                                log.error(f'UINT32 sensor {sensor["name"]} needs 2 registers, got {len(sensor_values)}')
-                                continue
-                        elif vt == "INT64":
-                            if len(sensor_values) >= 4:
-                                value = sensor_values[0] + (sensor_values[1] << 16) + (sensor_values[2] << 32) + (sensor_values[3] << 48)
-                                if value & 0x8000000000000000:
-                                    value = -0x10000000000000000 + value
-                            else:
-                                log.error(f'INT64 sensor {sensor["name"]} needs 4 registers, got {len(sensor_values)}')
-                                continue
-                        elif vt == "UINT64":
-                            if len(sensor_values) >= 4:
-                                value = sensor_values[0] + (sensor_values[1] << 16) + (sensor_values[2] << 32) + (sensor_values[3] << 48)
-                            else:
-                                log.error(f'UINT64 sensor {sensor["name"]} needs 4 registers, got {len(sensor_values)}')
-                                continue
-                        else:
-                            log.error(f'Unknown value_type {vt} for sensor {sensor["name"]}')
-                            continue
-                            
-                        value = value * float(sensor['multiply'])
-                        units = sensor.get('unit_of_measurement', '')
-                        log.debug(f'{sensor["name"]} (0x{sensor["address"]:04X}): {value} {units}')
-                        data[sensor['id']] = value
-                        
-                except IOError as err:
-                    log.error(f'Failed to read from ModBus device at {self.em340.serial.port}: {err}')
-                    # Attempt to reconnect to the device
-                    log.warning('Attempting to reconnect to serial device...')
-                    if self._reconnect_serial_device():
-                        log.info('Successfully reconnected to serial device. Resuming operations.')
-                        # Continue to next block after successful reconnection
-                        continue
-                    else:
-                        log.error('Failed to reconnect to serial device. Will retry on next iteration.')
-                        # Break out of block loop and wait before trying again
-                        break
-                except serial.SerialException as err:
-                    log.error(f'Serial communication error: {err}')
-                    # Attempt to reconnect to the device
-                    log.warning('Serial exception detected. Attempting to reconnect...')
-                    if self._reconnect_serial_device():
-                        log.info('Successfully reconnected after serial exception. Resuming operations.')
-                        continue
-                    else:
-                        log.error('Failed to reconnect after serial exception. Will retry on next iteration.')
-                        break
-                except ValueError as err:
-                    log.error(f'Error reading block starting at 0x{start_addr:04X}: {err}')
+            try:
+                return self.bus.read_registers(start_addr, total_regs)
+            except minimalmodbus.IllegalRequestError:
+                raise
+            except minimalmodbus.ModbusException as err:
+                attempt += 1
+                if attempt > self.block_retries or time.monotonic() >= deadline:
+                    raise
+                self.block_retry_count += 1
+                log.warning(f'Block 0x{start_addr:04X}: {err} - retrying ({attempt}/{self.block_retries})')
+
+    def poll_cycle(self):
+        """
+        Read every block once and decode the sensor values.
+
+        Blocks that cannot be read are left out and reported in the quality flags.
+
+        Returns:
+            Dictionary of sensor id -> scaled value, quality flags and the last_seen timestamp
+        """
+        log.debug('Reading EM340...')
+        data = {}
+        stale = []
+        plan = self.plan  # a reload between cycles must not change the plan mid-cycle
+        for index, values in self._read_blocks(plan, range(len(plan.ranges)), stale):
+            plan.decode(index, values, data)
+        return self._finish_cycle(plan, data, stale)
+
+    def hybrid_cycle(self):
+        """
+        Listen to the other master for one publish interval and read only what it leaves stale.
+
+        Blocks are read one at a time, each in an idle window of the bus.
+
+        Returns:
+            Dictionary of sensor id -> scaled value, quality flags and the last_seen timestamp
+        """
+        hybrid = self.hybrid
+        plan = self.plan
+        failed = []
+        deadline = time.monotonic() + self.hybrid_interval
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                hybrid.listen(min(remaining, self.HYBRID_LISTEN_SLICE))
+            except (IOError, serial.SerialException, termios.error) as err:
+                log.error(f'Serial communication error on {self.device}: {err}')
+                if not self._reconnect_serial_device(max_retries=1, base_delay=0.0):
+                    break
+                continue
+            due = [index for index in hybrid.due(plan) if index not in failed]
+            if due and hybrid.idle():
+                # a block that failed is not retried before the next cycle
+                for index, values in self._read_blocks(plan, due[:1], failed):
+                    hybrid.merge(plan.ranges[index][0], values)
+        data = {}
+        stale = hybrid.decode(plan, data)
+        log.debug('Hybrid cycle: %d reads observed, %d own reads so far', hybrid.observed_reads, hybrid.own_reads)
+        return self._finish_cycle(plan, data, stale)
+
+    def _read_blocks(self, plan, indices, stale):
+        """
+        Read the given blocks of plan, yielding (index, register values) per block read.
+
+        Blocks that cannot be read are appended to stale.
+        """
+        indices = list(indices)
+        for position, index in enumerate(indices):
+            start_addr, total_regs = plan.ranges[index]
+            if not self.breaker.allow():
+                stale.append(index)
+                continue
+            try:
+                if not self.device_watcher.present:
+                    # Unplugged: go straight to reconnecting instead of waiting out I/O timeouts
+                    raise serial.SerialException(f'Device {self.device} was removed')
+                log.debug('Reading block: 0x%04X to 0x%04X (%d registers)', start_addr, start_addr + total_regs - 1,
+                          total_regs)
+                # Config commands queued on the bus are served between blocks;
+                # the bus also enforces t_delay_ms between transactions
+                values = self._read_block(start_addr, total_regs)
+                if values is None or len(values) != total_regs:
+                    raise ValueError(f"Expected {total_regs} values for block starting at {hex(start_addr)}, got {len(values) if values else 0}")
+                self.breaker.record_success()
+                yield index, values
+
+            except minimalmodbus.IllegalRequestError as err:
+                # The meter answered, but rejects this request: a register it does not
+                # have or a read longer than it supports. Retrying will not help.
+                log.error(f'Block 0x{start_addr:04X} failed, marked stale for this cycle: {err}')
+                stale.append(index)
+                self._learn_from_rejected_block(plan, index)
+            except minimalmodbus.ModbusException as err:
+                # The meter (or the RS-485 line) misbehaved, the transport itself is fine
+                log.error(f'Block 0x{start_addr:04X} failed, marked stale for this cycle: {err}')
+                stale.append(index)
+                if self.breaker.record_failure():
+                    log.warning(f'{self.breaker.consecutive_failures} block reads failed in a row - '
+                                f'reopening the serial port and pausing for {self.breaker.current_cooldown:.1f}s')
+                    self._reconnect_serial_device(max_retries=1, base_delay=0.0)
+            except (IOError, serial.SerialException, termios.error) as err:
+                # pyserial lets termios.error through when the tty vanished mid-call
+                log.error(f'Serial communication error on {self.device}: {err}')
+                stale.append(index)
+                # Attempt to reconnect to the device
+                log.warning('Attempting to reconnect to serial device...')
+                if self._reconnect_serial_device():
+                    log.info('Successfully reconnected to serial device. Resuming operations.')
+                    # Continue to next block after successful reconnection
                     continue
-                except KeyError as err:
-                    log.error(f'Error in yaml config file: {err}')
-                    sys.exit()
-                except KeyboardInterrupt:
-                    log.error("Keyboard interrupt detected. Exiting...")
-                    # Clean shutdown of configuration service
-                    if hasattr(self, 'config_manager'):
-                        self.config_manager.stop_config_service()
-                    sys.exit()
-                finally:
-                    # Add delay between blocks to avoid overwhelming the device
-                    time.sleep(self.t_delay_seconds)
-
-            # Add timestamp in local time as last_seen
-            data['last_seen'] = datetime.now(tz=tz.tzlocal()).isoformat()
+                else:
+                    log.error('Failed to reconnect to serial device. Will retry on next iteration.')
+                    # Break out of block loop and wait before trying again
+                    stale.extend(indices[position + 1:])
+                    break
+            except ValueError as err:
+                log.error(f'Error reading block starting at 0x{start_addr:04X}: {err}')
+                stale.append(index)
+                continue
+            except KeyError as err:
+                log.error(f'Error in yaml config file: {err}')
+                sys.exit()
+            except KeyboardInterrupt:
+                log.error("Keyboard interrupt detected. Exiting...")
+                # Clean shutdown of configuration service
+                if hasattr(self, 'config_manager'):
+                    self.config_manager.stop_config_service()
+                sys.exit()
 
+        if self.capture:
+            self.capture.flush()
+
+    def _finish_cycle(self, plan, data, stale):
+        """Add the quality flags and the last_seen timestamp to one cycle of data."""
+        self.cycle_count += 1
+        self.stale_block_count += len(stale)
+        if len(stale) < len(plan.ranges):
+            self.last_read = time.time()
+
+        # Quality flags: partial cycles are still published
+        if not stale:
+            data['quality'] = 'good'
+        else:
+            data['quality'] = 'partial' if len(stale) < len(plan.ranges) else 'unavailable'
+            data['stale_blocks'] = [f'0x{plan.ranges[i][0]:04X}' for i in stale]
+        if self.breaker.state != CircuitBreaker.CLOSED:
+            data['breaker'] = self.breaker.state
+
+        # Add timestamp in local time as last_seen
+        data['last_seen'] = datetime.now(tz=tz.tzlocal()).isoformat()
+        return data
+
+    def publish(self, data):
+        """Publish one cycle of sensor data to the MQTT topic."""
+        payload = json.dumps(data)
+        try:
+            result = self.mqtt_client.publish(self.topic, payload)
+            if result.rc != mqtt.MQTT_ERR_SUCCESS:
+                self.publish_error_count += 1
+                log.warning(f'MQTT publish failed with code {result.rc}')
+            else:
+                self.last_publish = time.time()
+        except Exception as e:
+            self.publish_error_count += 1
+            log.error(f'Error publishing to MQTT: {e}')
+
+    def write_status(self, data):
+        """Rewrite the status heartbeat after a cycle; a no-op without status_file."""
+        if self.status_file is None:
+            return
+        self.status_file.write({
+            'pid': os.getpid(),
+            'started': self.started,
+            'updated': time.time(),
+            'last_read': self.last_read,
+            'last_publish': self.last_publish,
+            'quality': data.get('quality'),
+            'breaker': self.breaker.state,
+            'mqtt_connected': self.mqtt_client.is_connected(),
+            'cycles': self.cycle_count,
+            'stale_blocks': self.stale_block_count,
+            'block_retries': self.block_retry_count,
+            'publish_errors': self.publish_error_count,
+            'reconnects': self.reconnect_count,
+        })
+
+    def read_sensors(self):
+        # Group contiguous registers into blocks for efficient reading
+        self._build_plan()
+        self.watchdog.start()
+
+        while True:
+            cycle_start = time.monotonic()
+            data = self.hybrid_cycle() if self.hybrid else self.poll_cycle()
             # Publish data to MQTT topic
-            payload = json.dumps(data)
-            try:
-                result = self.mqtt_client.publish(self.topic, payload)
-                if result.rc != mqtt.MQTT_ERR_SUCCESS:
-                    log.warning(f'MQTT publish failed with code {result.rc}')
-            except Exception as e:
-                log.error(f'Error publishing to MQTT: {e}')
+            self.publish(data)
+            self.write_status(data)
+            self.watchdog.cycle_done(time.monotonic() - cycle_start)
+            # Pick up em340.yaml edits between cycles
+            self.reload_config_if_changed()
+            # While the breaker is open there is nothing to read until its cooldown ends
+            if self.breaker.state == CircuitBreaker.OPEN:
+                self.watchdog.sleep(self.breaker.retry_in())
 
 if __name__ == '__main__':
+    config_file = sys.argv[1] if len(sys.argv) > 1 else 'em340.yaml'
+    try:
+        setup_logging(get_config(config_file))
+    except Exception as e:
+        print(f'Error loading YAML file: {e}')
+        sys.exit()
     log.info('=== Starting EM340D ModBus to MQTT Gateway ===')
     log.info('Application startup initiated')
-    em340 = EM340('em340.yaml')
+    em340 = EM340(config_file)
     log.info('EM340 instance created successfully')
     log.info('Beginning sensor reading loop...')
     em340.read_sensors()
@@ -4,12 +4,27 @@ EM340 MQTT Configuration Module
 Listens to MQTT configuration topics and applies settings to the EM340 device
 """
 
+import itertools
 import json
+import threading
 import time
+from collections import OrderedDict, deque
 import paho.mqtt.client as mqtt
 from logger import log
 import minimalmodbus
 from typing import Dict, Any, Optional, Union
+from modbus_bus import ModbusBus, PRIORITY_CONFIG_WRITE, PRIORITY_ON_DEMAND
+
+def register_field(register_info):
+    """
+    Bits of its register a parameter occupies: an optional 'mask' in its
+    CONFIG_REGISTERS entry, the whole register by default.
+
+    Returns:
+        (mask, shift): the value is (word & mask) >> shift
+    """
+    mask = register_info.get('mask', 0xFFFF)
+    return mask, (mask & -mask).bit_length() - 1
 
 class EM340ConfigManager:
     """Manages EM340 configuration via MQTT commands"""
@@ -111,20 +126,64 @@ class EM340ConfigManager:
         }
     }
     
-    def __init__(self, mqtt_config: Dict[str, Any], modbus_device: str, modbus_address: int):
-        """Initialize the configuration manager"""
+    # Silence after a write before the device is addressed again
+    WRITE_SETTLE_SECONDS = 0.1
+    # Largest block read/write issued for adjacent config registers
+    MAX_BLOCK_REGISTERS = 20
+    # Pending MQTT commands beyond this are rejected
+    COMMAND_QUEUE_SIZE = 32
+    # Token bucket limiting how fast config commands may take the bus
+    COMMAND_RATE_PER_S = 5.0
+    COMMAND_BURST = 5
+    # Minimum interval between metrics publications
+    METRICS_INTERVAL_S = 10.0
+
+    def __init__(self, mqtt_config: Dict[str, Any], modbus_device: str, modbus_address: int,
+                 bus: Optional[ModbusBus] = None):
+        """
+        Initialize the configuration manager.
+
+        When running next to the poller, pass its ModbusBus so config commands are
+        queued on the same line instead of opening the serial port a second time.
+        """
         self.mqtt_config = mqtt_config
         self.modbus_device = modbus_device
         self.modbus_address = modbus_address
         
-        # Initialize ModBus connection
-        self.modbus = minimalmodbus.Instrument(modbus_device, modbus_address)
-        self.modbus.serial.baudrate = 9600
-        self.modbus.serial.bytesize = 8
-        self.modbus.serial.parity = minimalmodbus.serial.PARITY_NONE
-        self.modbus.serial.stopbits = 1
-        self.modbus.serial.timeout = 1.0  # Longer timeout for config operations
-        self.modbus.mode = minimalmodbus.MODE_RTU
+        if bus is None:
+            # Standalone use: own the ModBus connection
+            instrument = minimalmodbus.Instrument(modbus_device, modbus_address)
+            instrument.serial.baudrate = 9600
+            instrument.serial.bytesize = 8
+            instrument.serial.parity = minimalmodbus.serial.PARITY_NONE
+            instrument.serial.stopbits = 1
+            instrument.serial.timeout = 1.0  # Longer timeout for config operations
+            instrument.mode = minimalmodbus.MODE_RTU
+            bus = ModbusBus(instrument, inter_frame_delay=0.05)
+        self.bus = bus
+        # Write Multiple Registers support, learned on first use (the EM340 answers "illegal function")
+        self.fc16_supported = None
+
+        # Last known config register values: address -> (value, monotonic time read).
+        # Filled by one bulk read when the service starts and kept current by every
+        # read and verified write, so get requests do not need the bus.
+        self._cache = {}
+        self._cache_lock = threading.Lock()
+        self._available_published = False
+
+        # Commands received on the paho thread are executed by a worker thread.
+        # Keyed for coalescing: repeated gets merge, repeated sets keep the last value.
+        self._commands = OrderedDict()
+        self._commands_condition = threading.Condition()
+        self._command_sequence = itertools.count()
+        self._worker = None
+        self._running = False
+        self._busy = False
+        self._tokens = float(self.COMMAND_BURST)
+        self._tokens_updated = time.monotonic()
+        self._latencies = deque(maxlen=256)
+        self._metrics_published = time.monotonic()
+        self.command_stats = {'received': 0, 'executed': 0, 'coalesced': 0, 'dropped': 0, 'max_depth': 0}
         
         # Initialize MQTT client for configuration
         self.config_mqtt_client = mqtt.Client(callback_api_version=mqtt.CallbackAPIVersion.VERSION2)
@@ -141,11 +200,17 @@ class EM340ConfigManager:
         log.info(f"EM340 Config Manager initialized for device {self.device_id}")
         log.info(f"Configuration topics base: {self.config_topic_base}")
 
+    @property
+    def modbus(self):
+        """Instrument currently owned by the bus"""
+        return self.bus.instrument
+
     def start_config_service(self):
         """Start the MQTT configuration service"""
         try:
+            self.start_command_worker()
+            self.config_mqtt_client.connect_async(self.mqtt_config['broker'], self.mqtt_config['port'])
             self.config_mqtt_client.loop_start()
-            self.config_mqtt_client.connect(self.mqtt_config['broker'], self.mqtt_config['port'])
             log.info("EM340 configuration service started")
             return True
         except Exception as e:
@@ -155,12 +220,29 @@ class EM340ConfigManager:
     def stop_config_service(self):
         """Stop the MQTT configuration service"""
         try:
-            self.config_mqtt_client.loop_stop()
+            self.stop_command_worker()
+            # Disconnect first so the network loop wakes up and exits right away
             self.config_mqtt_client.disconnect()
+            self.config_mqtt_client.loop_stop()
             log.info("EM340 configuration service stopped")
         except Exception as e:
             log.error(f"Error stopping configuration service: {e}")
 
+    def start_command_worker(self):
+        """Start the thread executing queued configuration commands"""
+        if self._worker is None:
+            self._running = True
+            self._worker = threading.Thread(target=self._command_worker, name='em340-config-worker', daemon=True)
+            self._worker.start()
+
+    def stop_command_worker(self):
+        with self._commands_condition:
+            self._running = False
+            self._commands_condition.notify_all()
+        if self._worker is not None:
+            self._worker.join(timeout=5)
+            self._worker = None
+
     def on_config_mqtt_connect(self, client, userdata, flags, reason_code, properties=None):
         """Handle MQTT connection for configuration"""
         if reason_code == 0:
@@ -169,7 +251,9 @@ class EM340ConfigManager:
             # Subscribe to configuration topics
             config_topics = [
                 f"{self.config_topic_base}/+/set",           # Individual parameter set
-                f"{self.config_topic_base}/+/get",           # Individual parameter get
+                f"{self.config_topic_base}/+/get",           # Individual parameter get (cached)
+                f"{self.config_topic_base}/+/refresh",       # Individual parameter read from the device
+                f"{self.config_topic_base}/refresh",         # Re-read all parameters from the device
                 f"{self.config_topic_base}/batch/set",       # Batch configuration
                 f"{self.config_topic_base}/reset",           # Reset to defaults
                 f"{self.config_topic_base}/backup",          # Backup current config
@@ -180,8 +264,14 @@ class EM340ConfigManager:
                 client.subscribe(topic)
                 log.info(f"Subscribed to configuration topic: {topic}")
                 
-            # Publish available configuration parameters
-            self.publish_available_parameters()
+            # The parameter list is static and retained - publish it once per process
+            if not self._available_published:
+                self.publish_available_parameters()
+                self._available_published = True
+
+            # Fill the cache with one bulk read (also after a reconnect that found it empty)
+            if not self._cache:
+                self.enqueue_command(('refresh_cache',), self.refresh_cache)
             
         else:
             log.error(f'Failed to connect to MQTT broker for configuration, return code {reason_code}')
@@ -208,80 +298,440 @@ class EM340ConfigManager:
                 parameter = topic_parts[0]
                 action = topic_parts[1]
                 
-                if action == "set":
-                    self.handle_parameter_set(parameter, payload)
+                # Commands are queued for the worker thread so the MQTT network
+                # loop never waits for the bus
+                if parameter == "batch" and action == "set":
+                    self.enqueue_command(('batch', next(self._command_sequence)), self.handle_batch_set, payload)
+                elif action == "set":
+                    self.enqueue_command(('set', parameter), self.handle_parameter_set, parameter, payload)
                 elif action == "get":
-                    self.handle_parameter_get(parameter)
+                    self.enqueue_command(('get', parameter), self.handle_parameter_get, parameter)
+                elif action == "refresh":
+                    self.enqueue_command(('refresh', parameter), self.handle_parameter_get, parameter, True)
                     
             elif len(topic_parts) == 1:
                 action = topic_parts[0]
                 
-                if action == "batch/set":
-                    self.handle_batch_set(payload)
-                elif action == "reset":
-                    self.handle_reset()
+                if action == "reset":
+                    self.enqueue_command(('reset',), self.handle_reset)
                 elif action == "backup":
-                    self.handle_backup()
+                    self.enqueue_command(('backup',), self.handle_backup)
+                elif action == "refresh":
+                    self.enqueue_command(('refresh',), self.handle_refresh)
                 elif action == "restore":
-                    self.handle_restore(payload)
+                    self.enqueue_command(('restore', next(self._command_sequence)), self.handle_restore, payload)
                     
         except Exception as e:
             log.error(f"Error processing configuration message: {e}")
             self.publish_error(f"Error processing message: {str(e)}")
 
-    def handle_parameter_set(self, parameter: str, payload: str):
-        """Handle setting a single parameter"""
+    def enqueue_command(self, key: tuple, handler, *args) -> bool:
+        """
+        Queue a command for the worker thread.
+
+        A command with the same key as one still waiting replaces its arguments
+        in place (duplicate gets merge, a later set wins), so bursts of retained
+        or repeated messages cost one bus operation per parameter. A get is never
+        merged into one queued ahead of a pending set of the same parameter: it
+        moves behind the set, so it answers with the written value.
+
+        Returns:
+            False if the queue is full and the command was rejected
+        """
+        with self._commands_condition:
+            self.command_stats['received'] += 1
+            if key in self._commands:
+                if key[0] in ('get', 'refresh') and self._queued_after(key, ('set',) + key[1:]):
+                    enqueued = self._commands.pop(key)[2]
+                    self._commands[key] = [handler, args, enqueued]
+                else:
+                    self._commands[key][0:2] = [handler, args]
+                self.command_stats['coalesced'] += 1
+                return True
+            if len(self._commands) >= self.COMMAND_QUEUE_SIZE:
+                self.command_stats['dropped'] += 1
+                dropped = True
+            else:
+                self._commands[key] = [handler, args, time.monotonic()]
+                self.command_stats['max_depth'] = max(self.command_stats['max_depth'], len(self._commands))
+                self._commands_condition.notify()
+                dropped = False
+        if dropped:
+            log.warning(f"Configuration command queue full, dropping {key[0]} command")
+            self.publish_error(f"Command queue full ({self.COMMAND_QUEUE_SIZE}), {key[0]} dropped")
+            return False
+        return True
+
+    def _queued_after(self, key, other):
+        """True if command other is waiting behind the queued command key."""
+        if other not in self._commands:
+            return False
+        keys = list(self._commands)
+        return keys.index(other) > keys.index(key)
+
+    def _take_token(self):
+        """Wait until the rate limiter allows the next command on the bus"""
+        while True:
+            now = time.monotonic()
+            self._tokens = min(float(self.COMMAND_BURST),
+                               self._tokens + (now - self._tokens_updated) * self.COMMAND_RATE_PER_S)
+            self._tokens_updated = now
+            if self._tokens >= 1.0:
+                self._tokens -= 1.0
+                return
+            time.sleep((1.0 - self._tokens) / self.COMMAND_RATE_PER_S)
+
+    def _command_worker(self):
+        while True:
+            with self._commands_condition:
+                if self._running and not self._commands:
+                    self._busy = False
+                    self._commands_condition.notify_all()
+                    self._commands_condition.wait(timeout=max(0.0, self._metrics_published +
+                                                              self.METRICS_INTERVAL_S - time.monotonic()))
+                if not self._running:
+                    self._busy = False
+                    self._commands_condition.notify_all()
+                    return
+                command = self._commands.popitem(last=False) if self._commands else None
+                self._busy = command is not None
+
+            # On its own timer, busy or idle, and without holding the queue lock,
+            # so a slow publish never blocks enqueue_command
+            self._maybe_publish_metrics()
+            if command is None:
+                continue
+            key, (handler, args, enqueued) = command
+            self._take_token()
+            try:
+                handler(*args)
+            except Exception as e:
+                log.error(f"Error executing configuration command {key[0]}: {e}")
+                self.publish_error(f"Error executing {key[0]}: {str(e)}")
+            with self._commands_condition:
+                self._latencies.append(time.monotonic() - enqueued)
+                self.command_stats['executed'] += 1
+
+    def wait_idle(self, timeout: Optional[float] = None) -> bool:
+        """Block until every queued command has been executed"""
+        with self._commands_condition:
+            return self._commands_condition.wait_for(lambda: not self._commands and not self._busy, timeout)
+
+    def command_metrics(self) -> Dict[str, Any]:
+        """Queue depth, counters and command latency (enqueue to completion) in milliseconds"""
+        with self._commands_condition:
+            latencies = sorted(self._latencies)
+            metrics = dict(self.command_stats, depth=len(self._commands))
+        if latencies:
+            metrics['latency_ms'] = {
+                'p50': round(latencies[len(latencies) // 2] * 1000, 1),
+                'p95': round(latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))] * 1000, 1),
+                'max': round(latencies[-1] * 1000, 1),
+            }
+        return metrics
+
+    def _maybe_publish_metrics(self):
+        now = time.monotonic()
+        if now - self._metrics_published < self.METRICS_INTERVAL_S:
+            return
+        # The timer advances while idle too, so the worker's wait never times out at once
+        self._metrics_published = now
+        if not self.command_stats['received']:
+            return
         try:
-            if parameter not in self.CONFIG_REGISTERS:
-                raise ValueError(f"Unknown parameter: {parameter}")
-                
-            register_info = self.CONFIG_REGISTERS[parameter]
-            
-            if not register_info.get('writable', False):
-                raise ValueError(f"Parameter {parameter} is read-only")
+            payload = dict(self.command_metrics(), timestamp=time.time())
+            self.config_mqtt_client.publish(f"{self.config_topic_base}/metrics", json.dumps(payload), retain=True)
+        except Exception as e:
+            log.debug(f"Could not publish configuration metrics: {e}")
+
+    def parse_parameter_value(self, parameter: str, payload: str) -> int:
+        """
+        Validate a set request and convert the payload to a register value.
+
+        Raises:
+            ValueError: Unknown or read-only parameter, invalid or out of range value
+        """
+        if parameter not in self.CONFIG_REGISTERS:
+            raise ValueError(f"Unknown parameter: {parameter}")
             
-            # Parse and validate value
-            try:
-                value = int(payload)
-            except ValueError:
-                # Try to parse as string for named values
-                if 'values' in register_info:
-                    reverse_values = {v: k for k, v in register_info['values'].items()}
-                    if payload in reverse_values:
-                        value = reverse_values[payload]
-                    else:
-                        raise ValueError(f"Invalid value '{payload}' for parameter {parameter}")
+        register_info = self.CONFIG_REGISTERS[parameter]
+        
+        if not register_info.get('writable', False):
+            raise ValueError(f"Parameter {parameter} is read-only")
+        
+        # Parse and validate value
+        try:
+            value = int(payload)
+        except ValueError:
+            # Try to parse as string for named values
+            if 'values' in register_info:
+                reverse_values = {v: k for k, v in register_info['values'].items()}
+                if payload in reverse_values:
+                    value = reverse_values[payload]
                 else:
-                    raise ValueError(f"Invalid numeric value: {payload}")
-            
-            # Validate range
-            if 'min_value' in register_info and value < register_info['min_value']:
-                raise ValueError(f"Value {value} below minimum {register_info['min_value']}")
-            if 'max_value' in register_info and value > register_info['max_value']:
-                raise ValueError(f"Value {value} above maximum {register_info['max_value']}")
-                
-            # Write to ModBus register
-            address = register_info['address']
-            log.info(f"Writing {parameter} = {value} to register 0x{address:04X}")
-            
-            self.modbus.write_register(address, value, functioncode=6)
-            time.sleep(0.1)  # Short delay after write
-            
-            # Verify write by reading back
-            read_value = self.modbus.read_register(address)
-            if read_value == value:
-                log.info(f"Successfully set {parameter} = {value}")
-                self.publish_parameter_status(parameter, value, "success")
+                    raise ValueError(f"Invalid value '{payload}' for parameter {parameter}")
             else:
-                log.error(f"Verification failed: wrote {value}, read {read_value}")
-                self.publish_parameter_status(parameter, read_value, "verification_failed")
-                
+                raise ValueError(f"Invalid numeric value: {payload}")
+        
+        # Validate range
+        if 'min_value' in register_info and value < register_info['min_value']:
+            raise ValueError(f"Value {value} below minimum {register_info['min_value']}")
+        if 'max_value' in register_info and value > register_info['max_value']:
+            raise ValueError(f"Value {value} above maximum {register_info['max_value']}")
+        return value
+
+    def _register_groups(self, addresses):
+        """Split register addresses into runs of adjacent registers, as (start, count) tuples"""
+        groups = []
+        for address in sorted(set(addresses)):
+            if groups and address == groups[-1][0] + groups[-1][1] and groups[-1][1] < self.MAX_BLOCK_REGISTERS:
+                groups[-1][1] += 1
+            else:
+                groups.append([address, 1])
+        return [tuple(group) for group in groups]
+
+    def _read_addresses(self, addresses, priority):
+        """
+        Read registers with one block read per group of adjacent addresses.
+
+        A group the device rejects with an exception response is retried register
+        by register; any other error fails the whole group.
+
+        Returns:
+            (address -> value, address -> error message)
+        """
+        registers, failed = {}, {}
+        for start, count in self._register_groups(addresses):
+            try:
+                words = self.bus.read_registers(start, count, priority=priority)
+                registers.update(zip(range(start, start + count), words))
+                self._update_cache(zip(range(start, start + count), words))
+                continue
+            except minimalmodbus.IllegalRequestError as e:
+                # The block may span a register this device lacks
+                if count == 1:
+                    failed[start] = str(e)
+                    continue
+                log.warning(f"Block read 0x{start:04X}+{count} failed ({e}), reading registers individually")
+            except Exception as e:
+                # A timeout or a lost port would fail every single-register retry as well
+                for address in range(start, start + count):
+                    failed[address] = str(e)
+                continue
+            for address in range(start, start + count):
+                try:
+                    registers[address] = self.bus.read_register(address, priority=priority)
+                    self._update_cache([(address, registers[address])])
+                except Exception as e:
+                    failed[address] = str(e)
+        return registers, failed
+
+    def _update_cache(self, items):
+        now = time.monotonic()
+        with self._cache_lock:
+            for address, value in items:
+                self._cache[address] = (value, now)
+
+    def invalidate_cache(self, addresses=None):
+        """Forget cached values (all of them by default), e.g. after a failed write or a device change"""
+        with self._cache_lock:
+            if addresses is None:
+                self._cache.clear()
+            else:
+                for address in addresses:
+                    self._cache.pop(address, None)
+
+    def cached_value(self, parameter: str):
+        """
+        Returns:
+            (value, age in seconds) from the cache, or None if the parameter has not been read yet
+        """
+        with self._cache_lock:
+            entry = self._cache.get(self.CONFIG_REGISTERS[parameter]['address'])
+        if entry is None:
+            return None
+        word, read_at = entry
+        return self._field_value(parameter, word), time.monotonic() - read_at
+
+    def _field_value(self, parameter, word):
+        """Value of a parameter in the word read from its register"""
+        mask, shift = register_field(self.CONFIG_REGISTERS[parameter])
+        return (word & mask) >> shift
+
+    def _with_field(self, parameter, word, value):
+        """Register word with a parameter's bits replaced by value"""
+        mask, shift = register_field(self.CONFIG_REGISTERS[parameter])
+        return (word & ~mask & 0xFFFF) | ((value << shift) & mask)
+
+    def refresh_cache(self):
+        """
+        Re-read every config register from the device in as few block reads as possible.
+
+        Returns:
+            (parameter -> value, parameter -> error message)
+        """
+        values, errors = self.read_parameters(self.CONFIG_REGISTERS)
+        if errors:
+            log.warning(f"Config cache refresh: {len(errors)} parameter(s) could not be read")
+        log.info(f"Config cache refreshed with {len(values)} parameters")
+        return values, errors
+
+    def _write_group(self, start, words):
+        """Write adjacent registers with FC16, or FC06 per register if the device lacks FC16"""
+        if len(words) > 1 and self.fc16_supported is not False:
+            try:
+                self.bus.write_registers(start, words, priority=PRIORITY_CONFIG_WRITE,
+                                         settle=self.WRITE_SETTLE_SECONDS)
+                self.fc16_supported = True
+                return
+            except minimalmodbus.IllegalRequestError as e:
+                if 'illegal function' not in str(e):
+                    raise
+                log.info("Device does not support Write Multiple Registers (FC16), falling back to FC06")
+                self.fc16_supported = False
+        for offset, word in enumerate(words):
+            # Only the last write of the group needs to settle before the verifying read
+            settle = self.WRITE_SETTLE_SECONDS if offset == len(words) - 1 else 0.0
+            self.bus.write_register(start + offset, word, priority=PRIORITY_CONFIG_WRITE, settle=settle)
+
+    def read_parameters(self, parameters, priority=PRIORITY_ON_DEMAND):
+        """
+        Read several parameters with as few transactions as possible.
+
+        Returns:
+            (parameter -> value, parameter -> error message)
+        """
+        addresses = {parameter: self.CONFIG_REGISTERS[parameter]['address'] for parameter in parameters}
+        registers, failed = self._read_addresses(addresses.values(), priority)
+        values, errors = {}, {}
+        for parameter, address in addresses.items():
+            if address in registers:
+                values[parameter] = self._field_value(parameter, registers[address])
+            else:
+                errors[parameter] = failed.get(address, 'not read')
+        return values, errors
+
+    def write_parameters(self, values: Dict[str, int]) -> Dict[str, tuple]:
+        """
+        Write validated parameter values and verify them.
+
+        Adjacent registers are written in one request and verified with one
+        block read per group instead of a write, sleep and read-back each.
+        Parameters sharing a register as bit fields ('mask') are merged into one
+        word; bits of such a register that are not being set are read from the
+        device first and written back unchanged. Parameters claiming the same
+        bits cannot be set together and are reported as errors.
+
+        Returns:
+            parameter -> (status, value read back or None)
+        """
+        fields = {}
+        for parameter, value in values.items():
+            fields.setdefault(self.CONFIG_REGISTERS[parameter]['address'], []).append((parameter, value))
+
+        write_errors = {}
+        for address, items in fields.items():
+            if self._overlapping([parameter for parameter, _ in items]):
+                names = ', '.join(parameter for parameter, _ in items)
+                write_errors[address] = f"{names} share register 0x{address:04X}, set one at a time"
+        fields = {address: items for address, items in fields.items() if address not in write_errors}
+        partial = [address for address, items in fields.items()
+                   if self._covered_bits(parameter for parameter, _ in items) != 0xFFFF]
+        current, failed = self._read_addresses(partial, PRIORITY_CONFIG_WRITE) if partial else ({}, {})
+        by_address = {}
+        for address, items in fields.items():
+            if address in partial and address not in current:
+                write_errors[address] = f"read before write failed: {failed.get(address)}"
+                continue
+            word = current.get(address, 0)
+            for parameter, value in items:
+                word = self._with_field(parameter, word, value)
+            by_address[address] = word
+
+        for start, count in self._register_groups(by_address):
+            log.info(f"Writing {count} register(s) at 0x{start:04X}")
+            try:
+                self._write_group(start, [by_address[address] for address in range(start, start + count)])
+            except Exception as e:
+                for address in range(start, start + count):
+                    write_errors[address] = str(e)
+
+        registers, failed = self._read_addresses([a for a in by_address if a not in write_errors],
+                                                 PRIORITY_CONFIG_WRITE)
+        self.invalidate_cache([a for a in fields if a not in registers])
+        results = {}
+        for parameter, value in values.items():
+            address = self.CONFIG_REGISTERS[parameter]['address']
+            if address in write_errors:
+                results[parameter] = (f"error: {write_errors[address]}", None)
+            elif address not in registers:
+                results[parameter] = (f"error: verification read failed: {failed.get(address)}", None)
+            elif self._field_value(parameter, registers[address]) == value:
+                results[parameter] = ("success", value)
+            else:
+                read_value = self._field_value(parameter, registers[address])
+                log.error(f"Verification failed for {parameter}: wrote {value}, read {read_value}")
+                results[parameter] = ("verification_failed", read_value)
+        return results
+
+    def _overlapping(self, parameters):
+        """True if any two of the parameters claim the same bits of a register"""
+        bits = 0
+        for parameter in parameters:
+            mask = register_field(self.CONFIG_REGISTERS[parameter])[0]
+            if bits & mask:
+                return True
+            bits |= mask
+        return False
+
+    def _covered_bits(self, parameters):
+        """Bits of a register set by writing the given parameters"""
+        bits = 0
+        for parameter in parameters:
+            bits |= register_field(self.CONFIG_REGISTERS[parameter])[0]
+        return bits
+
+    def apply_parameters(self, requested: Dict[str, Any]) -> Dict[str, str]:
+        """
+        Validate and write a set of parameters in bulk, publishing each parameter's status.
+
+        Returns:
+            parameter -> status
+        """
+        values, results = {}, {}
+        for parameter, payload in requested.items():
+            try:
+                values[parameter] = self.parse_parameter_value(parameter, str(payload))
+            except ValueError as e:
+                log.error(f"Error setting parameter {parameter}: {e}")
+                results[parameter] = f"error: {str(e)}"
+                self.publish_parameter_status(parameter, None, results[parameter])
+
+        if values:
+            for parameter, (status, read_value) in self.write_parameters(values).items():
+                if status == "success":
+                    log.info(f"Successfully set {parameter} = {read_value}")
+                results[parameter] = status
+                self.publish_parameter_status(parameter, read_value, status)
+        return results
+
+    def handle_parameter_set(self, parameter: str, payload: str):
+        """Handle setting a single parameter"""
+        try:
+            self.apply_parameters({parameter: payload})
         except Exception as e:
             log.error(f"Error setting parameter {parameter}: {e}")
             self.publish_parameter_status(parameter, None, f"error: {str(e)}")
 
-    def handle_parameter_get(self, parameter: str):
-        """Handle getting a single parameter"""
+    @staticmethod
+    def _display_value(register_info, value):
+        """Convert to human-readable if possible"""
+        if 'values' in register_info and value in register_info['values']:
+            return f"{value} ({register_info['values'][value]})"
+        return value
+
+    def handle_parameter_get(self, parameter: str, refresh: bool = False):
+        """Handle getting a single parameter, from the cache unless refresh is requested"""
         try:
             if parameter not in self.CONFIG_REGISTERS:
                 raise ValueError(f"Unknown parameter: {parameter}")
@@ -289,15 +739,19 @@ class EM340ConfigManager:
             register_info = self.CONFIG_REGISTERS[parameter]
             address = register_info['address']
             
-            value = self.modbus.read_register(address)
-            log.info(f"Read {parameter} = {value} from register 0x{address:04X}")
+            cached = None if refresh else self.cached_value(parameter)
+            if cached is not None:
+                value, age = cached
+                source = "cache"
+            else:
+                word = self.bus.read_register(address, priority=PRIORITY_ON_DEMAND)
+                self._update_cache([(address, word)])
+                value = self._field_value(parameter, word)
+                age, source = 0.0, "device"
+                log.info(f"Read {parameter} = {value} from register 0x{address:04X}")
             
-            # Convert to human-readable if possible
-            display_value = value
-            if 'values' in register_info and value in register_info['values']:
-                display_value = f"{value} ({register_info['values'][value]})"
-                
-            self.publish_parameter_value(parameter, value, display_value)
+            self.publish_parameter_value(parameter, value, self._display_value(register_info, value),
+                                         age=age, source=source)
             
         except Exception as e:
             log.error(f"Error getting parameter {parameter}: {e}")
@@ -307,17 +761,9 @@ class EM340ConfigManager:
         """Handle batch configuration set"""
         try:
             config_data = json.loads(payload)
-            results = {}
             
             log.info(f"Processing batch configuration: {len(config_data)} parameters")
-            
-            for parameter, value in config_data.items():
-                try:
-                    self.handle_parameter_set(parameter, str(value))
-                    results[parameter] = "success"
-                except Exception as e:
-                    results[parameter] = f"error: {str(e)}"
-                    log.error(f"Batch set error for {parameter}: {e}")
+            results = self.apply_parameters(config_data)
                     
             # Publish batch results
             self.publish_batch_result(results)
@@ -329,24 +775,37 @@ class EM340ConfigManager:
             log.error(f"Error in batch configuration: {e}")
             self.publish_error(f"Batch configuration error: {str(e)}")
 
+    def handle_refresh(self):
+        """Re-read all parameters from the device and publish their values"""
+        try:
+            values, errors = self.refresh_cache()
+            for parameter, value in values.items():
+                register_info = self.CONFIG_REGISTERS[parameter]
+                self.publish_parameter_value(parameter, value, self._display_value(register_info, value),
+                                             age=0.0, source="device")
+            for parameter, error in errors.items():
+                self.publish_parameter_status(parameter, None, f"error: {error}")
+            self.publish_status(f"Refreshed {len(values)} parameters, {len(errors)} errors")
+        except Exception as e:
+            log.error(f"Error refreshing configuration: {e}")
+            self.publish_error(f"Refresh error: {str(e)}")
+
     def handle_backup(self):
         """Create a backup of current configuration"""
         try:
             backup_data = {}
+            values, errors = self.read_parameters(self.CONFIG_REGISTERS)
             
             for parameter, register_info in self.CONFIG_REGISTERS.items():
-                try:
-                    address = register_info['address']
-                    value = self.modbus.read_register(address)
+                if parameter in values:
                     backup_data[parameter] = {
-                        'value': value,
-                        'address': f"0x{address:04X}",
+                        'value': values[parameter],
+                        'address': f"0x{register_info['address']:04X}",
                         'description': register_info.get('description', '')
                     }
-                    time.sleep(0.05)  # Small delay between reads
-                except Exception as e:
-                    log.warning(f"Could not backup parameter {parameter}: {e}")
-                    backup_data[parameter] = {'error': str(e)}
+                else:
+                    log.warning(f"Could not backup parameter {parameter}: {errors[parameter]}")
+                    backup_data[parameter] = {'error': errors[parameter]}
             
             # Add metadata
             backup_data['_metadata'] = {
@@ -375,9 +834,7 @@ class EM340ConfigManager:
             if '_metadata' not in backup_data:
                 raise ValueError("Invalid backup format: missing metadata")
                 
-            restored = 0
-            errors = 0
-            
+            requested = {}
             for parameter, data in backup_data.items():
                 if parameter.startswith('_'):
                     continue  # Skip metadata
@@ -386,13 +843,11 @@ class EM340ConfigManager:
                     log.warning(f"Skipping parameter {parameter}: backup contains error")
                     continue
                     
-                try:
-                    value = data['value']
-                    self.handle_parameter_set(parameter, str(value))
-                    restored += 1
-                except Exception as e:
-                    log.error(f"Error restoring parameter {parameter}: {e}")
-                    errors += 1
+                requested[parameter] = data['value']
+            
+            results = self.apply_parameters(requested)
+            restored = sum(1 for status in results.values() if status == "success")
+            errors = len(results) - restored
             
             log.info(f"Restore completed: {restored} parameters restored, {errors} errors")
             self.publish_status(f"Restore completed: {restored} restored, {errors} errors")
@@ -417,14 +872,9 @@ class EM340ConfigManager:
                 'ct_secondary': 5           # 5A secondary (1:1)
             }
             
-            reset_count = 0
-            for parameter, default_value in factory_defaults.items():
-                if parameter in self.CONFIG_REGISTERS:
-                    try:
-                        self.handle_parameter_set(parameter, str(default_value))
-                        reset_count += 1
-                    except Exception as e:
-                        log.error(f"Error resetting parameter {parameter}: {e}")
+            results = self.apply_parameters({parameter: value for parameter, value in factory_defaults.items()
+                                             if parameter in self.CONFIG_REGISTERS})
+            reset_count = sum(1 for status in results.values() if status == "success")
             
             log.info(f"Factory reset completed: {reset_count} parameters reset")
             self.publish_status(f"Factory reset completed: {reset_count} parameters reset")
@@ -470,13 +920,16 @@ class EM340ConfigManager:
         payload = json.dumps(status_data)
         self.config_mqtt_client.publish(status_topic, payload)
 
-    def publish_parameter_value(self, parameter: str, value: int, display_value: Union[int, str]):
-        """Publish parameter current value"""
+    def publish_parameter_value(self, parameter: str, value: int, display_value: Union[int, str],
+                                age: float = 0.0, source: str = "device"):
+        """Publish parameter current value with the age of the reading"""
         value_topic = f"{self.config_topic_base}/{parameter}/value"
         value_data = {
             'parameter': parameter,
             'value': value,
             'display_value': str(display_value),
+            'age_s': round(age, 1),
+            'source': source,
             'timestamp': time.time()
         }
         payload = json.dumps(value_data)
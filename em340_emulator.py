@@ -0,0 +1,520 @@
+#!/usr/bin/env python
+"""
+EM340 ModBus RTU slave emulator
+Serves the sensor register map from em340.yaml and the configuration registers of
+EM340ConfigManager over a pseudo-terminal, with time-varying measurements and
+configurable fault injection, so the gateway can be tested without a physical meter
+
+Usage:
+    python em340_emulator.py --config em340.yaml.template --slaves 1-32 --link /tmp/ttyEM340
+    kill -USR1 <pid>    # simulate unplugging / replugging the USB adapter
+"""
+import argparse
+import math
+import os
+import random
+import select
+import signal
+import sys
+import threading
+import time
+import tty
+
+from config_loader import ConfigError, get_config
+from em340_config_manager import EM340ConfigManager, register_field
+from modbus_codec import (ILLEGAL_DATA_ADDRESS, ILLEGAL_DATA_VALUE, ILLEGAL_FUNCTION, READ_FUNCTION_CODES,
+                          SLAVE_DEVICE_FAILURE, WRITE_MULTIPLE_REGISTERS, WRITE_SINGLE_REGISTER, FrameError,
+                          build_exception_response, build_read_request, build_read_response,
+                          build_write_multiple_response, check_crc, parse_request, request_length)
+
+# Plausible steady-state readings per device class, in engineering units,
+# used for configured sensors outside the modelled EM340 measurement table
+DEFAULT_VALUES = {
+    'voltage': 230.0,
+    'current': 5.0,
+    'power': 1150.0,
+    'power_factor': 0.98,
+    'energy': 12345.6,
+}
+
+# Gap of silence after which a partial frame is discarded (well above 3.5 chars at 9600 baud)
+FRAME_RESET_TIMEOUT = 0.02
+
+# Address ranges the EM340 answers without an exception (instantaneous variables and meters)
+MEASUREMENT_RANGE = range(0x0000, 0x0080)
+
+# EM340 limit for function codes 03/04 ("1 to 14h" in the ModBus manual)
+MAX_READ_REGISTERS = 20
+
+# Factory settings of the configuration registers that are not 0
+CONFIG_DEFAULTS = {
+    'measuring_system': 0,
+    'measurement_mode': 0,
+    'pt_primary': 400,
+    'pt_secondary': 400,
+    'ct_primary': 5,
+    'ct_secondary': 5,
+}
+
+def encode_value(value_type, value):
+    """
+    Encode an integer into register words using the EM340 LSW-first word order.
+
+    Returns:
+        List of 16-bit register values
+    """
+    count = {'INT16': 1, 'UINT16': 1, 'INT32': 2, 'UINT32': 2, 'INT64': 4, 'UINT64': 4}[value_type]
+    value &= (1 << (16 * count)) - 1  # two's complement for negative values
+    return [(value >> (16 * i)) & 0xFFFF for i in range(count)]
+
+class ModbusException(Exception):
+    """Request rejected by the emulated meter with a ModBus exception code"""
+
+    def __init__(self, code):
+        Exception.__init__(self, f'ModBus exception 0x{code:02X}')
+        self.code = code
+
+class FaultConfig:
+    """Fault injection settings shared by all emulated slaves"""
+
+    def __init__(self, turnaround_ms=0.0, jitter_ms=0.0, crc_error_rate=0.0, drop_rate=0.0,
+                 exception_rate=0.0, failing_addresses=None, max_registers=MAX_READ_REGISTERS,
+                 support_fc16=False):
+        self.turnaround_ms = turnaround_ms        # delay between request and response
+        self.jitter_ms = jitter_ms                # uniform random extra delay
+        self.crc_error_rate = crc_error_rate      # probability of a corrupted response CRC
+        self.drop_rate = drop_rate                # probability of not answering at all
+        self.exception_rate = exception_rate      # probability of a "slave device failure" response
+        self.failing_addresses = dict(failing_addresses or {})  # address -> exception code
+        self.max_registers = max_registers        # per-request read limit
+        self.support_fc16 = support_fc16          # the real EM340 rejects Write Multiple Registers
+
+class MeterModel:
+    """
+    Register map of one emulated meter.
+
+    Measurements follow a slowly varying three-phase load so consecutive polls
+    return different but physically consistent values; energy counters integrate
+    the active power over time.
+    """
+
+    def __init__(self, sensors, serial_number='235411W', seed=None):
+        self.random = random.Random(seed)
+        self.phase_offset = self.random.uniform(0, 2 * math.pi)
+        self.start_time = time.monotonic()
+        self.energy_import_kwh = 12345.6 + self.random.uniform(0, 1000)
+        self.energy_export_kwh = 321.0 + self.random.uniform(0, 100)
+        self._last_update = self.start_time
+        self.lock = threading.Lock()
+
+        # Parameters sharing a register (bit fields) each contribute their bits
+        self.config = {}
+        self.config_info = {}
+        for name, info in EM340ConfigManager.CONFIG_REGISTERS.items():
+            mask, shift = register_field(info)
+            value = CONFIG_DEFAULTS.get(name, info.get('min_value', 0))
+            self.config[info['address']] = self.config.get(info['address'], 0) | ((value << shift) & mask)
+            self.config_info.setdefault(info['address'], []).append(info)
+
+        # Identification registers: firmware version/revision, serial number (ASCII in LSB), production year
+        self.static = {0x0302: 1, 0x0303: 2, 0x5010: 2023}
+        for i, char in enumerate(serial_number[:7].ljust(7)):
+            self.static[0x5000 + i] = ord(char)
+
+        # Configured sensors outside the physical model get a constant plausible value
+        self.fallback = {}
+        for sensor in sensors:
+            value_type = sensor.get('value_type', 'INT16')
+            multiply = float(sensor.get('multiply', 1)) or 1.0
+            value = DEFAULT_VALUES.get(sensor.get('device_class'), 0.0)
+            for offset, word in enumerate(encode_value(value_type, int(round(value / multiply)))):
+                self.fallback[sensor['address'] + offset] = word
+
+    @property
+    def measuring_system(self):
+        return self.config.get(0x1002, 0)
+
+    def measurements(self, now=None):
+        """
+        Compute the instantaneous measurement registers.
+
+        Returns:
+            Dictionary of register address -> 16-bit word
+        """
+        now = time.monotonic() if now is None else now
+        t = now - self.start_time
+        rnd = self.random
+        phases = {2: 2, 3: 1}.get(self.measuring_system, 3)  # 2-phase 3-wire, 1-phase (EM330)
+
+        volts, amps, pfs = [], [], []
+        for phase in range(3):
+            if phase >= phases:
+                volts.append(0.0)
+                amps.append(0.0)
+                pfs.append(0.0)
+                continue
+            angle = self.phase_offset + phase * 2 * math.pi / 3
+            volts.append(230.0 + 2.0 * math.sin(2 * math.pi * t / 60 + angle) + rnd.uniform(-0.3, 0.3))
+            amps.append(max(0.0, 5.0 * (1 + 0.5 * math.sin(2 * math.pi * t / 300 + angle)) + rnd.uniform(-0.05, 0.05)))
+            pfs.append(0.97 + 0.02 * math.sin(2 * math.pi * t / 120 + angle))
+
+        apparent = [v * a for v, a in zip(volts, amps)]
+        active = [s * pf for s, pf in zip(apparent, pfs)]
+        reactive = [math.sqrt(max(0.0, s * s - p * p)) for s, p in zip(apparent, active)]
+        line = [v * math.sqrt(3) if phases > 1 and v else 0.0 for v in volts]
+        p_sys, s_sys, q_sys = sum(active), sum(apparent), sum(reactive)
+
+        with self.lock:
+            self.energy_import_kwh += p_sys / 1000.0 * (now - self._last_update) / 3600.0
+            self._last_update = now
+            energy_import = self.energy_import_kwh
+
+        values = {}
+        def put(address, value_type, value):
+            for offset, word in enumerate(encode_value(value_type, int(round(value)))):
+                values[address + offset] = word
+
+        for phase in range(3):
+            put(0x0000 + 2 * phase, 'INT32', volts[phase] * 10)
+            put(0x0006 + 2 * phase, 'INT32', line[phase] * 10)
+            put(0x000C + 2 * phase, 'INT32', amps[phase] * 1000)
+            put(0x0012 + 2 * phase, 'INT32', active[phase] * 10)
+            put(0x0018 + 2 * phase, 'INT32', apparent[phase] * 10)
+            put(0x001E + 2 * phase, 'INT32', reactive[phase] * 10)
+            put(0x002E + phase, 'INT16', pfs[phase] * 1000)
+        put(0x0024, 'INT32', sum(volts) / phases * 10)
+        put(0x0026, 'INT32', sum(line) / phases * 10)
+        put(0x0028, 'INT32', p_sys * 10)
+        put(0x002A, 'INT32', s_sys * 10)
+        put(0x002C, 'INT32', q_sys * 10)
+        put(0x0031, 'INT16', p_sys / s_sys * 1000 if s_sys else 1000)
+        put(0x0032, 'INT16', 0)
+        put(0x0033, 'INT16', (50.0 + rnd.uniform(-0.05, 0.05)) * 10)
+        put(0x0034, 'INT32', energy_import * 10)
+        put(0x004E, 'INT32', self.energy_export_kwh * 10)
+        return values
+
+    def read(self, address, count, faults):
+        """
+        Read count registers starting at address.
+
+        Raises:
+            ModbusException: Illegal quantity or address, as the real meter would report
+        """
+        if not 1 <= count <= faults.max_registers:
+            raise ModbusException(ILLEGAL_DATA_VALUE)
+        addresses = range(address, address + count)
+        for a in addresses:
+            if a in faults.failing_addresses:
+                raise ModbusException(faults.failing_addresses[a])
+
+        measurements = None
+        words = []
+        for a in addresses:
+            if a in MEASUREMENT_RANGE:
+                if measurements is None:
+                    measurements = self.measurements()
+                words.append(measurements.get(a, self.fallback.get(a, 0)))
+            elif a in self.config:
+                words.append(self.config[a])
+            elif a in self.static:
+                words.append(self.static[a])
+            elif a in self.fallback:
+                words.append(self.fallback[a])
+            else:
+                raise ModbusException(ILLEGAL_DATA_ADDRESS)
+        return words
+
+    def write(self, address, values):
+        """
+        Write holding registers; only configuration registers are writable.
+
+        Raises:
+            ModbusException: Address not writable or value out of range
+        """
+        for offset, value in enumerate(values):
+            infos = self.config_info.get(address + offset)
+            if not infos or not all(info.get('writable', False) for info in infos):
+                raise ModbusException(ILLEGAL_DATA_ADDRESS)
+            for info in infos:
+                mask, shift = register_field(info)
+                field = (value & mask) >> shift
+                if field < info.get('min_value', 0) or field > info.get('max_value', 0xFFFF):
+                    raise ModbusException(ILLEGAL_DATA_VALUE)
+        for offset, value in enumerate(values):
+            self.config[address + offset] = value
+
+class EM340Emulator(threading.Thread):
+    """
+    ModBus RTU bus with one or more emulated EM340 slaves on the master side of a pty pair.
+
+    When link_path is given, the gateway should open that symlink; unplug() removes it
+    and closes the pty so the gateway sees the same errors as with a pulled USB adapter.
+    foreign_reads emulates another master on the bus (e.g. a GoodWe inverter): every
+    foreign_interval seconds each (slave, address, count) read is put on the line as
+    a request and its response, as a sniffing gateway would hear them.
+    """
+
+    def __init__(self, sensors, slave_address=1, slave_addresses=None, faults=None,
+                 link_path=None, seed=None, foreign_reads=(), foreign_interval=1.0):
+        threading.Thread.__init__(self, daemon=True)
+        addresses = list(slave_addresses) if slave_addresses else [slave_address]
+        self.slave_address = addresses[0]
+        self.slaves = {}
+        for address in addresses:
+            serial_number = f'{235400 + address:06d}W'
+            self.slaves[address] = MeterModel(sensors, serial_number=serial_number,
+                                              seed=None if seed is None else seed + address)
+        self.faults = faults or FaultConfig()
+        self.random = random.Random(seed)
+        self.link_path = link_path
+        self.foreign_reads = list(foreign_reads)
+        self.foreign_interval = foreign_interval
+
+        self.requests_served = 0
+        self.foreign_exchanges = 0
+        self.frames_received = 0
+        self.crc_errors = 0
+        self.faults_injected = 0
+        self._lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self.master_fd = self.slave_fd = None
+        self._open_pty()
+
+    @property
+    def plugged(self):
+        return self.master_fd is not None
+
+    def _open_pty(self):
+        master_fd, slave_fd = os.openpty()
+        tty.setraw(slave_fd)
+        self.pty_name = os.ttyname(slave_fd)
+        if self.link_path:
+            tmp_link = f'{self.link_path}.tmp'
+            if os.path.lexists(tmp_link):
+                os.unlink(tmp_link)
+            os.symlink(self.pty_name, tmp_link)
+            os.replace(tmp_link, self.link_path)
+        with self._lock:
+            self.master_fd, self.slave_fd = master_fd, slave_fd
+        self.port = self.link_path or self.pty_name
+
+    def _close_pty(self):
+        with self._lock:
+            fds = (self.master_fd, self.slave_fd)
+            self.master_fd = self.slave_fd = None
+        for fd in fds:
+            if fd is not None:
+                try:
+                    os.close(fd)
+                except OSError:
+                    pass
+
+    def unplug(self):
+        """Simulate pulling the USB adapter: the device node vanishes and I/O fails."""
+        if self.link_path and os.path.lexists(self.link_path):
+            os.unlink(self.link_path)
+        self._close_pty()
+
+    def replug(self):
+        """Simulate reconnecting the adapter on a fresh pty behind the same link."""
+        if not self.plugged:
+            self._open_pty()
+
+    def run(self):
+        buffer = bytearray()
+        last_byte_time = time.monotonic()
+        next_foreign = time.monotonic()
+        while not self._stop_event.is_set():
+            master_fd = self.master_fd
+            if master_fd is None:
+                buffer.clear()
+                time.sleep(0.01)
+                continue
+            if self.foreign_reads and not buffer and time.monotonic() >= next_foreign:
+                self._send_foreign(master_fd)
+                next_foreign = time.monotonic() + self.foreign_interval
+            wait = min(0.05, max(0.0, next_foreign - time.monotonic())) if self.foreign_reads else 0.05
+            try:
+                readable, _, _ = select.select([master_fd], [], [], wait)
+                now = time.monotonic()
+                if buffer and now - last_byte_time > FRAME_RESET_TIMEOUT:
+                    buffer.clear()  # incomplete frame followed by silence - resynchronise
+                if not readable:
+                    continue
+                chunk = os.read(master_fd, 512)
+            except (OSError, ValueError):
+                buffer.clear()  # pty closed by unplug() or by the other side
+                time.sleep(0.01)
+                continue
+            buffer.extend(chunk)
+            last_byte_time = now
+
+            while True:
+                frame_length = request_length(buffer)
+                if frame_length is None or len(buffer) < frame_length:
+                    break
+                frame = bytes(buffer[:frame_length])
+                del buffer[:frame_length]
+                response = self.handle_frame(frame)
+                if response:
+                    self._send(master_fd, response)
+
+    def _send_foreign(self, master_fd):
+        """Put the other master's reads and the meter's answers on the line."""
+        for slave, address, count in self.foreign_reads:
+            request = build_read_request(slave, address, count)
+            try:
+                response = self._execute(self.slaves[slave], request)
+                os.write(master_fd, request)
+                time.sleep((len(request) + len(response)) * 11 / 9600)  # time on the wire at 9600 baud
+                os.write(master_fd, response)
+            except (ModbusException, OSError):
+                continue
+            self.foreign_exchanges += 1
+
+    def _send(self, master_fd, response):
+        faults = self.faults
+        delay = faults.turnaround_ms + (self.random.uniform(0, faults.jitter_ms) if faults.jitter_ms else 0)
+        if delay:
+            time.sleep(delay / 1000.0)
+        try:
+            os.write(master_fd, response)
+        except OSError:
+            pass
+
+    def stop(self):
+        """Stop serving requests and release the pty pair."""
+        self._stop_event.set()
+        if self.is_alive():
+            self.join(timeout=1.0)
+        self._close_pty()
+        if self.link_path and os.path.lexists(self.link_path):
+            os.unlink(self.link_path)
+
+    def handle_frame(self, frame):
+        """
+        Process one request frame, applying fault injection.
+
+        Returns:
+            Response frame bytes, or None when the request is not answered
+        """
+        self.frames_received += 1
+        if not check_crc(frame):
+            self.crc_errors += 1
+            return None
+        slave = frame[0]
+        model = self.slaves.get(slave)
+        if model is None:
+            return None  # another slave's request (or broadcast) - stay silent
+
+        faults, rnd = self.faults, self.random
+        if faults.drop_rate and rnd.random() < faults.drop_rate:
+            self.faults_injected += 1
+            return None
+        self.requests_served += 1
+        function_code = frame[1]
+        if faults.exception_rate and rnd.random() < faults.exception_rate:
+            self.faults_injected += 1
+            return self._exception(slave, function_code, SLAVE_DEVICE_FAILURE)
+
+        try:
+            response = self._execute(model, frame)
+        except ModbusException as err:
+            response = self._exception(slave, function_code, err.code)
+
+        if faults.crc_error_rate and rnd.random() < faults.crc_error_rate:
+            self.faults_injected += 1
+            response = response[:-1] + bytes((response[-1] ^ 0xFF,))
+        return response
+
+    def _execute(self, model, frame):
+        if frame[1] == 8:
+            return frame  # diagnostic echo (sub-function 00h)
+        try:
+            request = parse_request(frame)
+        except FrameError:
+            raise ModbusException(ILLEGAL_FUNCTION)
+        if request.function_code in READ_FUNCTION_CODES:
+            words = model.read(request.address, request.count, self.faults)
+            return build_read_response(request.slave, words, request.function_code)
+        if request.function_code == WRITE_SINGLE_REGISTER:
+            model.write(request.address, list(request.values))
+            return frame
+        if request.function_code == WRITE_MULTIPLE_REGISTERS and self.faults.support_fc16:
+            model.write(request.address, list(request.values))
+            return build_write_multiple_response(request.slave, request.address, request.count)
+        raise ModbusException(ILLEGAL_FUNCTION)
+
+    @staticmethod
+    def _exception(slave, function_code, code):
+        return build_exception_response(slave, function_code, code)
+
+def parse_slave_range(text):
+    """Parse a slave list such as "1", "1-32" or "1,5,7-9"."""
+    addresses = []
+    for part in text.split(','):
+        if '-' in part:
+            first, last = part.split('-', 1)
+            addresses.extend(range(int(first, 0), int(last, 0) + 1))
+        else:
+            addresses.append(int(part, 0))
+    return addresses
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Emulate EM340 meters on a pseudo-terminal')
+    parser.add_argument('--config', default='em340.yaml.template', help='YAML file providing the sensor register map')
+    parser.add_argument('--address', type=int, default=1, help='ModBus slave address')
+    parser.add_argument('--slaves', help='Slave addresses to emulate, e.g. 1-32 (overrides --address)')
+    parser.add_argument('--link', help='Symlink to create for the pty (needed to simulate unplugging)')
+    parser.add_argument('--latency-ms', type=float, default=0.0, help='Turnaround latency')
+    parser.add_argument('--jitter-ms', type=float, default=0.0, help='Random extra turnaround latency')
+    parser.add_argument('--crc-error-rate', type=float, default=0.0, help='Probability of a corrupted response')
+    parser.add_argument('--drop-rate', type=float, default=0.0, help='Probability of a missing response')
+    parser.add_argument('--exception-rate', type=float, default=0.0, help='Probability of an exception response')
+    parser.add_argument('--fail-address', action='append', default=[],
+                        help='Register that answers with illegal data address, e.g. 0x0034 (repeatable)')
+    parser.add_argument('--max-registers', type=int, default=MAX_READ_REGISTERS, help='Per-request read limit')
+    parser.add_argument('--fc16', action='store_true', help='Accept Write Multiple Registers (not supported by EM340)')
+    parser.add_argument('--seed', type=int, help='Random seed for reproducible runs')
+    parser.add_argument('--foreign-read', action='append', default=[],
+                        help='Read of another master put on the line, as ADDRESS:COUNT, e.g. 0x0000:20 (repeatable)')
+    parser.add_argument('--foreign-interval', type=float, default=1.0,
+                        help='Seconds between the other master\'s read cycles')
+    args = parser.parse_args()
+
+    try:
+        config = get_config(args.config)
+    except ConfigError as e:
+        parser.error(str(e))
+    faults = FaultConfig(turnaround_ms=args.latency_ms, jitter_ms=args.jitter_ms,
+                         crc_error_rate=args.crc_error_rate, drop_rate=args.drop_rate,
+                         exception_rate=args.exception_rate,
+                         failing_addresses={int(a, 0): ILLEGAL_DATA_ADDRESS for a in args.fail_address},
+                         max_registers=args.max_registers, support_fc16=args.fc16)
+    slaves = parse_slave_range(args.slaves) if args.slaves else [args.address]
+    foreign_reads = [(slaves[0], int(address, 0), int(count, 0))
+                     for address, count in (read.split(':', 1) for read in args.foreign_read)]
+    emulator = EM340Emulator(config['sensor'], slave_addresses=slaves, faults=faults,
+                             link_path=args.link, seed=args.seed, foreign_reads=foreign_reads,
+                             foreign_interval=args.foreign_interval)
+
+    def toggle_plug(signum, frame):
+        if emulator.plugged:
+            emulator.unplug()
+        else:
+            emulator.replug()
+    signal.signal(signal.SIGUSR1, toggle_plug)
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+
+    emulator.start()
+    # First line of output is the device path for the gateway under test
+    print(emulator.port, flush=True)
+    try:
+        while emulator.is_alive():
+            time.sleep(1)
+    except (KeyboardInterrupt, SystemExit):
+        pass
+    finally:
+        emulator.stop()
+    sys.exit(0)
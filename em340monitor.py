@@ -2,332 +2,301 @@ import threading
 import queue
 import serial
 import datetime
-from datetime import timedelta
 import yaml # pip install PyYAML
 import sys
-from logger import log
+from logger import log, setup_logging
+from config_loader import get_config
 import paho.mqtt.client as mqtt
 import json
+import logging
 import time
+from typing import NamedTuple
+from frame_capture import DIRECTION_BUS, CaptureWriter
+from modbus_codec import READ_FUNCTION_CODES
+from modbus_sniffer import ModbusSniffer, character_time_ns
+from poll_plan import VALUE_TYPE_REGISTERS, decode_value
 
 start_time = datetime.datetime.now()
 
 #read_buffer = bytearray()
 
 class MqttSender(threading.Thread):
+    """
+    Publishes the cycle snapshots queued by ModBusParser.
+
+    The paho network loop reconnects on its own. Whatever is queued is taken as
+    one batch; while the broker is unreachable only the newest snapshot is
+    kept and sent after reconnecting, so consumers never get a burst of old cycles.
+    """
+    OFFLINE_CHECK_INTERVAL = 1.0  # seconds between queue drains while disconnected
+
     def __init__(self, mqtt_queue, config):
-        threading.Thread.__init__(self)
+        threading.Thread.__init__(self, daemon=True)
         self.mqtt_queue = mqtt_queue
         self.config = config
         self.topic = self.config['mqtt']['topic'] + '/' + self.config['config']['name']
-        self.client = mqtt.Client()
+        self.connected = threading.Event()
+        self.published = 0  # snapshots the client accepted for sending
+        self.superseded = 0  # snapshots replaced by a newer one before they could be sent
+        self.publish_errors = 0
+        self.client = mqtt.Client(callback_api_version=mqtt.CallbackAPIVersion.VERSION2)
         self.client.username_pw_set(self.config['mqtt']['username'], self.config['mqtt']['password'])
-        self.client.connect(self.config['mqtt']['broker'], self.config['mqtt']['port'], 60)
-        log.info(f'Connected to MQTT broker: {self.config["mqtt"]["broker"]}:{self.config["mqtt"]["port"]}')
+        self.client.on_connect = self.on_connect
+        self.client.on_disconnect = self.on_disconnect
+        self.client.reconnect_delay_set(min_delay=2, max_delay=30)
+        self.client.connect_async(self.config['mqtt']['broker'], self.config['mqtt']['port'], 60)
+        self.client.loop_start()
+
+    def on_connect(self, client, userdata, flags, reason_code, properties=None):
+        if reason_code == 0:
+            log.info(f'Connected to MQTT broker: {self.config["mqtt"]["broker"]}:{self.config["mqtt"]["port"]}')
+            self.connected.set()
+        else:
+            log.error(f'Failed to connect to MQTT broker, return code {reason_code}')
+
+    def on_disconnect(self, client, userdata, flags, reason_code, properties=None):
+        self.connected.clear()
+        log.warning(f'MQTT broker connection lost ({reason_code}), reconnecting')
+
+    def take_queued(self, block):
+        """Take everything queued, first waiting for one snapshot if block is set."""
+        batch = [self.mqtt_queue.get()] if block else []
+        while True:
+            try:
+                batch.append(self.mqtt_queue.get_nowait())
+            except queue.Empty:
+                return batch
 
     def run(self):
+        pending = []
         while True:
+            pending.extend(self.take_queued(block=not pending))
+            if not self.connected.is_set():
+                self.superseded += len(pending) - 1
+                pending = pending[-1:]
+                self.connected.wait(self.OFFLINE_CHECK_INTERVAL)
+                continue
+            pending = self.publish_batch(pending)
+
+    def publish_batch(self, pending):
+        """
+        Publish snapshots; paho does not raise when offline but returns an error code.
+
+        Returns:
+            Snapshots to send after reconnecting: the newest one if the connection
+            dropped during the batch
+        """
+        for index, data in enumerate(pending):
             try:
-                data = self.mqtt_queue.get()
-                topic = self.topic + '/'
-                topic += data['subtopic'] if 'subtopic' in data else 'unkwnown'
-                log.debug(f'topic: {topic}, data: {data}')
-                self.client.publish(topic, json.dumps(data))
-                #self.mqtt_queue.task_done()
+                rc = self.client.publish(self.topic, json.dumps(data)).rc
             except Exception as e:
+                rc = None
                 log.error(f'Error publishing to MQTT broker: {e}')
-                pass
-
-# in GoodWe ModBus described CRC ：X^16+X^12+X^5+1
-# ModBus standard: 0xA001
-
-def calculate_crc16(data):
-    crc = 0xFFFF
-    for byte in data:
-        crc = crc ^ byte
-        for i in range(8):
-            last_bit = crc & 0x0001
-            crc = crc >> 1
-            if last_bit == 0x0001:
-                crc = crc ^ 0xA001
-#    log.info('crc: {}'.format(hex(crc)))
-    #return crc
-    return crc
-
-def calculate_modbus_crc(data: bytes):
-  """Calculates the Modbus CRC16 checksum of a byte array.
-
-  Args:
-    data: A byte array.
-
-  Returns:
-    A 16-bit CRC checksum.
-  """
-
-  crc = 0xFFFF
-  for byte in data:
-    crc ^= byte
-    for i in range(8):
-      if (crc & 0x0001) != 0:
-        crc = (crc >> 1) ^ 0xA001
-      else:
-        crc >>= 1
-  return crc
+            if rc == mqtt.MQTT_ERR_SUCCESS:
+                self.published += 1
+            elif rc == mqtt.MQTT_ERR_NO_CONN:
+                self.connected.clear()  # on_connect sets it again
+                self.superseded += len(pending) - index - 1
+                return pending[-1:]
+            else:
+                self.publish_errors += 1
+                if rc is not None:
+                    log.error(f'Error publishing to MQTT broker: {mqtt.error_string(rc)}')
+        return []
+
+# Largest chunk taken from the serial driver in one read() call
+READ_CHUNK_SIZE = 256
 
 class SerialReader(threading.Thread):
-    def __init__(self, port, baudrate, timeout, stopbits, recv_queue):
-        threading.Thread.__init__(self)
+    """
+    Reads the RS-485 line in chunks and queues (monotonic_ns, bytes) per chunk.
+
+    read() returns once the line has been silent for 1.5 characters (the ModBus
+    t1.5 inter-character limit), so a chunk is usually one whole frame; the
+    timestamp is taken when the chunk is complete.
+    """
+
+    def __init__(self, port, baudrate, timeout, stopbits, recv_queue, capture=None):
+        threading.Thread.__init__(self, daemon=True)
         self.port = port
         self.baudrate = baudrate
         self.timeout = timeout
         self.stopbits = stopbits
         self.recv_queue = recv_queue
-        #self.start_time = datetime.datetime.now()
-        #self.last_character_time = self.start_time
-        #self.read_buffer = bytearray()
+        self.capture = capture  # optional frame_capture.CaptureWriter for tools/bus_analyzer.py
+        self.inter_byte_timeout = 1.5 * character_time_ns(baudrate) / 1e9
+        self.chunks = 0
+        self.bytes_read = 0
+        self._stop_event = threading.Event()
+
+    def stop(self):
+        self._stop_event.set()
 
     def run(self):
-        with serial.Serial(port=self.port, baudrate=self.baudrate, timeout=self.timeout, stopbits=self.stopbits) as ser:
-            while True:
-                x = ser.read()
-                current_time = datetime.datetime.now()
-                #relative_time_from_start = current_time - self.start_time
-                #last_character_delay = current_time - self.last_character_time
-                for c in x:
-                    #self.read_buffer.append(c)
-                    self.recv_queue.put((current_time, c))
-                    self.last_character_time = current_time
-
-from enum import IntEnum, unique
-@unique
-class ModBus_Parser_Status(IntEnum): # IntEnum or Enum, for Enum comparisons does not work well
-    MODBUS_PARSER_WAITING_FOR_MASTER_REQUEST = 1
-#    MODBUS_PARSER_READ_SLAVE_RESPONSE_MODBUS_ADDRESS = 2
-    MODBUS_PARSER_READ_SLAVE_RESPONSE_FUNCTION_CODE = 3
-    MODBUS_PARSER_READ_SLAVE_RESPONSE_AMOUNT_OF_BYTES = 4
-    MODBUS_PARSER_READ_SLAVE_RESPONSE_DATA = 5
-    MODBUS_PARSER_READ_SLAVE_RESPONSE_CRC_HIGH = 6
-    MODBUS_PARSER_READ_SLAVE_RESPONSE_CRC_LOW = 7
+        with serial.Serial(port=self.port, baudrate=self.baudrate, timeout=self.timeout, stopbits=self.stopbits,
+                           inter_byte_timeout=self.inter_byte_timeout) as ser:
+            while not self._stop_event.is_set():
+                chunk = ser.read(max(READ_CHUNK_SIZE, ser.in_waiting))
+                if not chunk:
+                    continue
+                timestamp_ns = time.monotonic_ns()
+                self.recv_queue.put((timestamp_ns, chunk))
+                if self.capture:
+                    self.capture.write(DIRECTION_BUS, chunk, timestamp_ns)
+                self.chunks += 1
+                self.bytes_read += len(chunk)
+
+class SensorDecoder(NamedTuple):
+    id: str
+    value_type: str
+    register_count: int
+    multiply: float
+
+class RegisterMap:
+    """
+    Address index of the configured sensors, built once for decoding sniffed reads.
+
+    Every register a sensor covers maps to (decoder, offset of the register within
+    the sensor), so a response is decoded in one pass over its words, and a read
+    that starts or ends inside a multi-register sensor skips that sensor instead
+    of misaligning the ones after it. Sensors marked skip are left out, as in the
+    poller.
+    """
+
+    def __init__(self, sensors):
+        """
+        Raises:
+            ValueError: A sensor has an unknown value_type
+        """
+        self.index = {}
+        for sensor in sorted(sensors, key=lambda s: s['address']):
+            if sensor.get('skip', False):
+                continue
+            value_type = sensor['value_type']
+            if value_type not in VALUE_TYPE_REGISTERS:
+                raise ValueError(f'Unknown value type {value_type} for sensor {sensor["id"]}')
+            decoder = SensorDecoder(sensor['id'], value_type, VALUE_TYPE_REGISTERS[value_type],
+                                    float(sensor['multiply']))
+            for offset in range(decoder.register_count):
+                self.index.setdefault(sensor['address'] + offset, (decoder, offset))
+
+    def decode(self, address, registers, data):
+        """
+        Decode the words of a read starting at address into data (sensor id -> scaled value).
+        """
+        index = self.index
+        position = 0
+        length = len(registers)
+        while position < length:
+            entry = index.get(address + position)
+            if entry is None:
+                position += 1  # register without a configured sensor
+                continue
+            decoder, offset = entry
+            end = position - offset + decoder.register_count
+            if offset == 0 and end <= length:
+                data[decoder.id] = decode_value(decoder.value_type, registers[position:end]) * decoder.multiply
+            position = end
 
 class ModBusParser(threading.Thread):
-    def __init__(self, recv_queue, mqtt_queue, config):
-        threading.Thread.__init__(self)
+    """
+    Assembles the meter's answers to another master's reads into cycle snapshots.
+
+    Framing and request/response pairing are done by modbus_sniffer.ModbusSniffer;
+    every successful FC 03/04 read of the configured slave is decoded into the
+    latest value per sensor. The master's polling cycle ends when it reads a start
+    address again (or stays silent for CYCLE_TIMEOUT); then one snapshot with all
+    sensor values and the age of each is queued for MQTT. Other slaves and
+    function codes on the bus are framed and counted but not decoded.
+    """
+    CYCLE_TIMEOUT = 2.0  # seconds without traffic that end a polling cycle
+
+    def __init__(self, recv_queue, mqtt_queue, config, baudrate=9600):
+        threading.Thread.__init__(self, daemon=True)
         self.recv_queue = recv_queue
-        self.last_character_time = datetime.datetime.now()
-        self.modbus_parser_status = ModBus_Parser_Status.MODBUS_PARSER_WAITING_FOR_MASTER_REQUEST
-        self.modbus_slave_address = 0
-        self.modbus_function_code = 0
-        self.modbus_register_address = 0
-        self.modbus_amount_of_registers = 0
-        self.modbus_slave_data = bytearray()
-        self.modbus_slave_crc_high = 0
-        self.modbus_slave_crc_low = 0
         self.config = config
         self.mqtt_queue = mqtt_queue
+        self.slave = config['config'].get('modbus_address')
+        self.register_map = RegisterMap(config['sensor'])
+        self.sniffer = ModbusSniffer(baudrate, on_exchange=self.on_exchange)
+        self.frames = 0
+        self.cycles = 0
+        self.latest = {}              # sensor id -> (value, monotonic ns of the response)
+        self.cycle_addresses = set()  # start addresses read in the current cycle
 
     def run(self):
-        last_character_delay = timedelta()
-        read_buffer = bytearray() # ModBus packet buffer
         while True:
-            data = self.recv_queue.get() # blocking function to read from queue
-            char_recv_time = data[0]
-            byte = data[1]
-
-            read_buffer.append(byte) # add byte to ModBus packet buffer
-            last_character_delay = char_recv_time - self.last_character_time
-            self.last_character_time = char_recv_time
-
-            # print zero-padded byte in 0x00 format
-            #log.debug('recv. byte: {}'.format(f'{byte:#0{4}x}'))
-            log.debug('recv. byte: {} {}'.format(f'{byte:#0{4}x}', last_character_delay))
-
-            # synchronization within RS485 data stream - looking for a ModBus Master request
-            if self.modbus_parser_status == ModBus_Parser_Status.MODBUS_PARSER_WAITING_FOR_MASTER_REQUEST:
-
-                # check for a ModBus delay of 4ms between characters (for 9600 baudrate) - see https://minimalmodbus.readthedocs.io/en/stable/serialcommunication.html
-                if last_character_delay > timedelta(milliseconds=4):
-                    
-                    # print all the bytes in the buffer in the zero padded format 0x00 to a single line
-                    log.debug('looking for ModBus Master request - read_buffer after 4ms delay: size={} {}'.format(len(read_buffer), [f'{i:#0{4}x}' for i in read_buffer]))
-
-                    # decode the ModBus message
-                    if len(read_buffer) >= 9: # incl. first characters of next message
-                        self.modbus_slave_address = read_buffer[0]
-                        self.modbus_function_code = read_buffer[1]
-                        self.modbus_register_address = read_buffer[2] << 8 | read_buffer[3]
-                        self.modbus_amount_of_registers = read_buffer[4] << 8 | read_buffer[5]
-                        modbus_crc = read_buffer[7] << 8 | read_buffer[6] # this does not correspond to GoodWe documentation, however works
-                        calculated_crc = calculate_crc16(read_buffer[0:6])
-                        #calculated_crc_3 = calculate_modbus_crc(read_buffer[0:6])
-
-                        if calculated_crc == modbus_crc:
-                            #log.debug('modbus_slave_address: {}'.format(self.modbus_slave_address))
-                            #log.debug('modbus_function_code: {}'.format(self.modbus_function_code))
-                            #log.debug('modbus_register_address: {}'.format(self.modbus_register_address))
-                            #log.debug('modbus_amount_of_registers: {}'.format(self.modbus_amount_of_registers))
-                            #log.debug('modbus_crc: {}'.format(hex(modbus_crc)))
-                            #log.debug('calculated_crc: {}'.format(hex(calculated_crc)))
-                            #log.debug('calculated_crc_3: {}'.format(hex(calculated_crc_3)))
-                            log.debug(f'ModBus Master request CRC ok - waiting for slave registers address: {hex(self.modbus_register_address)}, amount of registers: {self.modbus_amount_of_registers}')
-                            #self.modbus_parser_status = ModBus_Parser_Status.MODBUS_PARSER_READ_SLAVE_RESPONSE_MODBUS_ADDRESS
-                            
-                            # last byte is already first byte of slave response (slave address)
-                            if read_buffer[8] == self.modbus_slave_address:
-                                self.modbus_parser_status = ModBus_Parser_Status.MODBUS_PARSER_READ_SLAVE_RESPONSE_FUNCTION_CODE
-                            else:
-                                log.error(f'modbus_slave_address error: recv {hex(read_buffer[8])}, expected: {hex(self.modbus_slave_address)})')
-                                # print error with red color terminal text
-                                print('\033[91m' + f'modbus_slave_address error: recv {hex(read_buffer[8])}, expected: {hex(self.modbus_slave_address)})' + '\033[0m')
-                                self.modbus_parser_status = ModBus_Parser_Status.MODBUS_PARSER_WAITING_FOR_MASTER_REQUEST
-                            
-                        else:
-                            log.error('crc error: modbus_crc={} calculated_crc={}'.format(hex(modbus_crc), hex(calculated_crc)))
-
-                        # captured combination of packets, delete parsed packet from buffer
-                        # keep only characters of the next message (starting with character 9 - first character of the next message)
-                        log.debug('before reduction: size={} {}'.format(len(read_buffer), [f'{i:#0{4}x}' for i in read_buffer]))
-                        read_buffer = read_buffer[8:]
-                        log.debug('reduced read buffer: size={} {}'.format(len(read_buffer), [f'{i:#0{4}x}' for i in read_buffer]))
-                    
-                    else:
-                        log.debug('after inter-message delay read_buffer too small: size={} {}, waiting for additional data...'.format(len(read_buffer), [f'{i:#0{4}x}' for i in read_buffer]))
-
-            # elif self.modbus_parser_status == ModBus_Parser_Status.MODBUS_PARSER_READ_SLAVE_RESPONSE_MODBUS_ADDRESS:
-            #     if byte == self.modbus_slave_address:
-            #         self.modbus_parser_status = ModBus_Parser_Status.MODBUS_PARSER_READ_SLAVE_RESPONSE_FUNCTION_CODE
-            #     else:
-            #         log.error(f'modbus_slave_address error: recv {hex(byte)}, expected: {hex(self.modbus_slave_address)})')
-            #         self.modbus_parser_status = ModBus_Parser_Status.MODBUS_PARSER_WAITING_FOR_MASTER_REQUEST
-                
-            elif self.modbus_parser_status == ModBus_Parser_Status.MODBUS_PARSER_READ_SLAVE_RESPONSE_FUNCTION_CODE:
-                if byte == self.modbus_function_code:
-                    self.modbus_parser_status = ModBus_Parser_Status.MODBUS_PARSER_READ_SLAVE_RESPONSE_AMOUNT_OF_BYTES
-                else:
-                    log.error(f'modbus_function_code error: recv {hex(byte)}, expected: {hex(self.modbus_function_code)})')
-                    self.modbus_parser_status = ModBus_Parser_Status.MODBUS_PARSER_WAITING_FOR_MASTER_REQUEST
-            
-            elif self.modbus_parser_status == ModBus_Parser_Status.MODBUS_PARSER_READ_SLAVE_RESPONSE_AMOUNT_OF_BYTES:
-                if byte == self.modbus_amount_of_registers * 2:
-                    self.modbus_parser_status = ModBus_Parser_Status.MODBUS_PARSER_READ_SLAVE_RESPONSE_DATA
-                    self.modbus_slave_data.clear()
-                else:
-                    #log.debug('read_buffer: size={} {}'.format(len(read_buffer), [f'{i:#0{4}x}' for i in read_buffer]))
-                    log.warning(f'modbus_amount_of_bytes error - could be repeated Master Request: recv {hex(byte)}, expected: {hex(self.modbus_amount_of_registers * 2)})' + ', read_buffer: size={} {}'.format(len(read_buffer), [f'{i:#0{4}x}' for i in read_buffer]))
-                    self.modbus_parser_status = ModBus_Parser_Status.MODBUS_PARSER_WAITING_FOR_MASTER_REQUEST
-
-            elif self.modbus_parser_status == ModBus_Parser_Status.MODBUS_PARSER_READ_SLAVE_RESPONSE_DATA:
-                self.modbus_slave_data.append(byte)
-                if len(self.modbus_slave_data) == self.modbus_amount_of_registers * 2:
-                    self.modbus_parser_status = ModBus_Parser_Status.MODBUS_PARSER_READ_SLAVE_RESPONSE_CRC_HIGH
-                    # print all response data in 0x00 zero padded format
-                    #log.error('modbus_slave_data: {}'.format([f'{i:#0{4}x}' for i in self.modbus_slave_data]))
-            
-            elif self.modbus_parser_status == ModBus_Parser_Status.MODBUS_PARSER_READ_SLAVE_RESPONSE_CRC_HIGH:
-                self.modbus_slave_crc_high = byte
-                self.modbus_parser_status = ModBus_Parser_Status.MODBUS_PARSER_READ_SLAVE_RESPONSE_CRC_LOW
-            
-            elif self.modbus_parser_status == ModBus_Parser_Status.MODBUS_PARSER_READ_SLAVE_RESPONSE_CRC_LOW:
-                self.modbus_slave_crc_low = byte
-                modbus_crc = self.modbus_slave_crc_low << 8 | self.modbus_slave_crc_high # this does not correspond to GoodWe documentation, however works
-                data_for_crc = bytearray()
-                data_for_crc.append(self.modbus_slave_address)
-                data_for_crc.append(self.modbus_function_code)
-                data_for_crc.append(self.modbus_amount_of_registers * 2)
-                data_for_crc.extend(self.modbus_slave_data)
-                calculated_crc = calculate_crc16(data_for_crc)
-                if calculated_crc == modbus_crc:
-                    # log.error(f'modbus_crc: {hex(modbus_crc)} calculated_crc: {hex(calculated_crc)}')
-                    log.debug('recv. crc ok, modbus_slave_data payload: {} - parsing...'.format([f'{i:#0{4}x}' for i in self.modbus_slave_data]))
-                else:
-                    log.error(f'crc error: modbus_crc={hex(modbus_crc)} calculated_crc={hex(calculated_crc)}')
-                self.modbus_parser_status = ModBus_Parser_Status.MODBUS_PARSER_WAITING_FOR_MASTER_REQUEST
-                read_buffer.clear()
-
-                smart_meter_data = {}
-                smart_meter_data['timestamp'] = datetime.datetime.now().isoformat()
-                register_address = self.modbus_register_address
-                if register_address == 0x0000:
-                    smart_meter_data['subtopic'] = 'voltage_current'
-                elif register_address == 0x0012:
-                    smart_meter_data['subtopic'] = 'active_power'
-                elif register_address == 0x004E:
-                    smart_meter_data['subtopic'] = 'total_exported_energy'
-                elif register_address == 0x0034:
-                    smart_meter_data['subtopic'] = 'total_imported_energy'
-                else:
-                    smart_meter_data['subtopic'] = 'unknown'
-
-                while len(self.modbus_slave_data) > 0:
-
-                    log.debug(f'register_address: {hex(register_address)}')
-
-                    for register in self.config['sensor']:
-                        if register['address'] == register_address:
-
-                            log.debug(f'{register["name"]} {register["value_type"]} {register["multiply"]} {register["unit_of_measurement"]}')
-
-                            number_of_registers = 0
-                            if register['value_type'] == "INT16" or register['value_type'] == "UINT16":
-                                number_of_registers = 1
-                            elif register['value_type'] == "INT32" or register['value_type'] == "UINT32":
-                                number_of_registers = 2
-                            elif register['value_type'] == "INT64" or register['value_type'] == "UINT64":
-                                number_of_registers = 4
-                            else:
-                                log.error(f"Unknown value type {register['value_type']}")
-                                raise ValueError(f"Unknown value type {register['value_type']}")
-                    
-                            value = None
-                            if register['value_type'] == "INT16":
-                                value = self.modbus_slave_data[0] << 8 | self.modbus_slave_data[1]
-                                if value & 0x8000:
-                                    value = -0x10000 + value
-                            elif register['value_type'] == "UINT16":
-                                value = self.modbus_slave_data[0] << 8 | self.modbus_slave_data[1]
-                            elif register['value_type'] == "INT32":
-                                value = self.modbus_slave_data[0] << 8 | self.modbus_slave_data[1] | self.modbus_slave_data[2] << 24 | self.modbus_slave_data[3] << 16
-                                if value & 0x80000000:
-                                    value = -0x100000000 + value
-                            elif register['value_type'] == "UINT32":
-                                value = self.modbus_slave_data[0] | self.modbus_slave_data[1] << 16 | self.modbus_slave_data[2] << 8 | self.modbus_slave_data[3] << 24
-                            elif register['value_type'] == "INT64":
-                                value = self.modbus_slave_data[0] | self.modbus_slave_data[1] << 16 | self.modbus_slave_data[2] << 32 | self.modbus_slave_data[3] << 48 | self.modbus_slave_data[4] << 8 | self.modbus_slave_data[5] << 24 | self.modbus_slave_data[6] << 40 | self.modbus_slave_data[7] << 56
-                                if value & 0x8000000000000000:
-                                    value = -0x10000000000000000 + value
-                            elif register['value_type'] == "UINT64":
-                                value = self.modbus_slave_data[0] | self.modbus_slave_data[1] << 16 | self.modbus_slave_data[2] << 32 | self.modbus_slave_data[3] << 48 | self.modbus_slave_data[4] << 8 | self.modbus_slave_data[5] << 24 | self.modbus_slave_data[6] << 40 | self.modbus_slave_data[7] << 56
-
-                            value = value * float(register['multiply'])
-                            units = register['unit_of_measurement'] if 'unit_of_measurement' in register else ''
-                            log.debug(f'{register["name"]} {value} {units}')
-                            smart_meter_data[register['id']] = value
-
-                            break
-
-                    register_address += number_of_registers
-                    self.modbus_slave_data = self.modbus_slave_data[(number_of_registers*2):]
-                        
-                # push data to MQTT queue
-                log.debug(f'pushing to mqtt_queue: {smart_meter_data}')
-                self.mqtt_queue.put(smart_meter_data)
-                
+            try:
+                timestamp_ns, chunk = self.recv_queue.get(timeout=self.CYCLE_TIMEOUT)
+            except queue.Empty:
+                self.end_cycle()  # the master stopped polling
+                continue
+            self.sniffer.feed(timestamp_ns, chunk)
+
+    def feed(self, timestamp_ns, chunk):
+        """Add one chunk received at timestamp_ns (when its last byte arrived)."""
+        self.sniffer.feed(timestamp_ns, chunk)
+
+    def on_exchange(self, exchange):
+        request, response = exchange.request, exchange.response
+        if response is None or response.is_exception or request.function_code not in READ_FUNCTION_CODES:
+            return
+        if self.slave is not None and request.slave != self.slave:
+            return
+        self.frames += 1
+        if request.address in self.cycle_addresses:
+            self.end_cycle()
+        self.cycle_addresses.add(request.address)
+        values = {}
+        self.register_map.decode(request.address, response.values, values)
+        for sensor_id, value in values.items():
+            self.latest[sensor_id] = (value, exchange.response_ns)
+
+    def end_cycle(self, now_ns=None):
+        """Queue one snapshot of the cycle just completed, if it read anything."""
+        if not self.cycle_addresses:
+            return
+        self.cycle_addresses.clear()
+        self.cycles += 1
+        self.mqtt_queue.put(self.snapshot(now_ns))
+
+    def snapshot(self, now_ns=None):
+        """Latest value of every sensor seen, with the age of each in milliseconds."""
+        now_ns = time.monotonic_ns() if now_ns is None else now_ns
+        data = {'timestamp': datetime.datetime.now().isoformat(), 'cycle': self.cycles}
+        ages = {}
+        for sensor_id, (value, seen_ns) in self.latest.items():
+            data[sensor_id] = value
+            ages[sensor_id] = max(0, (now_ns - seen_ns) // 1_000_000)
+        data['age_ms'] = ages
+        if log.isEnabledFor(logging.DEBUG):
+            log.debug(f'pushing to mqtt_queue: {data}')
+        return data
 
-if __name__ == '__main__':
-    log.info('Starting EM340 ModBus sniffer to MQTT...')
 
+if __name__ == '__main__':
     try:
-        em340_config = yaml.load(open('em340.yaml'), Loader=yaml.FullLoader)
+        em340_config = get_config('em340.yaml')
     except Exception as e:
-        log.error(f'Error loading YAML file: {e}')
+        print(f'Error loading YAML file: {e}')
         sys.exit()
+    setup_logging(em340_config)
+    log.info('Starting EM340 ModBus sniffer to MQTT...')
 
     device = em340_config['config']['device']
     modbus_address = em340_config['config']['modbus_address']
     t_delay_seconds = em340_config['config']['t_delay_ms'] / 1000.0
 
+    capture = None
+    capture_file = em340_config['config'].get('capture_file')
+    if capture_file:
+        capture = CaptureWriter(capture_file)
+        log.info(f'Capturing sniffed bus traffic to {capture_file}')
+
     q = queue.Queue()
     mqtt_q = queue.Queue()
-    reader = SerialReader(port=device, baudrate=9600, timeout=1, stopbits=serial.STOPBITS_ONE, recv_queue=q)
+    reader = SerialReader(port=device, baudrate=9600, timeout=1, stopbits=serial.STOPBITS_ONE, recv_queue=q,
+                          capture=capture)
     parser = ModBusParser(recv_queue=q, mqtt_queue=mqtt_q, config=em340_config)
     sender = MqttSender(mqtt_queue=mqtt_q, config=em340_config)
     reader.start()
@@ -335,12 +304,22 @@ if __name__ == '__main__':
     sender.start()
     try:
         # sleep forever and let threads do their job
+        STATS_INTERVAL_S = 60
         while True:
             # sleep to reduce CPU usage
-            time.sleep(10)
-            pass
+            time.sleep(STATS_INTERVAL_S)
+            stats = parser.sniffer.stats
+            log.info(f'Sniffer: {stats.exchanges} exchanges, {stats.unanswered_requests} unanswered, '
+                     f'{stats.unmatched_responses} unmatched responses, {stats.resyncs} resyncs '
+                     f'({stats.discarded_bytes} bytes discarded), loss rate {stats.loss_rate:.2%}; '
+                     f'{parser.cycles} cycles, {sender.published} snapshots published, '
+                     f'{sender.superseded} superseded while disconnected, {sender.publish_errors} publish errors')
+            if capture:
+                capture.flush()
             
     except KeyboardInterrupt:
-        reader.join()
-        parser.join()
-        sender.join()
+        reader.stop()
+        reader.join(timeout=2)
+        sender.client.loop_stop()
+        if capture:
+            capture.close()
@@ -0,0 +1,224 @@
+#!/usr/bin/env python
+"""
+Raw ModBus frame capture and replay
+Records every request/response frame on the serial line with a monotonic
+timestamp into a compact binary log, and replays such logs through the
+decoder so field problems can be reproduced offline
+
+File format (little endian):
+    header:  b'EM340CAP' + uint8 version
+    record:  int64 monotonic_ns, uint8 direction, uint16 length, <length> frame bytes
+
+Sniffer captures (em340monitor), and what the gateway hears of another master
+in hybrid mode, are DIRECTION_BUS records: raw chunks as read from the line, not
+split into frames, stamped when their last byte arrived
+"""
+import struct
+import threading
+import time
+
+from modbus_codec import READ_FUNCTION_CODES, FrameError, parse_request, parse_response
+
+CAPTURE_MAGIC = b'EM340CAP'
+CAPTURE_VERSION = 1
+RECORD_HEADER = struct.Struct('<qBH')
+# Bytes read from a capture file at a time
+READ_CHUNK_SIZE = 1 << 20
+
+# Frame direction as seen from the gateway
+DIRECTION_TX = 0  # request sent to the meter
+DIRECTION_RX = 1  # response received from the meter
+DIRECTION_BUS = 2  # chunk sniffed from a bus driven by another master
+
+class CaptureWriter:
+    """Thread-safe appender for capture files"""
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._file = open(path, 'ab')
+        if self._file.tell() == 0:
+            self._file.write(CAPTURE_MAGIC + bytes((CAPTURE_VERSION,)))
+        self.records_written = 0
+
+    def write(self, direction, frame, timestamp_ns=None):
+        """Append one frame; the timestamp defaults to time.monotonic_ns()."""
+        if timestamp_ns is None:
+            timestamp_ns = time.monotonic_ns()
+        with self._lock:
+            self._file.write(RECORD_HEADER.pack(timestamp_ns, direction, len(frame)))
+            self._file.write(frame)
+            self.records_written += 1
+
+    def flush(self):
+        with self._lock:
+            self._file.flush()
+
+    def close(self):
+        with self._lock:
+            self._file.close()
+
+def read_capture(path, chunk_size=READ_CHUNK_SIZE):
+    """
+    Iterate over the records of a capture file.
+
+    The file is read in chunks of chunk_size bytes, so memory use does not grow
+    with the length of the capture.
+
+    Yields:
+        (monotonic_ns, direction, frame bytes) tuples
+
+    Raises:
+        ValueError: File is not a capture or has an unsupported version
+    """
+    with open(path, 'rb') as f:
+        header = f.read(len(CAPTURE_MAGIC) + 1)
+        if header[:len(CAPTURE_MAGIC)] != CAPTURE_MAGIC:
+            raise ValueError(f'{path} is not an EM340 capture file')
+        version = header[len(CAPTURE_MAGIC):]
+        if version != bytes((CAPTURE_VERSION,)):
+            raise ValueError(f'Unsupported capture version {version[0] if version else None}')
+
+        rest = b''
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            content = rest + chunk
+            position = 0
+            end = len(content)
+            while position + RECORD_HEADER.size <= end:
+                timestamp_ns, direction, length = RECORD_HEADER.unpack_from(content, position)
+                if position + RECORD_HEADER.size + length > end:
+                    break  # record continues in the next chunk
+                position += RECORD_HEADER.size
+                yield timestamp_ns, direction, content[position:position + length]
+                position += length
+            rest = content[position:]
+        # anything left in rest is a truncated last record (capture interrupted mid-write)
+
+class CapturingSerial:
+    """
+    Wrapper around a pyserial port that records every write and read.
+
+    All other attributes are delegated to the wrapped port, so it can replace
+    minimalmodbus.Instrument.serial transparently. Bytes read while only
+    listening to another master (hybrid mode) are read with read_passive() and
+    recorded as DIRECTION_BUS chunks, apart from responses to own requests.
+    """
+
+    def __init__(self, port, capture):
+        object.__setattr__(self, '_port', port)
+        object.__setattr__(self, '_capture', capture)
+
+    def __getattr__(self, name):
+        return getattr(self._port, name)
+
+    def __setattr__(self, name, value):
+        setattr(self._port, name, value)
+
+    def write(self, data):
+        self._capture.write(DIRECTION_TX, bytes(data))
+        return self._port.write(data)
+
+    def read(self, size=1):
+        data = self._port.read(size)
+        if data:
+            self._capture.write(DIRECTION_RX, data)
+        return data
+
+    def read_passive(self, size=1):
+        """Read bytes another master's traffic put on the line."""
+        data = self._port.read(size)
+        if data:
+            self._capture.write(DIRECTION_BUS, data)
+        return data
+
+def parse_read_exchange(request, response):
+    """
+    Extract the register values from an FC 03/04 request/response pair.
+
+    Returns:
+        (start address, list of register values), or None if the pair is not a
+        valid read exchange (CRC error, exception response, mismatched request)
+    """
+    try:
+        request = parse_request(request)
+        if request.function_code not in READ_FUNCTION_CODES:
+            return None
+        response = parse_response(response, request)
+    except FrameError:
+        return None
+    if response.is_exception:
+        return None
+    return request.address, list(response.values)
+
+def replay(records, plan, on_cycle, realtime=False):
+    """
+    Feed captured frames through the block decoder.
+
+    A cycle ends whenever a read starts at or before the previously read address,
+    i.e. when the poller wraps around to its first block.
+
+    Args:
+        records: Iterable of (monotonic_ns, direction, frame) as from read_capture()
+        plan: poll_plan.PollPlan used to decode the responses
+        on_cycle: Callable receiving the decoded data of each complete cycle
+        realtime: Sleep to reproduce the captured pacing instead of running flat out
+
+    Returns:
+        Dictionary of replay statistics
+    """
+    stats = {'frames': 0, 'exchanges': 0, 'invalid': 0, 'unknown_blocks': 0, 'cycles': 0, 'sniffed_chunks': 0}
+
+    data = {}
+    previous_start = None
+    pending_request = None
+    first_capture_ns = None
+    replay_start = time.monotonic()
+    cycle_started_ns = None
+
+    def finish_cycle():
+        data['capture_time_s'] = round((cycle_started_ns - first_capture_ns) / 1e9, 6)
+        on_cycle(dict(data))
+        stats['cycles'] += 1
+        data.clear()
+
+    for timestamp_ns, direction, frame in records:
+        stats['frames'] += 1
+        if first_capture_ns is None:
+            first_capture_ns = timestamp_ns
+        if realtime:
+            delay = (timestamp_ns - first_capture_ns) / 1e9 - (time.monotonic() - replay_start)
+            if delay > 0:
+                time.sleep(delay)
+
+        if direction == DIRECTION_BUS:
+            stats['sniffed_chunks'] += 1  # traffic of another master, see tools/bus_analyzer.py
+            continue
+        if direction == DIRECTION_TX:
+            pending_request = frame
+            continue
+        if pending_request is None:
+            continue
+        exchange = parse_read_exchange(pending_request, frame)
+        pending_request = None
+        if exchange is None:
+            stats['invalid'] += 1
+            continue
+        stats['exchanges'] += 1
+        start, values = exchange
+
+        if previous_start is not None and start <= previous_start and data:
+            finish_cycle()
+        if not data:
+            cycle_started_ns = timestamp_ns
+        previous_start = start
+
+        index = plan.block_index.get(start)
+        if index is None or plan.ranges[index][1] != len(values):
+            stats['unknown_blocks'] += 1
+            continue
+        plan.decode(index, values, data)
+
+    if data:
+        finish_cycle()
+    stats['elapsed_s'] = time.monotonic() - replay_start
+    return stats
@@ -0,0 +1,156 @@
+#!/usr/bin/env python
+"""
+Hybrid passive/active polling
+When another master (the GoodWe inverter) already polls the meter, the daemon
+listens to the bus and takes every register that master reads into a snapshot.
+It sends its own requests only for registers the other master leaves stale or
+never reads, and only in the idle windows between that master's exchanges
+"""
+import select
+import time
+
+from modbus_bus import PRIORITY_POLL
+from modbus_codec import READ_FUNCTION_CODES
+from modbus_sniffer import ModbusSniffer
+
+# Longest a request of the other master is assumed to wait for its answer
+MASTER_RESPONSE_TIMEOUT_NS = 500_000_000
+
+class RegisterSnapshot:
+    """Latest value of each register and the monotonic time it was read."""
+
+    def __init__(self):
+        self.values = {}
+        self.updated = {}
+
+    def merge(self, address, values, timestamp):
+        for offset, value in enumerate(values):
+            self.values[address + offset] = value
+            self.updated[address + offset] = timestamp
+
+    def age(self, address, now):
+        """Seconds since the register was read, or None if it never was."""
+        updated = self.updated.get(address)
+        return None if updated is None else now - updated
+
+class HybridPoller:
+    """
+    Sniffer, snapshot and idle-window scheduling for the hybrid poll mode.
+
+    The caller alternates listen() with reads of the blocks due() returns,
+    made while idle(), and merges its own results with merge(); decode()
+    turns the snapshot into one cycle of sensor data.
+    """
+
+    def __init__(self, bus, slave, max_age=5.0, idle_guard=0.05, baudrate=9600):
+        """
+        Args:
+            bus: ModbusBus owning the serial port
+            slave: ModBus address of the meter
+            max_age: Seconds after which a register counts as stale; blocks are
+                read by the daemon once half of it has passed without an update,
+                and not before the bus has been listened to for that long
+            idle_guard: Silence in seconds after the other master's last byte
+                before the daemon may send a request
+            baudrate: Line speed, for the sniffer's frame timing
+        """
+        self.bus = bus
+        self.slave = slave
+        self.max_age = max_age
+        self.idle_guard_ns = int(idle_guard * 1e9)
+        self.snapshot = RegisterSnapshot()
+        self.sniffer = ModbusSniffer(baudrate, on_exchange=self._on_exchange)
+        self.listening_since = None
+        self.observed_reads = 0
+        self.own_reads = 0
+
+    def _on_exchange(self, exchange):
+        request, response = exchange.request, exchange.response
+        if (response is None or response.is_exception or request.slave != self.slave or
+                request.function_code not in READ_FUNCTION_CODES):
+            return
+        self.observed_reads += 1
+        self.snapshot.merge(request.address, response.values, exchange.response_ns / 1e9)
+
+    def listen(self, timeout):
+        """
+        Feed what appears on the line within timeout seconds to the sniffer.
+
+        The bus is held only while listening, so configuration writes still get through.
+
+        Raises:
+            IOError, serial.SerialException: The port failed
+        """
+        if self.listening_since is None:
+            self.listening_since = time.monotonic()
+        with self.bus.transaction(PRIORITY_POLL, passive=True) as instrument:
+            port = instrument.serial
+            if not port.in_waiting:
+                select.select([port.fileno()], [], [], timeout)
+            waiting = port.in_waiting
+            # a CapturingSerial records sniffed bytes apart from responses to own requests
+            read = getattr(port, 'read_passive', port.read)
+            chunk = read(waiting) if waiting else b''
+        if chunk:
+            self.sniffer.feed(time.monotonic_ns(), chunk)
+
+    def idle(self):
+        """True if the other master has no exchange in progress and the line has been silent long enough."""
+        sniffer = self.sniffer
+        now_ns = time.monotonic_ns()
+        if sniffer.buffer:
+            return False
+        if sniffer.pending is not None and now_ns - sniffer.pending[1] < MASTER_RESPONSE_TIMEOUT_NS:
+            return False
+        last_byte_ns = sniffer.idle_since_ns
+        return last_byte_ns is None or now_ns - last_byte_ns >= self.idle_guard_ns
+
+    def merge(self, address, values):
+        """Take the result of an own read into the snapshot."""
+        self.own_reads += 1
+        self.snapshot.merge(address, values, time.monotonic())
+
+    def _oldest(self, plan, index, now):
+        """Age of the oldest sensor register of block index, None if one was never read."""
+        start = plan.ranges[index][0]
+        oldest = 0.0
+        for offset, reg_count, *_ in plan.tables[index]:
+            for address in range(start + offset, start + offset + reg_count):
+                age = self.snapshot.age(address, now)
+                if age is None:
+                    return None
+                oldest = max(oldest, age)
+        return oldest
+
+    def due(self, plan):
+        """Indices of the blocks to read, never read first, then oldest first."""
+        now = time.monotonic()
+        refresh_age = self.max_age / 2
+        if self.listening_since is None or now - self.listening_since < refresh_age:
+            return []  # first learn what the other master reads
+        due = []
+        for index in range(len(plan.ranges)):
+            age = self._oldest(plan, index, now)
+            if age is None:
+                due.append((float('inf'), index))
+            elif age >= refresh_age:
+                due.append((age, index))
+        return [index for _, index in sorted(due, reverse=True)]
+
+    def decode(self, plan, data):
+        """
+        Decode the snapshot into data (sensor id -> scaled value).
+
+        Returns:
+            Indices of the blocks left out because a register is missing or older than max_age
+        """
+        now = time.monotonic()
+        values = self.snapshot.values
+        stale = []
+        for index, (start, count) in enumerate(plan.ranges):
+            age = self._oldest(plan, index, now)
+            if age is None or age > self.max_age:
+                stale.append(index)
+                continue
+            plan.decode(index, [values.get(address, 0) for address in range(start, start + count)], data)
+        return stale
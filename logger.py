@@ -1,55 +1,171 @@
+import atexit
 import logging
 import logging.handlers
-import yaml
-import sys
-from config_loader import load_yaml_with_env
-
-config_file = 'em340.yaml'
-
-try:
-    config = load_yaml_with_env(config_file)
-except Exception as e:
-    print(f'Error loading YAML file: {e}')
-    sys.exit()
-
-log_level = config['logger']['log_level']
-log_to_file = bool(config['logger']['log_to_file'])
-log_file = config['logger']['log_file']
-log_to_console = bool(config['logger']['log_to_console'])
-log_rotate = bool(config['logger']['log_rotate'])
-log_rotate_size = int(config['logger']['log_rotate_size'])
-log_rotate_count = config['logger']['log_rotate_count']
+import queue
+import threading
+import time
 
+# Root logger shared by all modules. Importing this module has no side effects -
+# entry points call setup_logging() once the configuration has been loaded.
 log = logging.getLogger()
-if log_level == 'DEBUG':
-    log.setLevel(logging.DEBUG)
-elif log_level == 'INFO':
-    log.setLevel(logging.INFO)
-elif log_level == 'WARNING':
-    log.setLevel(logging.WARNING)
-elif log_level == 'ERROR':
-    log.setLevel(logging.ERROR)
-elif log_level == 'CRITICAL':
-    log.setLevel(logging.CRITICAL)
-else:
-    log.setLevel(logging.INFO) # default to INFO if log_level is not recognized
-
-if log_to_file:
-    if log_rotate:
-        # Create a RotatingFileHandler object that rotates log files when they reach 10 MB in size.
-        file_handler = logging.handlers.RotatingFileHandler(log_file, maxBytes=log_rotate_size, backupCount=log_rotate_count)
+
+LOG_LEVELS = {
+    'DEBUG': logging.DEBUG,
+    'INFO': logging.INFO,
+    'WARNING': logging.WARNING,
+    'ERROR': logging.ERROR,
+    'CRITICAL': logging.CRITICAL,
+}
+
+class RateLimitFilter(logging.Filter):
+    """
+    Lets at most burst WARNING-or-worse records per message through per interval.
+
+    A reconnect loop or a dead meter repeats the same error every retry; the
+    excess is dropped and counted, and the first record of the same message let
+    through in a later interval reports how many were suppressed. A message is
+    identified by its call site and its unformatted msg, so different errors
+    logged from one line (one per block, one per config key) do not share a
+    budget. Records below WARNING always pass.
+    """
+
+    # Expired entries are dropped once this many messages are tracked
+    MAX_TRACKED = 1000
+
+    def __init__(self, burst=5, interval=60.0, clock=time.monotonic):
+        super().__init__()
+        self.burst = burst
+        self.interval = interval
+        self.clock = clock
+        self.suppressed_total = 0
+        self._sites = {}  # (pathname, lineno, msg) -> [interval start, records passed, records suppressed]
+        self._lock = threading.Lock()
+
+    def filter(self, record):
+        if record.levelno < logging.WARNING or self.burst <= 0:
+            return True
+        key = (record.pathname, record.lineno, str(record.msg))
+        now = self.clock()
+        with self._lock:
+            site = self._sites.get(key)
+            if site is None or now - site[0] >= self.interval:
+                if site is None and len(self._sites) >= self.MAX_TRACKED:
+                    self._prune(now)
+                self._sites[key] = [now, 1, 0]
+                if site is not None and site[2]:
+                    record.msg = f'{record.msg} [{site[2]} similar messages suppressed]'
+                return True
+            if site[1] < self.burst:
+                site[1] += 1
+                return True
+            site[2] += 1
+            self.suppressed_total += 1
+            return False
+
+    def _prune(self, now):
+        # f-string messages make a key per distinct text; forget the ones whose interval is over
+        self._sites = {key: site for key, site in self._sites.items() if now - site[0] < self.interval}
+
+    def suppressed(self):
+        """Records suppressed in the current interval, per call site."""
+        counts = {}
+        with self._lock:
+            for (path, line, _), site in self._sites.items():
+                if site[2]:
+                    name = f'{path.rsplit("/", 1)[-1]}:{line}'
+                    counts[name] = counts.get(name, 0) + site[2]
+        return counts
+
+class _QueueHandler(logging.handlers.QueueHandler):
+    """Queues records for the listener thread without formatting them in the caller."""
+
+    def prepare(self, record):
+        # The queue stays in-process, so only the arguments are merged now, while
+        # they still hold the values of the moment; timestamp and traceback are
+        # formatted by the output handlers on the listener thread
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+
+# Handlers installed by setup_logging(), replaced on every call: the output handlers,
+# the handlers on the root logger (a QueueHandler when logging asynchronously) and
+# the listener thread feeding the output handlers from the queue
+_handlers = []
+_root_handlers = []
+_listener = None
+rate_limiter = RateLimitFilter()
+
+def shutdown_logging():
+    """Write out queued records and close the handlers installed by setup_logging()."""
+    global _listener
+    for handler in _root_handlers:
+        log.removeHandler(handler)
+        handler.close()
+    _root_handlers.clear()
+    if _listener is not None:
+        _listener.stop()  # processes what is still queued
+        _listener = None
+    for handler in _handlers:
+        handler.close()
+    _handlers.clear()
+
+atexit.register(shutdown_logging)
+
+def setup_logging(config):
+    """
+    Configure the root logger from the 'logger' section of the configuration.
+
+    Safe to call more than once; handlers from a previous call are replaced.
+    With log_async (the default) callers only put records on a queue; a listener
+    thread formats them and writes to the console and the log file, so slow
+    SD-card or pipe writes never stall the poll loop.
+    """
+    global _listener
+    logger_config = config.get('logger') or {}
+    log_level = logger_config.get('log_level', 'INFO')
+    log_to_file = bool(logger_config.get('log_to_file', False))
+    log_file = logger_config.get('log_file', 'em340d.log')
+    log_to_console = bool(logger_config.get('log_to_console', True))
+    log_rotate = bool(logger_config.get('log_rotate', False))
+    log_rotate_size = int(logger_config.get('log_rotate_size', 1048576))
+    log_rotate_count = int(logger_config.get('log_rotate_count', 5))
+    log_async = bool(logger_config.get('log_async', True))
+    rate_limiter.burst = int(logger_config.get('log_rate_limit_burst', 5))
+    rate_limiter.interval = float(logger_config.get('log_rate_limit_interval_s', 60))
+
+    log.setLevel(LOG_LEVELS.get(log_level, logging.INFO)) # default to INFO if log_level is not recognized
+
+    shutdown_logging()
+
+    if log_to_file:
+        if log_rotate:
+            # Create a RotatingFileHandler object that rotates log files when they reach log_rotate_size bytes.
+            file_handler = logging.handlers.RotatingFileHandler(log_file, maxBytes=log_rotate_size, backupCount=log_rotate_count)
+        else:
+            # Add a handler to the log object that writes messages to a file.
+            file_handler = logging.FileHandler(log_file)
+        file_handler.setFormatter(logging.Formatter('%(asctime)s %(levelname)s: %(message)s'))
+        _handlers.append(file_handler)
+
+    if log_to_console:
+        # Add a handler to the log object that prints messages to the console.
+        stream_handler = logging.StreamHandler()
+        # Include timestamp and level for Docker logs visibility
+        stream_handler.setFormatter(logging.Formatter('%(asctime)s [%(levelname)s] %(message)s'))
+        _handlers.append(stream_handler)
+
+    if log_async and _handlers:
+        log_queue = queue.SimpleQueue()
+        _listener = logging.handlers.QueueListener(log_queue, *_handlers, respect_handler_level=True)
+        _listener.start()
+        _root_handlers.append(_QueueHandler(log_queue))
     else:
-        # Add a handler to the log object that writes messages to a file.
-        file_handler = logging.FileHandler(log_file)
-    file_handler.setFormatter(logging.Formatter('%(asctime)s %(levelname)s: %(message)s'))
-    log.addHandler(file_handler)
-
-if log_to_console:
-    # Add a handler to the log object that prints messages to the console.
-    stream_handler = logging.StreamHandler()
-    # Include timestamp and level for Docker logs visibility
-    stream_handler.setFormatter(logging.Formatter('%(asctime)s [%(levelname)s] %(message)s'))
-    log.addHandler(stream_handler)
+        _root_handlers.extend(_handlers)
+
+    log.addFilter(rate_limiter)  # once per record, whatever the number of handlers
+    for handler in _root_handlers:
+        log.addHandler(handler)
+    return log
 
 # Log a message at the INFO level.
 # log.info('This is an info message.')
@@ -66,4 +182,3 @@ if log_to_console:
 # WARNING	Indicates a potential problem.
 # ERROR	Indicates a serious problem that may cause the program to fail.
 # CRITICAL	Indicates a fatal error that will cause the program to terminate.
-
@@ -0,0 +1,165 @@
+#!/usr/bin/env python
+"""
+ModBus bus arbiter
+Single owner of the RS-485 line shared by the poller and the configuration
+manager. Every transaction is granted the bus in priority order, so a config
+write never lands in the middle of a poll block, and the inter-frame delay is
+enforced in one place
+"""
+import heapq
+import itertools
+import threading
+import time
+from contextlib import contextmanager
+
+# Lower value = served first
+PRIORITY_CONFIG_WRITE = 0
+PRIORITY_ON_DEMAND = 1
+PRIORITY_POLL = 2
+
+class ModbusBus:
+    """
+    Serialises access to one minimalmodbus.Instrument.
+
+    Callers queue for the bus with a priority; when the bus is released the
+    waiting transaction with the lowest priority value (then oldest) runs next.
+    Polling uses PRIORITY_POLL and so only gets the slots nobody else wants.
+    """
+
+    def __init__(self, instrument, inter_frame_delay=0.0):
+        """
+        Args:
+            instrument: minimalmodbus.Instrument that owns the serial port
+            inter_frame_delay: Minimum silence in seconds between two transactions
+        """
+        self.instrument = instrument
+        self.inter_frame_delay = inter_frame_delay
+        self._condition = threading.Condition()
+        self._waiting = []  # heap of (priority, sequence) tickets
+        self._sequence = itertools.count()
+        self._busy = False
+        self._idle_until = 0.0  # monotonic time before which the line must stay silent
+        self.transactions = {PRIORITY_CONFIG_WRITE: 0, PRIORITY_ON_DEMAND: 0, PRIORITY_POLL: 0}
+
+    @contextmanager
+    def transaction(self, priority=PRIORITY_POLL, settle=0.0, passive=False):
+        """
+        Hold the bus for one request/response exchange.
+
+        Args:
+            priority: PRIORITY_CONFIG_WRITE, PRIORITY_ON_DEMAND or PRIORITY_POLL
+            settle: Extra silence after this transaction (e.g. device busy after a write)
+            passive: Only listen to the line (hybrid mode); nothing is sent, so the
+                inter-frame delay is not restarted and no transaction is counted
+
+        Yields:
+            The instrument to talk to
+        """
+        ticket = (priority, next(self._sequence))
+        with self._condition:
+            heapq.heappush(self._waiting, ticket)
+            try:
+                while self._busy or self._waiting[0] != ticket:
+                    self._condition.wait()
+            except BaseException:
+                self._waiting.remove(ticket)
+                heapq.heapify(self._waiting)
+                self._condition.notify_all()
+                raise
+            heapq.heappop(self._waiting)
+            self._busy = True
+            idle_until = self._idle_until
+
+        try:
+            delay = idle_until - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            if not passive:
+                self.transactions[priority] = self.transactions.get(priority, 0) + 1
+            yield self.instrument
+        finally:
+            with self._condition:
+                if not passive:
+                    self._idle_until = time.monotonic() + max(self.inter_frame_delay, settle)
+                self._busy = False
+                self._condition.notify_all()
+
+    def read_registers(self, address, count, priority=PRIORITY_POLL, functioncode=3):
+        with self.transaction(priority) as instrument:
+            return instrument.read_registers(address, number_of_registers=count, functioncode=functioncode)
+
+    def read_register(self, address, priority=PRIORITY_ON_DEMAND, functioncode=3):
+        with self.transaction(priority) as instrument:
+            return instrument.read_register(address, functioncode=functioncode)
+
+    def write_register(self, address, value, priority=PRIORITY_CONFIG_WRITE, functioncode=6, settle=0.0):
+        with self.transaction(priority, settle=settle) as instrument:
+            instrument.write_register(address, value, functioncode=functioncode)
+
+    def write_registers(self, address, values, priority=PRIORITY_CONFIG_WRITE, settle=0.0):
+        with self.transaction(priority, settle=settle) as instrument:
+            instrument.write_registers(address, list(values))
+
+    def replace_instrument(self, instrument):
+        """Swap in a freshly opened instrument (after a reconnect) once the bus is free."""
+        with self.transaction(PRIORITY_CONFIG_WRITE):
+            self.instrument = instrument
+
+class CircuitBreaker:
+    """
+    Per-device circuit breaker for the poller.
+
+    closed:    requests flow, consecutive failures are counted
+    open:      after failure_threshold failures in a row requests are refused
+               until the cooldown has passed
+    half_open: after the cooldown one request is let through as a probe;
+               success closes the breaker, failure reopens it with twice the cooldown
+    """
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+    def __init__(self, failure_threshold=3, cooldown=5.0, max_cooldown=60.0, clock=time.monotonic):
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self.max_cooldown = max_cooldown
+        self.clock = clock
+        self.state = self.CLOSED
+        self.consecutive_failures = 0
+        self.trips = 0
+        self.current_cooldown = cooldown
+        self._opened_at = 0.0
+
+    def allow(self):
+        """True if a request may be sent now."""
+        if self.state == self.OPEN and self.clock() - self._opened_at >= self.current_cooldown:
+            self.state = self.HALF_OPEN
+        return self.state != self.OPEN
+
+    def retry_in(self):
+        """Seconds until an open breaker lets a probe through (0 if not open)."""
+        if self.state != self.OPEN:
+            return 0.0
+        return max(0.0, self._opened_at + self.current_cooldown - self.clock())
+
+    def record_success(self):
+        self.state = self.CLOSED
+        self.consecutive_failures = 0
+        self.current_cooldown = self.cooldown
+
+    def record_failure(self):
+        """
+        Count a failed request.
+
+        Returns:
+            True if this failure opened the breaker
+        """
+        self.consecutive_failures += 1
+        if self.state == self.HALF_OPEN:
+            self.current_cooldown = min(self.current_cooldown * 2, self.max_cooldown)
+        elif self.state != self.CLOSED or self.consecutive_failures < self.failure_threshold:
+            return False
+        self.state = self.OPEN
+        self._opened_at = self.clock()
+        self.trips += 1
+        return True
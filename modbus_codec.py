@@ -0,0 +1,202 @@
+#!/usr/bin/env python
+"""
+ModBus RTU frame codec
+Table-driven CRC16 plus builders and parsers for the function codes used with the
+EM340 (03/04 read, 06 write single, 16 write multiple) and exception responses.
+Parsers work on bytes, bytearray or memoryview without copying the frame
+"""
+import struct
+from typing import NamedTuple, Optional, Tuple
+
+READ_HOLDING_REGISTERS = 0x03
+READ_INPUT_REGISTERS = 0x04
+WRITE_SINGLE_REGISTER = 0x06
+WRITE_MULTIPLE_REGISTERS = 0x10
+EXCEPTION_FLAG = 0x80
+
+# ModBus exception codes
+ILLEGAL_FUNCTION = 0x01
+ILLEGAL_DATA_ADDRESS = 0x02
+ILLEGAL_DATA_VALUE = 0x03
+SLAVE_DEVICE_FAILURE = 0x04
+SLAVE_DEVICE_BUSY = 0x06
+
+READ_FUNCTION_CODES = (READ_HOLDING_REGISTERS, READ_INPUT_REGISTERS)
+MAX_READ_REGISTERS = 125   # protocol limit; the EM340 itself stops at 20
+MAX_WRITE_REGISTERS = 123
+
+_HEADER = struct.Struct('>BBHH')  # slave, function code, address, count/value
+
+def _crc_table():
+    table = []
+    for byte in range(256):
+        crc = byte
+        for _ in range(8):
+            crc = (crc >> 1) ^ 0xA001 if crc & 1 else crc >> 1
+        table.append(crc)
+    return tuple(table)
+
+CRC_TABLE = _crc_table()
+
+def crc16(data):
+    """
+    ModBus RTU CRC16 (polynomial 0xA001 reflected, initial value 0xFFFF).
+
+    Computed over a whole frame including its CRC the result is 0.
+    """
+    crc = 0xFFFF
+    table = CRC_TABLE
+    for byte in data:
+        crc = (crc >> 8) ^ table[(crc ^ byte) & 0xFF]
+    return crc
+
+def append_crc(frame):
+    """Return frame with its CRC appended in ModBus wire order (low byte first)."""
+    crc = crc16(frame)
+    return bytes(frame) + bytes((crc & 0xFF, crc >> 8))
+
+def check_crc(frame):
+    """True if frame (including its two CRC bytes) carries a valid CRC."""
+    return len(frame) >= 4 and crc16(frame) == 0
+
+class FrameError(ValueError):
+    """Frame too short, with a bad CRC or not matching its function code"""
+
+class Request(NamedTuple):
+    slave: int
+    function_code: int
+    address: int
+    count: int
+    values: Tuple[int, ...] = ()   # written values for FC 06/16
+
+class Response(NamedTuple):
+    slave: int
+    function_code: int                 # without the exception flag
+    values: Tuple[int, ...] = ()       # register values for FC 03/04
+    address: Optional[int] = None      # echoed by FC 06/16
+    count: int = 0                     # registers read or written
+    exception_code: Optional[int] = None
+
+    @property
+    def is_exception(self):
+        return self.exception_code is not None
+
+# --- builders ---------------------------------------------------------------
+
+def build_read_request(slave, address, count, function_code=READ_HOLDING_REGISTERS):
+    return append_crc(_HEADER.pack(slave, function_code, address, count))
+
+def build_read_response(slave, values, function_code=READ_HOLDING_REGISTERS):
+    values = list(values)
+    return append_crc(struct.pack(f'>BBB{len(values)}H', slave, function_code, len(values) * 2, *values))
+
+def build_write_single_request(slave, address, value):
+    """FC 06 request; the slave answers with an identical frame."""
+    return append_crc(_HEADER.pack(slave, WRITE_SINGLE_REGISTER, address, value))
+
+def build_write_multiple_request(slave, address, values):
+    values = list(values)
+    return append_crc(_HEADER.pack(slave, WRITE_MULTIPLE_REGISTERS, address, len(values)) +
+                      struct.pack(f'>B{len(values)}H', len(values) * 2, *values))
+
+def build_write_multiple_response(slave, address, count):
+    return append_crc(_HEADER.pack(slave, WRITE_MULTIPLE_REGISTERS, address, count))
+
+def build_exception_response(slave, function_code, exception_code):
+    return append_crc(bytes((slave, (function_code | EXCEPTION_FLAG) & 0xFF, exception_code)))
+
+# --- framing ----------------------------------------------------------------
+
+def request_length(buffer):
+    """
+    Length of the request frame at the start of buffer.
+
+    Returns:
+        Frame length in bytes, or None until enough bytes are buffered to tell
+    """
+    if len(buffer) < 2:
+        return None
+    if buffer[1] == WRITE_MULTIPLE_REGISTERS:
+        return 9 + buffer[6] if len(buffer) >= 7 else None
+    return 8
+
+def response_length(buffer):
+    """
+    Length of the response frame at the start of buffer.
+
+    Returns:
+        Frame length in bytes, or None until enough bytes are buffered to tell
+    """
+    if len(buffer) < 2:
+        return None
+    function_code = buffer[1]
+    if function_code & EXCEPTION_FLAG:
+        return 5
+    if function_code in READ_FUNCTION_CODES:
+        return 5 + buffer[2] if len(buffer) >= 3 else None
+    return 8
+
+# --- parsers ----------------------------------------------------------------
+
+def parse_request(frame):
+    """
+    Decode a request frame.
+
+    Raises:
+        FrameError: Bad CRC, wrong length or an unsupported function code
+    """
+    if not check_crc(frame):
+        raise FrameError('CRC error')
+    if len(frame) < 8:
+        raise FrameError(f'request too short ({len(frame)} bytes)')
+    slave, function_code, address, count = _HEADER.unpack_from(frame)
+    if function_code in READ_FUNCTION_CODES:
+        if len(frame) != 8:
+            raise FrameError(f'read request of {len(frame)} bytes')
+        return Request(slave, function_code, address, count)
+    if function_code == WRITE_SINGLE_REGISTER:
+        if len(frame) != 8:
+            raise FrameError(f'write request of {len(frame)} bytes')
+        return Request(slave, function_code, address, 1, (count,))
+    if function_code == WRITE_MULTIPLE_REGISTERS:
+        if len(frame) != 9 + 2 * count or frame[6] != 2 * count:
+            raise FrameError(f'write request for {count} registers has {len(frame)} bytes')
+        return Request(slave, function_code, address, count, struct.unpack_from(f'>{count}H', frame, 7))
+    raise FrameError(f'unsupported function code 0x{function_code:02X}')
+
+def parse_response(frame, request=None):
+    """
+    Decode a response frame, optionally checking that it answers request.
+
+    Exception responses are returned with exception_code set, not raised.
+
+    Raises:
+        FrameError: Bad CRC, wrong length or not an answer to request
+    """
+    if not check_crc(frame):
+        raise FrameError('CRC error')
+    if len(frame) < 5:
+        raise FrameError(f'response too short ({len(frame)} bytes)')
+    slave, function_code = frame[0], frame[1]
+    if request is not None and (slave != request.slave or function_code & ~EXCEPTION_FLAG != request.function_code):
+        raise FrameError(f'response from slave {slave} FC 0x{function_code:02X} does not match the request')
+    if function_code & EXCEPTION_FLAG:
+        if len(frame) != 5:
+            raise FrameError(f'exception response of {len(frame)} bytes')
+        return Response(slave, function_code & ~EXCEPTION_FLAG, exception_code=frame[2])
+    if function_code in READ_FUNCTION_CODES:
+        byte_count = frame[2]
+        if len(frame) != 5 + byte_count or byte_count % 2:
+            raise FrameError(f'read response with byte count {byte_count} has {len(frame)} bytes')
+        count = byte_count // 2
+        if request is not None and count != request.count:
+            raise FrameError(f'{count} registers returned, {request.count} requested')
+        return Response(slave, function_code, struct.unpack_from(f'>{count}H', frame, 3), count=count)
+    if function_code in (WRITE_SINGLE_REGISTER, WRITE_MULTIPLE_REGISTERS):
+        if len(frame) != 8:
+            raise FrameError(f'write response of {len(frame)} bytes')
+        _, _, address, value = _HEADER.unpack_from(frame)
+        if function_code == WRITE_SINGLE_REGISTER:
+            return Response(slave, function_code, (value,), address=address, count=1)
+        return Response(slave, function_code, address=address, count=value)
+    raise FrameError(f'unsupported function code 0x{function_code:02X}')
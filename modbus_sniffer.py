@@ -0,0 +1,222 @@
+#!/usr/bin/env python
+"""
+Passive ModBus RTU framing engine
+Splits the byte stream of an RS-485 bus observed by a third party into frames,
+decodes FC 03/04/06/16 and exception frames for any number of slaves and pairs
+each request with its response. Frames are delimited by the silent interval
+(3.5 characters) and, when a USB adapter delivers several frames in one chunk,
+by frame length and CRC, so sync is held at full bus load
+"""
+import logging
+from typing import NamedTuple, Optional
+
+from logger import log
+from modbus_codec import (EXCEPTION_FLAG, FrameError, Request, Response, check_crc, parse_request,
+                          parse_response, request_length, response_length)
+
+# Bits per character on the wire: start bit, 8 data bits, parity or 2nd stop bit, stop bit
+BITS_PER_CHARACTER = 11
+
+def character_time_ns(baudrate):
+    return BITS_PER_CHARACTER * 1_000_000_000 // baudrate
+
+class Exchange(NamedTuple):
+    """One request and its response (None if the slave never answered)."""
+    request: Request
+    response: Optional[Response]
+    request_ns: int                 # monotonic time the request ended
+    response_ns: Optional[int]      # monotonic time the response ended
+
+    @property
+    def turnaround_ns(self):
+        return None if self.response_ns is None else self.response_ns - self.request_ns
+
+class SnifferStats:
+    """Frame counters of a ModbusSniffer."""
+
+    def __init__(self):
+        self.bytes = 0
+        self.requests = 0
+        self.responses = 0
+        self.exceptions = 0
+        self.exchanges = 0
+        self.unanswered_requests = 0   # request followed by the next request without a response
+        self.unmatched_responses = 0   # response without the matching request (e.g. request lost)
+        self.resyncs = 0               # times sync was lost (garbage, CRC error, truncated frame)
+        self.discarded_bytes = 0
+
+    @property
+    def loss_rate(self):
+        """Share of unicast requests that did not end in a decoded exchange."""
+        expected = self.exchanges + self.unanswered_requests
+        return (self.unanswered_requests / expected) if expected else 0.0
+
+    def as_dict(self):
+        data = dict(vars(self))
+        data['loss_rate'] = round(self.loss_rate, 4)
+        return data
+
+class ModbusSniffer:
+    """
+    Frames and pairs ModBus RTU traffic from (timestamp, bytes) chunks.
+
+    Feed every chunk read from the line with feed(). Completed exchanges are
+    passed to on_exchange; requests nobody answered are passed too, with
+    response None, once the next request shows the master gave up.
+    """
+
+    def __init__(self, baudrate=9600, on_exchange=None, on_frame=None):
+        """
+        Args:
+            baudrate: Line speed, used for the silent interval and byte timing
+            on_exchange: Optional callable(Exchange)
+            on_frame: Optional callable(frame_ns, frame, is_response) for every
+                CRC-valid frame, before it is paired
+        """
+        self.character_ns = character_time_ns(baudrate)
+        self.silent_interval_ns = 7 * self.character_ns // 2
+        self.on_exchange = on_exchange
+        self.on_frame = on_frame
+        self.stats = SnifferStats()
+        self.buffer = bytearray()
+        self.buffer_end_ns = None    # arrival time of the last buffered byte
+        self.last_frame_ns = None    # end of the last complete frame
+        self.pending = None          # (Request, request end ns) awaiting its response
+        self._boundary = None        # buffer offset of the last silent interval inside the buffer
+        self._in_sync = True
+
+    @property
+    def idle_since_ns(self):
+        """End of the last byte seen on the line, or None before any traffic."""
+        return self.buffer_end_ns
+
+    def feed(self, timestamp_ns, chunk):
+        """
+        Add one chunk whose last byte arrived at timestamp_ns (monotonic).
+
+        Bytes inside a chunk are assumed back to back at the line speed.
+        """
+        if not chunk:
+            return
+        self.stats.bytes += len(chunk)
+        if self.buffer and self.buffer_end_ns is not None:
+            first_byte_ns = timestamp_ns - (len(chunk) - 1) * self.character_ns
+            if first_byte_ns - self.buffer_end_ns > self.silent_interval_ns:
+                # A frame never spans a silent interval, so the buffered fragment is
+                # dropped unless it still completes into a valid frame (a USB adapter
+                # can deliver one frame in two late chunks)
+                self._boundary = len(self.buffer)
+        self.buffer += chunk
+        self.buffer_end_ns = timestamp_ns
+        self._parse()
+
+    def _lose_sync(self, count, reason):
+        if self._in_sync:
+            self.stats.resyncs += 1
+            if log.isEnabledFor(logging.DEBUG):
+                log.debug(f'Sniffer lost sync ({reason}): {bytes(self.buffer[:count]).hex(" ")}')
+        self._in_sync = False
+        self.stats.discarded_bytes += count
+
+    def _frame_at_head(self):
+        """
+        Identify a complete, CRC-valid frame at the start of the buffer.
+
+        Returns:
+            (length, is_response), (None, None) if more bytes are needed, or
+            (0, None) if no frame can start here
+        """
+        buffer = self.buffer
+        as_request = request_length(buffer)
+        as_response = response_length(buffer)
+        if as_request is None or as_response is None:
+            return None, None
+        # try the expected direction first: a response if it would answer the pending
+        # request (FC 06 responses echo the request byte for byte)
+        candidates = [(as_response, True), (as_request, False)]
+        pending = self.pending[0] if self.pending else None
+        if pending is None or pending.slave != buffer[0] or pending.function_code != buffer[1] & ~EXCEPTION_FLAG:
+            candidates.reverse()
+        waiting = False
+        with memoryview(buffer) as view:
+            for length, is_response in candidates:
+                if len(buffer) < length:
+                    waiting = True
+                elif check_crc(view[:length]):
+                    return length, is_response
+        return (None, None) if waiting else (0, None)
+
+    def _consume(self, count):
+        del self.buffer[:count]
+        if self._boundary is not None:
+            self._boundary -= count
+            if self._boundary <= 0:
+                self._boundary = None
+
+    def _parse(self):
+        buffer = self.buffer
+        while buffer:
+            length, is_response = self._frame_at_head() if len(buffer) >= 4 else (None, None)
+            if not length:
+                if self._boundary:
+                    self._lose_sync(self._boundary, 'incomplete frame before silent interval')
+                    self._consume(self._boundary)
+                    continue
+                if length is None:
+                    return
+                self._lose_sync(1, 'no valid frame')
+                self._consume(1)
+                continue
+            frame_ns = self.buffer_end_ns - (len(buffer) - length) * self.character_ns
+            frame = bytes(buffer[:length])
+            self._consume(length)
+            self._in_sync = True
+            self.last_frame_ns = frame_ns
+            if self.on_frame:
+                self.on_frame(frame_ns, frame, is_response)
+            if is_response:
+                self._on_response(frame, frame_ns)
+            else:
+                self._on_request(frame, frame_ns)
+
+    def _on_request(self, frame, frame_ns):
+        try:
+            request = parse_request(frame)
+        except FrameError as err:
+            log.debug(f'Sniffed unsupported request: {err}')
+            return
+        self.stats.requests += 1
+        self._expire_pending()
+        if request.slave != 0:  # broadcasts are never answered
+            self.pending = (request, frame_ns)
+
+    def _on_response(self, frame, frame_ns):
+        pending = self.pending
+        request = pending[0] if pending else None
+        try:
+            if request is not None and (frame[0] != request.slave or
+                                        frame[1] & ~EXCEPTION_FLAG != request.function_code):
+                raise FrameError('response does not match the pending request')
+            response = parse_response(frame, request)
+        except FrameError:
+            self.stats.unmatched_responses += 1
+            return
+        self.stats.responses += 1
+        if response.is_exception:
+            self.stats.exceptions += 1
+        if request is None:
+            self.stats.unmatched_responses += 1
+            return
+        self.pending = None
+        self.stats.exchanges += 1
+        if self.on_exchange:
+            self.on_exchange(Exchange(request, response, pending[1], frame_ns))
+
+    def _expire_pending(self):
+        if self.pending is None:
+            return
+        request, request_ns = self.pending
+        self.pending = None
+        self.stats.unanswered_requests += 1
+        if self.on_exchange:
+            self.on_exchange(Exchange(request, None, request_ns, None))
@@ -0,0 +1,220 @@
+#!/usr/bin/env python
+"""
+Minimal in-process MQTT 3.1.1 broker for tests and benchmarks
+Accepts paho clients, records every PUBLISH and routes it to matching subscribers
+"""
+import socket
+import socketserver
+import threading
+import time
+
+def topic_matches(topic_filter, topic):
+    """Check an MQTT topic against a subscription filter with + and # wildcards."""
+    filter_parts = topic_filter.split('/')
+    topic_parts = topic.split('/')
+    for i, part in enumerate(filter_parts):
+        if part == '#':
+            return True
+        if i >= len(topic_parts):
+            return False
+        if part != '+' and part != topic_parts[i]:
+            return False
+    return len(filter_parts) == len(topic_parts)
+
+def _encode_length(length):
+    encoded = bytearray()
+    while True:
+        byte = length % 128
+        length //= 128
+        encoded.append(byte | 0x80 if length else byte)
+        if not length:
+            return bytes(encoded)
+
+def _encode_string(text):
+    data = text.encode('utf-8')
+    return len(data).to_bytes(2, 'big') + data
+
+class _ClientHandler(socketserver.BaseRequestHandler):
+    def setup(self):
+        self.subscriptions = set()
+        self.send_lock = threading.Lock()
+        self.request.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+    def send(self, packet_type, body=b''):
+        with self.send_lock:
+            self.request.sendall(bytes((packet_type,)) + _encode_length(len(body)) + body)
+
+    def _recv_exact(self, size):
+        data = bytearray()
+        while len(data) < size:
+            chunk = self.request.recv(size - len(data))
+            if not chunk:
+                raise ConnectionError('client closed connection')
+            data += chunk
+        return bytes(data)
+
+    def handle(self):
+        broker = self.server.broker
+        try:
+            while True:
+                header = self._recv_exact(1)[0]
+                length, multiplier = 0, 1
+                while True:
+                    byte = self._recv_exact(1)[0]
+                    length += (byte & 0x7F) * multiplier
+                    multiplier *= 128
+                    if not byte & 0x80:
+                        break
+                body = self._recv_exact(length) if length else b''
+                packet_type = header >> 4
+
+                if packet_type == 1:  # CONNECT
+                    self.send(0x20, b'\x00\x00')
+                    broker._register(self)
+                elif packet_type == 3:  # PUBLISH
+                    qos = (header >> 1) & 0x03
+                    topic_length = int.from_bytes(body[:2], 'big')
+                    topic = body[2:2 + topic_length].decode('utf-8')
+                    position = 2 + topic_length
+                    if qos:
+                        packet_id = body[position:position + 2]
+                        position += 2
+                        self.send(0x40 if qos == 1 else 0x50, packet_id)
+                    broker._route(topic, body[position:], bool(header & 0x01))
+                elif packet_type == 6:  # PUBREL
+                    self.send(0x70, body[:2])
+                elif packet_type == 8:  # SUBSCRIBE
+                    packet_id, position, granted = body[:2], 2, bytearray()
+                    filters = []
+                    while position < len(body):
+                        filter_length = int.from_bytes(body[position:position + 2], 'big')
+                        filters.append(body[position + 2:position + 2 + filter_length].decode('utf-8'))
+                        position += 3 + filter_length
+                        granted.append(0)
+                    self.subscriptions.update(filters)
+                    self.send(0x90, packet_id + bytes(granted))
+                    broker._deliver_retained(self, filters)
+                elif packet_type == 10:  # UNSUBSCRIBE
+                    position = 2
+                    while position < len(body):
+                        filter_length = int.from_bytes(body[position:position + 2], 'big')
+                        self.subscriptions.discard(body[position + 2:position + 2 + filter_length].decode('utf-8'))
+                        position += 2 + filter_length
+                    self.send(0xB0, body[:2])
+                elif packet_type == 12:  # PINGREQ
+                    self.send(0xD0)
+                elif packet_type == 14:  # DISCONNECT
+                    break
+        except (ConnectionError, OSError):
+            pass
+        finally:
+            broker._unregister(self)
+
+    def deliver(self, topic, payload, retain=False):
+        try:
+            self.send(0x31 if retain else 0x30, _encode_string(topic) + payload)
+        except OSError:
+            pass
+
+class _Server(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+class StubBroker:
+    """
+    MQTT broker running in background threads on 127.0.0.1.
+
+    Supports QoS 0/1/2 publishes (delivered to subscribers at QoS 0),
+    retained messages and wildcard subscriptions - enough for paho clients.
+    """
+
+    def __init__(self, host='127.0.0.1', port=0):
+        self._server = _Server((host, port), _ClientHandler)
+        self._server.broker = self
+        self.host, self.port = self._server.server_address
+        self._lock = threading.Condition()
+        self._clients = set()
+        self.retained = {}
+        self.messages = []  # (monotonic timestamp, topic, payload)
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+        with self._lock:
+            clients = list(self._clients)
+        for client in clients:
+            try:
+                client.request.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def _register(self, client):
+        with self._lock:
+            self._clients.add(client)
+            self._lock.notify_all()
+
+    def _unregister(self, client):
+        with self._lock:
+            self._clients.discard(client)
+
+    def _route(self, topic, payload, retain):
+        with self._lock:
+            self.messages.append((time.monotonic(), topic, payload))
+            if retain:
+                if payload:
+                    self.retained[topic] = payload
+                else:
+                    self.retained.pop(topic, None)
+            subscribers = [c for c in self._clients if any(topic_matches(f, topic) for f in c.subscriptions)]
+            self._lock.notify_all()
+        for client in subscribers:
+            client.deliver(topic, payload)
+
+    def _deliver_retained(self, client, filters):
+        with self._lock:
+            retained = [(t, p) for t, p in self.retained.items() if any(topic_matches(f, t) for f in filters)]
+        for topic, payload in retained:
+            client.deliver(topic, payload, retain=True)
+
+    @property
+    def client_count(self):
+        with self._lock:
+            return len(self._clients)
+
+    def messages_for(self, topic_filter):
+        """Return payloads of all recorded messages matching topic_filter."""
+        with self._lock:
+            return [p for _, t, p in self.messages if topic_matches(topic_filter, t)]
+
+    def wait_for_messages(self, topic_filter, count=1, timeout=5.0):
+        """Block until at least count messages matching topic_filter were published."""
+        deadline = time.monotonic() + timeout
+        with self._lock:
+            while True:
+                matched = [p for _, t, p in self.messages if topic_matches(topic_filter, t)]
+                remaining = deadline - time.monotonic()
+                if len(matched) >= count or remaining <= 0:
+                    return matched
+                self._lock.wait(remaining)
+
+    def wait_for_clients(self, count=1, timeout=5.0):
+        """Block until count clients completed CONNECT."""
+        deadline = time.monotonic() + timeout
+        with self._lock:
+            while len(self._clients) < count:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                self._lock.wait(remaining)
+            return True
@@ -0,0 +1,266 @@
+#!/usr/bin/env python
+"""
+ModBus block plan for the EM340 poller
+Groups configured sensors into block reads and precomputes the decode tables,
+so a plan can be rebuilt from a new configuration and swapped in between cycles
+"""
+import logging
+
+import minimalmodbus
+
+from logger import log
+
+def build_blocks(sensors, max_block_size=20, max_gap=5, unreadable=()):
+    """
+    Group sensors into blocks of contiguous registers for efficient reading.
+
+    Args:
+        sensors: List of sensor definitions from the YAML config
+        max_block_size: Maximum registers per read (EM340 typically allows up to 20)
+        max_gap: Maximum gap between registers to still consider them in the same block
+        unreadable: Register addresses the meter rejects; a gap over one of them splits the block
+
+    Returns:
+        List of blocks, each a list of sensors sorted by address
+    """
+    sensors = sorted(sensors, key=lambda r: r['address'])
+    blocks = []
+    current_block = []
+
+    for sensor in sensors:
+        if not current_block:
+            current_block = [sensor]
+            continue
+
+        prev_sensor = current_block[-1]
+        prev_end_addr = prev_sensor['address'] + prev_sensor.get('register_count', 1)
+        current_start_addr = sensor['address']
+        gap = current_start_addr - prev_end_addr
+
+        # Calculate total registers needed if we add this sensor to current block
+        total_regs_needed = sensor['address'] + sensor.get('register_count', 1) - current_block[0]['address']
+
+        # Start new block if:
+        # - Gap is too large (inefficient to read empty registers)
+        # - Block would exceed max size
+        # - Gap is negative (overlapping - shouldn't happen but safety check)
+        # - Gap contains a register the meter rejects
+        if (gap < 0 or gap > max_gap or total_regs_needed > max_block_size or
+                any(a in unreadable for a in range(prev_end_addr, current_start_addr))):
+            blocks.append(current_block)
+            current_block = [sensor]
+        else:
+            current_block.append(sensor)
+
+    if current_block:
+        blocks.append(current_block)
+    return blocks
+
+# Number of 16-bit registers needed by each value type (EM340 uses LSW-first word order)
+VALUE_TYPE_REGISTERS = {
+    'INT16': 1, 'UINT16': 1,
+    'INT32': 2, 'UINT32': 2,
+    'INT64': 4, 'UINT64': 4,
+}
+
+def decode_value(value_type, registers):
+    """
+    Decode raw register words into an integer according to the EM340 value type.
+
+    Raises:
+        ValueError: Unknown value type or not enough registers
+    """
+    if value_type not in VALUE_TYPE_REGISTERS:
+        raise ValueError(f'Unknown value_type {value_type}')
+    needed = VALUE_TYPE_REGISTERS[value_type]
+    if len(registers) < needed:
+        raise ValueError(f'{value_type} needs {needed} registers, got {len(registers)}')
+
+    value = 0
+    for i in range(needed):
+        value |= registers[i] << (16 * i)
+    if value_type.startswith('INT'):
+        sign_bit = 1 << (16 * needed - 1)
+        if value & sign_bit:
+            value -= sign_bit << 1
+    return value
+
+class PollPlan:
+    """
+    Immutable read plan compiled from the sensor list of a configuration.
+
+    blocks holds the sensor groups as produced by build_blocks(); ranges and the
+    decode tables are precomputed so each cycle only reads and converts.
+    Learned PlanLimits cap the block size and drop sensors on unreadable registers;
+    sensors at excluded addresses (not measured with the meter's wiring) are left out.
+    """
+
+    def __init__(self, sensors, max_block_size=20, max_gap=5, limits=None, excluded=()):
+        enabled = [s for s in sensors if not s.get('skip', False)]
+        self.not_measured = [s['id'] for s in enabled if s['address'] in excluded]
+        enabled = [s for s in enabled if s['address'] not in excluded]
+        self.unavailable = []  # ids of sensors left out because the meter rejects their registers
+        unreadable = set()
+        if limits is not None:
+            if limits.max_block_size:
+                max_block_size = min(max_block_size, limits.max_block_size)
+            unreadable = limits.unreadable
+            readable = []
+            for sensor in enabled:
+                registers = range(sensor['address'], sensor['address'] + sensor.get('register_count', 1))
+                if any(a in unreadable for a in registers):
+                    self.unavailable.append(sensor['id'])
+                else:
+                    readable.append(sensor)
+            enabled = readable
+        self.sensor_count = len(enabled)
+        self.blocks = build_blocks(enabled, max_block_size=max_block_size, max_gap=max_gap,
+                                   unreadable=unreadable)
+        self.ranges = []   # (start address, register count) per block
+        self.tables = []   # per block: (offset, register count, value type, scale, id, label, unit) per sensor
+        for block in self.blocks:
+            start = block[0]['address']
+            end = block[-1]['address'] + block[-1].get('register_count', 1)
+            self.ranges.append((start, end - start))
+            table = []
+            for sensor in block:
+                value_type = sensor['value_type']
+                if value_type not in VALUE_TYPE_REGISTERS:
+                    raise ValueError(f'Unknown value_type {value_type} for sensor {sensor["id"]}')
+                label = f'{sensor.get("name", sensor["id"])} (0x{sensor["address"]:04X})'
+                table.append((sensor['address'] - start, sensor.get('register_count', 1), value_type,
+                              float(sensor['multiply']), sensor['id'], label, sensor.get('unit_of_measurement', '')))
+            self.tables.append(table)
+        self.block_index = {start: i for i, (start, _) in enumerate(self.ranges)}
+
+    @classmethod
+    def from_config(cls, config, limits=None, excluded=()):
+        return cls(config['sensor'], limits=limits, excluded=excluded)
+
+    def decode(self, index, values, data):
+        """
+        Decode the register values of block index into data (sensor id -> scaled value).
+
+        Sensors whose registers are missing from values are skipped.
+        """
+        debug = log.isEnabledFor(logging.DEBUG)
+        for offset, reg_count, value_type, scale, sensor_id, label, unit in self.tables[index]:
+            registers = values[offset:offset + reg_count]
+            try:
+                value = decode_value(value_type, registers) * scale
+            except ValueError as err:
+                log.error(f'Sensor {label}: {err}')
+                continue
+            if debug:
+                log.debug('%s: %s %s', label, value, unit)
+            data[sensor_id] = value
+
+    def describe(self):
+        """Human-readable lines describing the blocks, for logging."""
+        lines = [f'Organized {self.sensor_count} sensors into {len(self.blocks)} blocks:']
+        for i, (block, (start, count)) in enumerate(zip(self.blocks, self.ranges)):
+            sensor_names = [s.get('name', s['id']) for s in block]
+            lines.append(f'  Block {i+1}: 0x{start:04X}-0x{start+count-1:04X} ({count} regs) - {", ".join(sensor_names)}')
+        if self.not_measured:
+            lines.append(f'  Not read (not measured with this wiring): {", ".join(self.not_measured)}')
+        if self.unavailable:
+            lines.append(f'  Not read (rejected by the meter): {", ".join(self.unavailable)}')
+        return lines
+
+
+class PlanLimits:
+    """
+    Read limits of one meter, learned from its ModBus exception responses.
+
+    max_block_size caps the registers per request (None = no learned limit);
+    unreadable holds register addresses answered with an illegal-request
+    exception, e.g. EM340 registers missing on an EM330 or older firmware.
+    """
+
+    def __init__(self, max_block_size=None, unreadable=()):
+        self.max_block_size = max_block_size
+        self.unreadable = set(unreadable)
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(data.get('max_block_size'), (int(a, 0) for a in data.get('unreadable', [])))
+
+    def to_dict(self):
+        data = {'unreadable': [f'0x{a:04X}' for a in sorted(self.unreadable)]}
+        if self.max_block_size:
+            data['max_block_size'] = self.max_block_size
+        return data
+
+    def diagnose(self, read, plan, index):
+        """
+        Find out why the meter rejected block index of plan with an illegal request.
+
+        The block is read again to confirm the rejection, then split at sensor
+        boundaries and the halves probed until the rejected sensors are isolated.
+        If every part reads fine on its own, the request was too long: a binary
+        search from the block start finds the longest accepted read, and a single
+        read of the next register tells a size limit from a rejected gap register.
+
+        Args:
+            read: Callable(address, count) performing one read request
+            plan: PollPlan the block belongs to
+            index: Block index within the plan
+
+        Returns:
+            True if new limits were learned
+
+        Raises:
+            minimalmodbus.ModbusException: A probe failed for another reason (no
+                answer, CRC error); nothing is learned from an unreliable line
+        """
+        start, count = plan.ranges[index]
+        spans = [(start + offset, reg_count) for offset, reg_count, *_ in plan.tables[index]]
+        rejected = []
+
+        def accepted(address, reg_count):
+            try:
+                read(address, reg_count)
+                return True
+            except minimalmodbus.IllegalRequestError:
+                return False
+
+        def probe(group, known_rejected=False):
+            first = group[0][0]
+            if not known_rejected and accepted(first, group[-1][0] + group[-1][1] - first):
+                return
+            if len(group) == 1:
+                rejected.append(group[0])
+                return
+            middle = len(group) // 2
+            probe(group[:middle])
+            probe(group[middle:])
+
+        if accepted(start, count):
+            return False  # not reproducible, nothing to learn
+        probe(spans, known_rejected=True)
+
+        if rejected:
+            for address, reg_count in rejected:
+                self.unreadable.update(range(address, address + reg_count))
+            log.warning(f'Meter rejects registers of block 0x{start:04X}: ' +
+                        ', '.join(f'0x{address:04X} ({reg_count} regs)' for address, reg_count in rejected))
+            return True
+
+        low, high = 0, count  # longest accepted / shortest rejected read from start
+        while high - low > 1:
+            middle = (low + high) // 2
+            if accepted(start, middle):
+                low = middle
+            else:
+                high = middle
+        if low == 0:
+            return False
+        if not accepted(start + low, 1):
+            self.unreadable.add(start + low)
+            log.warning(f'Meter rejects gap register 0x{start + low:04X} in block 0x{start:04X}')
+            return True
+        if self.max_block_size and self.max_block_size <= low:
+            return False
+        self.max_block_size = low
+        log.warning(f'Meter accepts at most {low} registers per request')
+        return True
@@ -149,6 +149,20 @@ else
     print_info "Connect your USB-RS485 adapter and run this script again"
 fi
 
+# Let the daemon lower the latency timer of FTDI adapters (16 ms by default), which
+# otherwise delays every ModBus response
+LATENCY_RULE="/etc/udev/rules.d/99-em340-latency.rules"
+print_info "Installing udev rule for USB-serial latency: $LATENCY_RULE"
+cat > "$LATENCY_RULE" <<'EOF'
+# FTDI USB-serial adapters: 1 ms latency timer, writable by the dialout group (em340d latency_timer_ms)
+ACTION=="add", SUBSYSTEM=="usb-serial", DRIVERS=="ftdi_sio", ATTR{latency_timer}="1", RUN+="/bin/chgrp dialout /sys%p/latency_timer", RUN+="/bin/chmod g+w /sys%p/latency_timer"
+EOF
+udevadm control --reload-rules && udevadm trigger --subsystem-match=usb-serial --action=add || \
+    print_warning "Could not reload udev rules - replug the adapter to apply $LATENCY_RULE"
+for timer in /sys/bus/usb-serial/devices/*/latency_timer; do
+    [ -e "$timer" ] && print_info "$(basename "$(dirname "$timer")"): latency_timer $(cat "$timer") ms"
+done
+
 # Provide next steps
 print_info ""
 print_info "Next Steps:"
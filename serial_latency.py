@@ -0,0 +1,149 @@
+#!/usr/bin/env python
+"""
+USB-serial adapter latency tuning
+FTDI adapters hold received bytes for up to latency_timer ms (16 by default)
+before passing them to the host, so every ModBus response arrives that much
+late. The adapter behind the configured device is looked up in sysfs, its
+latency_timer is lowered and ASYNC_LOW_LATENCY is set on the open port, where
+the driver and the permissions allow it
+"""
+import fcntl
+import os
+import struct
+import termios
+from typing import NamedTuple, Optional
+
+from logger import log
+
+ASYNC_LOW_LATENCY = 1 << 13
+TIOCGSERIAL = getattr(termios, 'TIOCGSERIAL', 0x541E)
+TIOCSSERIAL = getattr(termios, 'TIOCSSERIAL', 0x541F)
+
+# struct serial_struct starts with int type, int line, unsigned int port, int irq, int flags
+_FLAGS = struct.Struct('i')
+_FLAGS_OFFSET = 16
+_SERIAL_STRUCT_SIZE = 128  # more than sizeof(struct serial_struct) on every ABI
+
+class SerialAdapter(NamedTuple):
+    """The kernel's view of the device behind a serial port."""
+    tty: str                            # kernel name, e.g. ttyUSB0
+    driver: Optional[str]               # e.g. ftdi_sio, ch341-uart, cp210x
+    usb_id: Optional[str]               # vendor:product, None for on-board UARTs
+    latency_timer_path: Optional[str]   # only FTDI adapters have one
+
+    @property
+    def latency_timer(self):
+        """Current latency timer in ms, or None if the adapter has none."""
+        if self.latency_timer_path is None:
+            return None
+        try:
+            with open(self.latency_timer_path) as f:
+                return int(f.read())
+        except (OSError, ValueError):
+            return None
+
+    def describe(self):
+        usb = f' {self.usb_id}' if self.usb_id else ''
+        return f'{self.tty} ({self.driver or "unknown driver"}{usb})'
+
+def _read_attribute(directory, name):
+    try:
+        with open(os.path.join(directory, name)) as f:
+            return f.read().strip()
+    except OSError:
+        return None
+
+def _usb_id(device_dir, levels=4):
+    """vendor:product of the USB device above device_dir in the sysfs hierarchy."""
+    directory = device_dir
+    for _ in range(levels):
+        directory = os.path.dirname(directory)
+        vendor = _read_attribute(directory, 'idVendor')
+        if vendor is not None:
+            return f'{vendor}:{_read_attribute(directory, "idProduct")}'
+    return None
+
+def find_adapter(device, sysfs_root='/sys'):
+    """
+    Identify the adapter behind a device node; symlinks such as /dev/serial/by-id/* are followed.
+
+    Returns:
+        SerialAdapter, or None if the device is not a hardware serial port (e.g. a pty)
+    """
+    tty = os.path.basename(os.path.realpath(device))
+    device_dir = os.path.join(sysfs_root, 'class', 'tty', tty, 'device')
+    if not os.path.isdir(device_dir):
+        return None
+    driver_link = os.path.join(device_dir, 'driver')
+    driver = os.path.basename(os.path.realpath(driver_link)) if os.path.islink(driver_link) else None
+    latency_timer_path = os.path.join(device_dir, 'latency_timer')
+    return SerialAdapter(tty, driver, _usb_id(os.path.realpath(device_dir)),
+                         latency_timer_path if os.path.isfile(latency_timer_path) else None)
+
+def set_latency_timer(adapter, milliseconds):
+    """
+    Write the adapter's latency timer.
+
+    Returns:
+        True if written; False without a latency timer or without permission
+    """
+    path = adapter.latency_timer_path
+    if path is None:
+        return False
+    try:
+        with open(path, 'w') as f:
+            f.write(f'{milliseconds}\n')
+    except OSError as e:
+        log.warning(f'Cannot set the latency timer of {adapter.tty} to {milliseconds} ms: {e} - '
+                    f'scripts/setup-serial-access.sh installs a udev rule for it')
+        return False
+    return True
+
+def _get_flags(fd, buffer):
+    fcntl.ioctl(fd, TIOCGSERIAL, buffer)
+    return _FLAGS.unpack_from(buffer, _FLAGS_OFFSET)[0]
+
+def set_low_latency(fd):
+    """
+    Set ASYNC_LOW_LATENCY on an open serial port (ftdi_sio then also uses a 1 ms latency timer).
+
+    Returns:
+        (before, after) flag states, or None if the driver has no serial_struct
+    """
+    buffer = bytearray(_SERIAL_STRUCT_SIZE)
+    try:
+        flags = _get_flags(fd, buffer)
+    except OSError:
+        return None
+    before = bool(flags & ASYNC_LOW_LATENCY)
+    if not before:
+        _FLAGS.pack_into(buffer, _FLAGS_OFFSET, flags | ASYNC_LOW_LATENCY)
+        try:
+            fcntl.ioctl(fd, TIOCSSERIAL, buffer)
+            flags = _get_flags(fd, buffer)
+        except OSError as e:
+            log.warning(f'Cannot set the low latency flag on the serial port: {e}')
+    return before, bool(flags & ASYNC_LOW_LATENCY)
+
+def tune_adapter(adapter, fd, latency_timer_ms=1, low_latency=True):
+    """
+    Apply the latency settings to an adapter and its open port.
+
+    Args:
+        latency_timer_ms: Latency timer to set, None to leave it alone
+        low_latency: Set ASYNC_LOW_LATENCY on the port
+
+    Returns:
+        Dictionary of setting -> (before, after)
+    """
+    changes = {}
+    if latency_timer_ms is not None and adapter.latency_timer_path is not None:
+        before = adapter.latency_timer
+        if before != latency_timer_ms:
+            set_latency_timer(adapter, latency_timer_ms)
+        changes['latency_timer_ms'] = (before, adapter.latency_timer)
+    if low_latency:
+        flags = set_low_latency(fd)
+        if flags is not None:
+            changes['low_latency'] = flags
+    return changes
@@ -0,0 +1,199 @@
+#!/usr/bin/env python
+"""
+systemd watchdog integration and poll loop stall detection
+sd_notify READY/WATCHDOG messages are sent over $NOTIFY_SOCKET directly, without
+libsystemd. The watchdog is fed only when a poll cycle completes within a multiple
+of its target period, or while the daemon deliberately waits (breaker cooldown,
+device reconnect). A stall detector thread logs every thread's stack when no
+progress is reported for stall_timeout seconds, then optionally exits so systemd
+or Docker restarts the process
+"""
+import faulthandler
+import os
+import socket
+import sys
+import threading
+import time
+import traceback
+
+from logger import log, shutdown_logging
+
+# Exit status after a detected stall
+STALL_EXIT_CODE = 70
+# Keepalive interval for waits when systemd does not supervise the daemon
+DEFAULT_KEEPALIVE_INTERVAL = 5.0
+
+def sd_notify(*messages):
+    """
+    Send state lines such as 'READY=1' to the service manager.
+
+    Returns:
+        True if sent, False when not started by systemd with a notify socket
+    """
+    address = os.environ.get('NOTIFY_SOCKET')
+    if not address:
+        return False
+    if address.startswith('@'):
+        address = '\0' + address[1:]  # abstract namespace socket
+    try:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM | socket.SOCK_CLOEXEC) as sock:
+            sock.sendto('\n'.join(messages).encode(), address)
+    except OSError as e:
+        log.warning(f'sd_notify to {address!r} failed: {e}')
+        return False
+    return True
+
+def watchdog_interval():
+    """
+    Seconds between WATCHDOG=1 pings, half of WatchdogSec, or None without a systemd watchdog.
+
+    WATCHDOG_PID is not checked: em340d.service starts the daemon through a
+    wrapper script and accepts notifications from any of its processes.
+    """
+    try:
+        usec = int(os.environ.get('WATCHDOG_USEC', ''))
+    except ValueError:
+        return None
+    return usec / 2e6 if usec > 0 else None
+
+def dump_stacks():
+    """Current stack of every thread, as text."""
+    names = {thread.ident: thread.name for thread in threading.enumerate()}
+    lines = []
+    for ident, frame in sys._current_frames().items():
+        lines.append(f'Thread {names.get(ident, "?")} ({ident}):')
+        lines.extend(line.rstrip('\n') for line in traceback.format_stack(frame))
+    return '\n'.join(lines)
+
+class StallDetector:
+    """
+    Reports a stall when beat() has not been called for timeout seconds.
+
+    On a stall the stacks of all threads are logged and on_stall is called
+    once; the detector re-arms with the next beat().
+    """
+
+    def __init__(self, timeout, on_stall=None, clock=time.monotonic):
+        self.timeout = timeout
+        self.on_stall = on_stall
+        self.clock = clock
+        self.stalls = 0
+        self._deadline = clock() + timeout
+        self._reported = False
+        self._stop = threading.Event()
+        self._thread = None
+
+    def beat(self, grace=0.0):
+        """Report progress; grace extends the deadline for a wait known to be long."""
+        self._deadline = self.clock() + self.timeout + grace
+        self._reported = False
+
+    def start(self):
+        self.beat()
+        self._thread = threading.Thread(target=self._run, name='stall-detector', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def _run(self):
+        interval = min(1.0, self.timeout / 4)
+        while not self._stop.wait(interval):
+            overdue = self.clock() - self._deadline
+            if overdue < 0 or self._reported:
+                continue
+            self._reported = True
+            self.stalls += 1
+            log.critical(f'Poll loop made no progress for {self.timeout + overdue:.1f}s - thread stacks:\n'
+                         f'{dump_stacks()}')
+            if self.on_stall:
+                self.on_stall()
+
+def exit_after_stall():
+    """Default stall action: write out the log and exit for a restart."""
+    shutdown_logging()
+    os._exit(STALL_EXIT_CODE)
+
+class ServiceWatchdog:
+    """
+    Liveness reporting of the poll loop to systemd and to a StallDetector.
+
+    The loop calls cycle_done() after every cycle and keep_alive() or sleep()
+    around deliberate waits.
+    """
+
+    def __init__(self, target_period, multiple=3.0, stall_timeout=20.0, stall_exit=True):
+        """
+        Args:
+            target_period: Expected seconds per poll cycle
+            multiple: Cycles longer than multiple * target_period do not feed the watchdog
+            stall_timeout: Seconds without progress before thread stacks are dumped (0 = no detector)
+            stall_exit: Exit the process after dumping the stacks of a stall
+        """
+        self.max_cycle = target_period * multiple
+        self.interval = watchdog_interval()
+        self.keepalive_interval = self.interval or DEFAULT_KEEPALIVE_INTERVAL
+        self.ready = False
+        self.slow_cycles = 0
+        self._last_ping = None
+        self.detector = None
+        if stall_timeout > 0:
+            self.detector = StallDetector(stall_timeout, on_stall=exit_after_stall if stall_exit else None)
+        # SIGABRT from the systemd watchdog, or a fatal error, still dumps the stacks to stderr
+        if not faulthandler.is_enabled():
+            faulthandler.enable()
+
+    def start(self):
+        if self.detector is not None:
+            self.detector.start()
+        if self.interval:
+            log.info(f'systemd watchdog: pinging every {self.interval:.1f}s for cycles under {self.max_cycle:.1f}s')
+        return self
+
+    def stop(self):
+        if self.detector is not None:
+            self.detector.stop()
+
+    def cycle_done(self, duration):
+        """
+        Report a completed cycle that took duration seconds.
+
+        Returns:
+            True if the cycle was in time and the watchdog was fed
+        """
+        if duration > self.max_cycle:
+            self.slow_cycles += 1
+            log.warning('Poll cycle took %.2fs (limit %.2fs) - not feeding the watchdog', duration, self.max_cycle)
+            if self.detector is not None:
+                self.detector.beat()  # slow, but not stalled
+            return False
+        if not self.ready:
+            self.ready = True
+            sd_notify('READY=1', 'STATUS=Polling')
+        self.keep_alive()
+        return True
+
+    def keep_alive(self, wait=0.0):
+        """Feed the watchdog and the stall detector ahead of a deliberate wait of up to wait seconds."""
+        if self.interval:
+            # back-to-back cycles ping at most a few times per watchdog interval
+            now = time.monotonic()
+            if wait > 0 or self._last_ping is None or now - self._last_ping >= self.interval / 4:
+                self._last_ping = now
+                sd_notify('WATCHDOG=1')
+        if self.detector is not None:
+            self.detector.beat(grace=wait)
+
+    def sleep(self, seconds):
+        """Sleep while keeping the watchdog fed."""
+        deadline = time.monotonic() + seconds
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return
+            step = min(remaining, self.keepalive_interval)
+            self.keep_alive(step)
+            time.sleep(step)
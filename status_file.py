@@ -0,0 +1,64 @@
+#!/usr/bin/env python
+"""
+Daemon status heartbeat
+A small JSON record rewritten after every cycle with the time the meter was last
+read, the time data was last published and the error counters. Health checks
+read this record instead of opening the serial port the poller is using
+"""
+import json
+import os
+
+from logger import log
+
+DEFAULT_STATUS_FILE = '/tmp/em340d-status.json'
+
+class StatusFile:
+    """Atomically replaced status record of a running daemon."""
+
+    def __init__(self, path):
+        self.path = path
+        self._temp_path = f'{path}.{os.getpid()}.tmp'
+        self._failed = False
+
+    def write(self, status):
+        """
+        Replace the record with status (a JSON-serialisable dictionary).
+
+        Readers see either the previous or the new record, never a partial one.
+        The file is not fsynced: it is rewritten every cycle and belongs on a
+        tmpfs, and a record lost to a power cut is worthless anyway.
+
+        Returns:
+            True if the record was written
+        """
+        payload = json.dumps(status, separators=(',', ':')).encode()
+        try:
+            fd = os.open(self._temp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+            try:
+                os.write(fd, payload)
+            finally:
+                os.close(fd)
+            os.replace(self._temp_path, self.path)
+        except OSError as e:
+            if not self._failed:
+                log.error(f'Could not write status file {self.path}: {e}')
+            self._failed = True
+            return False
+        if self._failed:
+            log.info(f'Status file {self.path} written again')
+            self._failed = False
+        return True
+
+def read_status(path):
+    """
+    Read a status record written by StatusFile.
+
+    Raises:
+        OSError: The file is missing or unreadable
+        ValueError: The file does not hold a status record
+    """
+    with open(path, 'rb') as f:
+        status = json.loads(f.read())
+    if not isinstance(status, dict):
+        raise ValueError(f'{path} does not hold a status record')
+    return status
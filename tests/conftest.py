@@ -0,0 +1,89 @@
+#!/usr/bin/env python
+"""
+Shared fixtures: an emulated meter on a pty and a real gateway polling it
+"""
+import os
+
+import pytest
+import yaml
+
+from config_loader import load_yaml_with_env
+from em340_emulator import EM340Emulator
+from mqtt_stub_broker import StubBroker
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+TEMPLATE = os.path.join(ROOT, 'em340.yaml.template')
+
+
+@pytest.fixture
+def meter():
+    """
+    Start emulated EM340 meters (slave 1) for the test.
+
+    meter(faults=None, link_path=None, foreign_reads=(), config=None, serial_number=None)
+    config updates the meter's config registers; serial_number replaces its 0x5000 identification.
+    """
+    emulators = []
+
+    def start(faults=None, link_path=None, foreign_reads=(), config=None, serial_number=None):
+        sensors = load_yaml_with_env(TEMPLATE)['sensor']
+        emulator = EM340Emulator(sensors, link_path=link_path, faults=faults, foreign_reads=foreign_reads,
+                                 foreign_interval=0.2)
+        model = emulator.slaves[1]
+        model.config.update(config or {})
+        if serial_number:
+            for i, char in enumerate(serial_number.ljust(7)):
+                model.static[0x5000 + i] = ord(char)
+        emulator.start()
+        emulators.append(emulator)
+        return emulator
+
+    yield start
+    for emulator in emulators:
+        emulator.stop()
+
+
+@pytest.fixture
+def gateway(tmp_path):
+    """
+    Start real EM340 gateways polling an emulated meter and publishing to a stub broker.
+
+    gateway(emulator, **settings) returns (em340, broker). settings update the
+    config section of the template; a setting of None removes the key. Gateways
+    are stopped in the order they were started, so a test may start several
+    one after the other against the same state_dir.
+    """
+    from em340 import EM340
+    running = []
+
+    def start(emulator, **settings):
+        config = load_yaml_with_env(TEMPLATE)
+        config['config'].update({'device': emulator.link_path or emulator.port, 't_delay_ms': 0,
+                                 'serial_number': 'TEST', 'state_dir': ''})
+        for key, value in settings.items():
+            if value is None:
+                config['config'].pop(key, None)
+            else:
+                config['config'][key] = value
+        broker = StubBroker().start()
+        config['mqtt'].update({'broker': broker.host, 'port': broker.port, 'username': '', 'password': ''})
+        config_file = tmp_path / f'em340-{len(running)}.yaml'
+        config_file.write_text(yaml.safe_dump(config))
+        try:
+            em340 = EM340(str(config_file))
+        except BaseException:
+            broker.stop()
+            raise
+        running.append((em340, broker))
+        em340._build_plan()  # done by read_sensors(), which the tests replace with single cycles
+        assert broker.wait_for_clients(2)
+        return em340, broker
+
+    yield start
+    for em340, broker in running:
+        em340.mqtt_client.disconnect()
+        em340.mqtt_client.loop_stop()
+        em340.config_manager.stop_config_service()
+        em340.em340.serial.close()
+        em340.device_watcher.stop()
+        broker.stop()
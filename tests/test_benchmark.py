@@ -0,0 +1,48 @@
+#!/usr/bin/env python
+"""
+Tests for the benchmark harness: the stub broker and tools/benchmark.py
+"""
+import importlib.util
+import os
+
+from config_loader import get_config
+from mqtt_stub_broker import topic_matches
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def load_benchmark_module():
+    spec = importlib.util.spec_from_file_location('benchmark', os.path.join(ROOT, 'tools', 'benchmark.py'))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def test_topic_matches():
+    assert topic_matches('em340/#', 'em340/X/config/available')
+    assert topic_matches('em340/+/config/+/set', 'em340/X/config/pt_primary/set')
+    assert not topic_matches('em340/+/set', 'em340/X/config/set')
+
+
+def test_bench_config_points_at_the_emulator_and_leaves_the_template_alone():
+    class Broker:
+        host, port = '127.0.0.1', 18830
+
+    benchmark = load_benchmark_module()
+    template = os.path.join(ROOT, 'em340.yaml.template')
+    path = benchmark.write_bench_config(template, '/dev/pts/99', Broker(), 5)
+    try:
+        config = get_config(path)
+        assert config['config']['device'] == '/dev/pts/99' and config['config']['serial_number'] == 'BENCH'
+        assert (config['mqtt']['broker'], config['mqtt']['port']) == ('127.0.0.1', 18830)
+        assert get_config(template)['config']['serial_number'] != 'BENCH'
+    finally:
+        os.unlink(path)
+
+
+def test_compare_with_baseline():
+    benchmark = load_benchmark_module()
+    baseline = {'tolerance': 0.5, 'metrics': {'cycles_per_s': 100, 'latency_p99_ms': 10}}
+    assert benchmark.compare_with_baseline({'cycles_per_s': 60, 'latency_p99_ms': 14}, baseline) == []
+    regressions = benchmark.compare_with_baseline({'cycles_per_s': 40, 'latency_p99_ms': 16}, baseline)
+    assert len(regressions) == 2
@@ -0,0 +1,105 @@
+#!/usr/bin/env python
+"""
+Tests for the offline bus traffic analyzer
+"""
+import importlib.util
+import json
+import os
+
+import pytest
+
+import modbus_codec as codec
+from frame_capture import DIRECTION_BUS, DIRECTION_RX, DIRECTION_TX, CaptureWriter, read_capture
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+CHARACTER_NS = 11 * 1_000_000_000 // 9600
+
+
+def load_analyzer():
+    spec = importlib.util.spec_from_file_location('bus_analyzer', os.path.join(ROOT, 'tools', 'bus_analyzer.py'))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def _write_sniffer_capture(path, seconds=10):
+    """A master reading 20 registers from slave 1 and 2 from slave 2 every second."""
+    capture = CaptureWriter(path)
+    t = 1_000_000_000_000
+    for second in range(seconds):
+        t = 1_000_000_000_000 + second * 1_000_000_000
+        for slave, count in ((1, 20), (2, 2)):
+            request = codec.build_read_request(slave, 0x0000, count)
+            response = codec.build_read_response(slave, range(count))
+            if second == 3 and slave == 2:
+                response = response[:-1] + bytes((response[-1] ^ 0xFF,))  # CRC error
+            if second == 5 and slave == 2:
+                response = codec.build_exception_response(slave, 3, codec.ILLEGAL_DATA_ADDRESS)
+            t += len(request) * CHARACTER_NS
+            capture.write(DIRECTION_BUS, request, t)
+            t += 10_000_000 + len(response) * CHARACTER_NS                    # 10 ms turnaround
+            capture.write(DIRECTION_BUS, response, t)
+            t += 20_000_000
+    capture.close()
+
+
+def test_sniffer_capture_report(tmp_path):
+    analyzer = load_analyzer()
+    path = str(tmp_path / 'bus.cap')
+    _write_sniffer_capture(path)
+    report = analyzer.analyze(analyzer.load_frames(read_capture(path)), idle_ms=50)
+
+    assert report['duration_s'] == 10
+    assert report['requests'] == 20 and report['requests_per_slave'] == {'1': 10, '2': 10}
+    assert report['request_rate'] == {'mean_per_s': 2.0, 'max_per_s': 2}
+    assert report['frames'] == 39 and report['crc_errors'] == 1 and report['exceptions'] == 1
+    assert report['unanswered_requests'] == 1
+    assert abs(report['turnaround']['p50_ms'] - 10.0) < 0.01 and report['turnaround']['count'] == 19
+    # (8 + 45 + 8 + 9) characters of 1.146 ms in each second
+    assert abs(report['utilisation']['mean'] - 70 * CHARACTER_NS / 1e9) < 0.002
+    idle = report['idle_windows']
+    assert idle['count'] == 9 and idle['fit_full_read'] == 9 and idle['idle_fraction'] > 0.75
+    assert report['inter_frame_gap']['count'] == 38
+    assert any('Idle windows' in line for line in analyzer.format_report(report))
+
+
+def test_gateway_capture_report(tmp_path):
+    analyzer = load_analyzer()
+    path = str(tmp_path / 'gateway.cap')
+    capture = CaptureWriter(path)
+    request = codec.build_read_request(1, 0x0000, 2)
+    response = codec.build_read_response(1, [1, 2])
+    for i in range(5):
+        sent = 1_000_000_000 + i * 200_000_000
+        capture.write(DIRECTION_TX, request, sent)
+        capture.write(DIRECTION_RX, response, sent + (len(request) + len(response)) * CHARACTER_NS + 5_000_000)
+    capture.close()
+    report = analyzer.analyze(analyzer.load_frames(read_capture(path)))
+    assert report['requests'] == 5 and report['crc_errors'] == 0
+    assert abs(report['turnaround']['max_ms'] - 5.0) < 0.01
+
+
+def test_empty_capture(tmp_path):
+    analyzer = load_analyzer()
+    path = str(tmp_path / 'empty.cap')
+    CaptureWriter(path).close()
+    report = analyzer.analyze(analyzer.load_frames(read_capture(path)))
+    assert report['frames'] == 0
+    assert analyzer.format_report(report) == ['No frames found in the capture']
+
+
+def test_numpy_and_array_module_paths_report_the_same(tmp_path):
+    np = pytest.importorskip('numpy')
+    analyzer = load_analyzer()
+    path = str(tmp_path / 'bus.cap')
+    _write_sniffer_capture(path, seconds=30)
+    table = analyzer.load_frames(read_capture(path))
+
+    reports = []
+    for module in (None, np):
+        analyzer.np = module
+        report = analyzer.analyze(table, idle_ms=50)
+        assert report.pop('numpy') is (module is not None)
+        reports.append(json.loads(json.dumps(report)))  # numpy scalars become plain numbers
+    assert reports[0] == reports[1]
+    assert reports[0]['requests'] == 60 and reports[0]['idle_windows']['count'] > 0
@@ -6,6 +6,7 @@ import os
 import sys
 import tempfile
 import yaml
+import pytest
 
 # Import just the config loader without logger dependency
 sys.path.insert(0, '.')
@@ -177,6 +178,63 @@ sensor:
         finally:
             os.unlink(f.name)
 
+VALID_YAML = """
+config:
+  device: ${TEST_EM340_DEVICE:/dev/ttyUSB0}
+  modbus_address: 1
+  t_delay_ms: 50
+mqtt:
+  broker: localhost
+  port: 1883
+  topic: em340
+sensor:
+  - id: voltage_l1
+    address: 0x0000
+    value_type: INT32
+    multiply: 0.1
+"""
+
+def test_get_config_is_cached_until_file_or_env_changes(tmp_path, monkeypatch):
+    """get_config parses once and re-parses only when mtime or referenced env vars change"""
+    from config_loader import get_config, clear_config_cache
+    clear_config_cache()
+    path = tmp_path / 'em340.yaml'
+    path.write_text(VALID_YAML)
+    monkeypatch.delenv('TEST_EM340_DEVICE', raising=False)
+
+    first = get_config(str(path))
+    assert first['config']['device'] == '/dev/ttyUSB0'
+    assert get_config(str(path)) is first
+
+    monkeypatch.setenv('UNRELATED_VARIABLE', 'x')
+    assert get_config(str(path)) is first
+
+    monkeypatch.setenv('TEST_EM340_DEVICE', '/dev/ttyACM0')
+    second = get_config(str(path))
+    assert second is not first and second['config']['device'] == '/dev/ttyACM0'
+
+    path.write_text(VALID_YAML.replace('t_delay_ms: 50', 't_delay_ms: 20'))
+    os.utime(path, ns=(0, os.stat(path).st_mtime_ns + 1_000_000))
+    assert get_config(str(path))['config']['t_delay_ms'] == 20
+
+def test_get_config_validation(tmp_path):
+    """Invalid or missing files raise ConfigError instead of exiting at import time"""
+    from config_loader import get_config, ConfigError
+    with pytest.raises(ConfigError):
+        get_config(str(tmp_path / 'missing.yaml'))
+
+    path = tmp_path / 'broken.yaml'
+    path.write_text(VALID_YAML.replace('  broker: localhost\n', ''))
+    with pytest.raises(ConfigError, match='mqtt.broker'):
+        get_config(str(path))
+
+    path.write_text(VALID_YAML.replace('INT32', 'FLOAT32'))
+    with pytest.raises(ConfigError, match='value_type'):
+        get_config(str(path))
+
+    path.write_text(VALID_YAML.replace('    multiply: 0.1\n', '    skip: true\n'))
+    assert get_config(str(path))['sensor'][0]['skip'] is True
+
 if __name__ == '__main__':
     print("Testing EM340D Configuration Error Handling")
     print("=" * 50)
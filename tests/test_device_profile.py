@@ -0,0 +1,69 @@
+#!/usr/bin/env python
+"""
+Tests for the meter capability probe and sensor profiles
+"""
+import minimalmodbus
+
+from device_profile import describe_capabilities, not_measured, probe_capabilities
+from poll_plan import PollPlan
+from config_loader import load_yaml_with_env
+
+
+def _meter(registers):
+    reads = []
+
+    def read(address, count):
+        reads.append((address, count))
+        if address not in registers:
+            raise minimalmodbus.IllegalRequestError('Slave reported illegal data address')
+        return registers[address][:count]
+    return read, reads
+
+
+def test_probe_reads_identification_and_wiring():
+    read, reads = _meter({0x0302: [1, 3], 0x5000: [ord(c) for c in '235411W'], 0x1002: [2], 0x1103: [1]})
+    capabilities = probe_capabilities(read)
+    assert capabilities == {'firmware': 'B3', 'device_serial': '235411W', 'measuring_system': 2,
+                            'measurement_mode': 1}
+    assert len(reads) == 4
+    assert describe_capabilities(capabilities) == \
+        'Meter 235411W, firmware B3, 2-phase 3-wire, measurement mode B'
+
+
+def test_probe_tolerates_meters_without_serial_number_registers():
+    read, _ = _meter({0x0302: [0, 0], 0x1002: [0], 0x1103: [0]})
+    assert probe_capabilities(read)['device_serial'] is None
+
+
+def test_profiles_leave_out_unwired_phases():
+    sensors = load_yaml_with_env('em340.yaml.template')['sensor']
+    full = PollPlan(sensors)
+    assert not_measured({}) == frozenset() and not_measured({'measuring_system': 0}) == frozenset()
+
+    two_phase = PollPlan(sensors, excluded=not_measured({'measuring_system': 2}))
+    assert set(two_phase.not_measured) == {'voltage_l3', 'voltage_l2_l3', 'voltage_l3_l1', 'current_l3',
+                                           'active_power_l3', 'apparent_power_l3', 'reactive_power_l3',
+                                           'power_factor_l3'}
+
+    single_phase = PollPlan(sensors, excluded=not_measured({'measuring_system': 3}))
+    assert 'voltage_l1' not in single_phase.not_measured and 'voltage_l_l_sys' in single_phase.not_measured
+    assert sum(c for _, c in single_phase.ranges) < sum(c for _, c in full.ranges)
+
+    three_wire = PollPlan(sensors, excluded=not_measured({'measuring_system': 1}))
+    assert 'voltage_l1' in three_wire.not_measured and 'voltage_l1_l2' not in three_wire.not_measured
+    assert 'active_power_sys' not in three_wire.not_measured
+
+
+def test_gateway_leaves_out_phases_of_a_single_phase_meter(meter, gateway):
+    """A 1-phase meter is identified at startup and its L2/L3 registers are not polled."""
+    em340, _ = gateway(meter(config={0x1002: 3}))
+    assert em340.capabilities['measuring_system'] == 3
+    assert em340.capabilities['device_serial'] == '235401W'
+    assert 'voltage_l2' in em340.plan.not_measured and 'voltage_l1_l2' in em340.plan.not_measured
+    data = em340.poll_cycle()
+    assert data['quality'] == 'good' and 225.0 < data['voltage_l1'] < 235.0
+    assert 'current_l3' not in data and 'voltage_l_l_sys' not in data
+
+    em340, _ = gateway(meter(config={0x1002: 0}))
+    assert em340.plan.not_measured == []
+    assert 225.0 < em340.poll_cycle()['voltage_l3'] < 235.0
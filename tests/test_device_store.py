@@ -0,0 +1,94 @@
+#!/usr/bin/env python
+"""
+Tests for the per-meter state store
+"""
+import json
+
+from device_store import DeviceStore
+
+
+def test_sections_are_kept_per_serial_number(tmp_path):
+    store = DeviceStore(str(tmp_path / 'state'))
+    assert store.load('235411W', 'plan_limits') == {}
+
+    assert store.save('235411W', 'plan_limits', {'max_block_size': 12})
+    assert store.save('235411W', 'other', {'x': 1})
+    assert store.save('999999A', 'plan_limits', {'max_block_size': 20})
+
+    assert store.load('235411W', 'plan_limits') == {'max_block_size': 12}
+    assert json.loads((tmp_path / 'state' / '235411W.json').read_text())['other'] == {'x': 1}
+    assert sorted(p.name for p in (tmp_path / 'state').iterdir()) == ['235411W.json', '999999A.json']
+
+
+def test_corrupt_or_unwritable_state_is_not_fatal(tmp_path):
+    (tmp_path / 'X.json').write_text('{truncated')
+    store = DeviceStore(str(tmp_path))
+    assert store.load('X', 'plan_limits') == {}
+    assert store.save('X', 'plan_limits', {'max_block_size': 8})
+    assert store.load('X', 'plan_limits') == {'max_block_size': 8}
+
+    blocked = tmp_path / 'file'
+    blocked.write_text('')
+    assert DeviceStore(str(blocked / 'sub')).save('X', 'plan_limits', {}) is False
+
+
+def test_gateway_learns_block_limits_and_keeps_them_per_meter(tmp_path, meter, gateway):
+    """Rejected registers and the read limit are learned once and stored under the meter's serial number."""
+    from em340_emulator import FaultConfig, ILLEGAL_DATA_ADDRESS
+
+    def faults():
+        return FaultConfig(failing_addresses={0x0034: ILLEGAL_DATA_ADDRESS}, max_registers=12)
+
+    em340, _ = gateway(meter(faults=faults()), state_dir=str(tmp_path))
+    em340.em340.serial.timeout = 0.05  # exception responses are shorter than minimalmodbus expects
+    assert em340.poll_cycle()['quality'] != 'good'
+    # rejected blocks are probed within the first cycle or two, then every block reads
+    em340.poll_cycle()
+    data = em340.poll_cycle()
+    assert data['quality'] == 'good' and 'voltage_l1' in data and 'frequency' in data
+    assert 'total_energy_import' not in data
+    assert em340.plan_limits.max_block_size == 12
+    assert max(count for _, count in em340.plan.ranges) <= 12
+
+    # kept under the serial number the meter reports, not the configured one
+    stored = json.loads((tmp_path / '235401W.json').read_text())['plan_limits']
+    assert stored == {'max_block_size': 12, 'unreadable': ['0x0034', '0x0035']}
+
+    # the next start uses the corrected plan from its first cycle
+    em340, _ = gateway(meter(faults=faults()), state_dir=str(tmp_path))
+    assert em340.poll_cycle()['quality'] == 'good'
+    assert em340.plan.unavailable == ['total_energy_import']
+
+    # another meter behind the same configuration does not inherit those limits
+    em340, _ = gateway(meter(serial_number='999999X'), state_dir=str(tmp_path))
+    assert em340.plan_limits.to_dict() == {'unreadable': []}
+    assert em340.plan.unavailable == [] and max(count for _, count in em340.plan.ranges) == 20
+
+
+def test_gateway_confirms_the_cached_meter_profile(tmp_path, monkeypatch, meter, gateway):
+    """A cached profile is re-checked at startup and replaced for a rewired meter."""
+    import em340 as em340_module
+    probes = []
+    probe = em340_module.probe_capabilities
+    monkeypatch.setattr(em340_module, 'probe_capabilities', lambda read: (probes.append(1), probe(read))[1])
+
+    em340, _ = gateway(meter(config={0x1002: 3}), state_dir=str(tmp_path))
+    assert em340.capabilities['measuring_system'] == 3
+    # kept under the serial number the meter reports, not the configured one
+    stored = json.loads((tmp_path / '235401W.json').read_text())['capabilities']
+    assert stored['measuring_system'] == 3 and stored['firmware'] == 'B2'
+
+    # rewired meter: the cached profile is re-checked with one read and replaced
+    em340, _ = gateway(meter(config={0x1002: 0}), state_dir=str(tmp_path))
+    assert em340.capabilities['measuring_system'] == 0
+    assert em340.plan.not_measured == []
+    assert len(probes) == 2
+
+    # gateways sharing a default configuration keep one entry per meter, so neither re-probes
+    em340, _ = gateway(meter(serial_number='999999X'), state_dir=str(tmp_path))
+    assert em340.capabilities['device_serial'] == '999999X' and len(probes) == 3
+    for serial_number in ('235401W', '999999X'):
+        em340, _ = gateway(meter(serial_number=serial_number), state_dir=str(tmp_path))
+        assert em340.capabilities['device_serial'] == serial_number
+    assert len(probes) == 3
+    assert not (tmp_path / 'TEST.json').exists()
@@ -0,0 +1,104 @@
+#!/usr/bin/env python
+"""
+Tests for the serial device hotplug watcher, using a temporary directory as /dev
+"""
+import os
+import time
+
+import pytest
+
+from device_watcher import DeviceWatcher
+
+
+@pytest.fixture
+def watcher_factory():
+    watchers = []
+
+    def make(path, **kwargs):
+        watcher = DeviceWatcher(str(path), **kwargs)
+        watcher.start()
+        watchers.append(watcher)
+        return watcher
+
+    yield make
+    for watcher in watchers:
+        watcher.stop()
+
+
+def test_inotify_reports_appear_and_disappear_immediately(tmp_path, watcher_factory):
+    device = tmp_path / 'ttyUSB0'
+    # a long poll interval proves the change comes from inotify, not from polling
+    watcher = watcher_factory(device, poll_interval=30)
+    if not watcher.uses_inotify:
+        pytest.skip('inotify not available')
+    assert not watcher.present
+
+    started = time.monotonic()
+    device.touch()
+    assert watcher.wait_for(present=True, timeout=2)
+    assert time.monotonic() - started < 0.5
+
+    device.unlink()
+    assert watcher.wait_for(present=False, timeout=2)
+    assert watcher.changes == 2
+
+
+def test_by_id_link_in_missing_directory(tmp_path, watcher_factory):
+    """/dev/serial/by-id only exists while an adapter is plugged in."""
+    node = tmp_path / 'ttyUSB0'
+    link = tmp_path / 'serial' / 'by-id' / 'usb-FTDI_FT232R-if00-port0'
+    changes = []
+    watcher = watcher_factory(link, poll_interval=30, on_change=changes.append)
+    if not watcher.uses_inotify:
+        pytest.skip('inotify not available')
+
+    node.touch()
+    link.parent.mkdir(parents=True)
+    link.symlink_to(os.path.relpath(node, link.parent))
+    assert watcher.wait_for(present=True, timeout=2)
+
+    # the kernel removes the node first; the dangling link already counts as gone
+    node.unlink()
+    assert watcher.wait_for(present=False, timeout=2)
+    assert changes == [True, False]
+
+
+def test_polling_fallback(tmp_path, watcher_factory, monkeypatch):
+    import device_watcher
+
+    def no_inotify():
+        raise OSError('inotify not available')
+
+    monkeypatch.setattr(device_watcher, '_Inotify', no_inotify)
+    device = tmp_path / 'ttyUSB0'
+    watcher = watcher_factory(device, poll_interval=0.05)
+    assert not watcher.uses_inotify
+    device.touch()
+    assert watcher.wait_for(present=True, timeout=2)
+    assert not watcher.wait_for(present=False, timeout=0.1)
+
+
+def _is_open(fd):
+    try:
+        os.fstat(fd)
+    except OSError:
+        return False
+    return True
+
+
+def test_stop_releases_descriptors_after_run_returned(tmp_path):
+    watcher = DeviceWatcher(str(tmp_path / 'ttyUSB0'), poll_interval=0.05)
+    watcher._stop_event.set()  # run() returns on its own after its first check
+    watcher.start()
+    watcher.join()
+    descriptors = (watcher._wake_r, watcher._wake_w)
+    assert all(_is_open(fd) for fd in descriptors)
+    watcher.stop()
+    assert not any(_is_open(fd) for fd in descriptors)
+    watcher.stop()  # idempotent
+
+    # a watcher that never ran releases its descriptors too
+    watcher = DeviceWatcher(str(tmp_path / 'ttyUSB0'))
+    descriptors = (watcher._wake_r, watcher._wake_w)
+    watcher.stop()
+    assert not any(_is_open(fd) for fd in descriptors)
@@ -28,4 +28,280 @@ def test_em340_module_imports():
             assert True, "Module import test placeholder - requires proper mocking setup"
     except Exception as e:
         # For now, we'll mark this as a known limitation
-        assert True, f"Module has complex dependencies: {e}"
\ No newline at end of file
+        assert True, f"Module has complex dependencies: {e}"
+
+def test_decode_value_word_order_and_sign():
+    """Registers are LSW first and signed types use two's complement."""
+    from poll_plan import decode_value
+    assert decode_value('UINT16', [0xFFFF]) == 0xFFFF
+    assert decode_value('INT16', [0xFFFF]) == -1
+    assert decode_value('INT32', [0x0001, 0x0002]) == 0x00020001
+    assert decode_value('INT32', [0xFFFE, 0xFFFF]) == -2
+    assert decode_value('UINT64', [1, 0, 0, 1]) == (1 << 48) + 1
+    with pytest.raises(ValueError):
+        decode_value('INT32', [1])
+    with pytest.raises(ValueError):
+        decode_value('FLOAT', [1, 2])
+
+
+def test_build_blocks_from_template():
+    """The template sensors fit into the four documented blocks."""
+    from poll_plan import build_blocks
+    from config_loader import load_yaml_with_env
+    config = load_yaml_with_env('em340.yaml.template')
+    sensors = [s for s in config['sensor'] if not s.get('skip', False)]
+    blocks = build_blocks(sensors)
+    ranges = [(b[0]['address'], b[-1]['address'] + b[-1].get('register_count', 1) - 1) for b in blocks]
+    assert ranges == [(0x0000, 0x0013), (0x0014, 0x0027), (0x0028, 0x0035), (0x004E, 0x004F)]
+
+
+def test_poll_plan_decodes_every_sensor_of_a_block():
+    """The precompiled tables decode each sensor from its own registers and scale it."""
+    from poll_plan import PollPlan, decode_value
+    from config_loader import load_yaml_with_env
+    plan = PollPlan.from_config(load_yaml_with_env('em340.yaml.template'))
+    assert plan.ranges == [(0x0000, 20), (0x0014, 20), (0x0028, 14), (0x004E, 2)]
+    for index, (start, count) in enumerate(plan.ranges):
+        values = [(start + i * 7) & 0xFFFF for i in range(count)]
+        expected, actual = {}, {}
+        for sensor in plan.blocks[index]:
+            offset = sensor['address'] - start
+            registers = values[offset:offset + sensor.get('register_count', 1)]
+            expected[sensor['id']] = decode_value(sensor['value_type'], registers) * float(sensor['multiply'])
+        plan.decode(index, values, actual)
+        assert actual == expected
+
+
+def _reload_fixture(tmp_path, sensors):
+    """An EM340 instance without hardware, loaded from a config file in tmp_path."""
+    import yaml
+    from em340 import EM340
+    from poll_plan import PlanLimits, PollPlan
+    from modbus_bus import ModbusBus
+    from config_loader import get_config
+    config_file = tmp_path / 'em340.yaml'
+    config = {'config': {'device': '/dev/null', 'modbus_address': 1, 't_delay_ms': 10},
+              'mqtt': {'broker': 'localhost', 'port': 1883, 'topic': 'em340'},
+              'sensor': sensors}
+    config_file.write_text(yaml.safe_dump(config))
+    em340 = EM340.__new__(EM340)
+    em340.config_file = str(config_file)
+    em340.em340_config = get_config(str(config_file))
+    em340._config_signature_seen = em340._config_signature()
+    em340.t_delay_seconds = 0.01
+    em340.bus = ModbusBus(None, inter_frame_delay=0.01)
+    em340.plan_limits = PlanLimits()
+    em340.capabilities = {}
+    em340.plan = PollPlan.from_config(em340.em340_config)
+    return em340, config, config_file
+
+
+def _bump_mtime(path):
+    import os
+    stat = os.stat(path)
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000))
+
+
+def test_hot_reload_swaps_plan(tmp_path):
+    import yaml
+    sensors = [{'id': 'voltage', 'address': 0, 'register_count': 2, 'value_type': 'INT32', 'multiply': 0.1}]
+    em340, config, config_file = _reload_fixture(tmp_path, sensors)
+    assert em340.reload_config_if_changed() is False
+
+    config['sensor'].append({'id': 'frequency', 'address': 0x33, 'value_type': 'INT16', 'multiply': 0.1})
+    config['config']['t_delay_ms'] = 50
+    config_file.write_text(yaml.safe_dump(config))
+    _bump_mtime(config_file)
+
+    old_plan = em340.plan
+    assert em340.reload_config_if_changed() is True
+    assert em340.plan is not old_plan
+    assert em340.plan.ranges == [(0, 2), (0x33, 1)]
+    assert em340.t_delay_seconds == 0.05
+    assert em340.bus.inter_frame_delay == 0.05
+
+
+def test_hot_reload_rejects_broken_file(tmp_path):
+    sensors = [{'id': 'voltage', 'address': 0, 'register_count': 2, 'value_type': 'INT32', 'multiply': 0.1}]
+    em340, config, config_file = _reload_fixture(tmp_path, sensors)
+    old_plan = em340.plan
+
+    config_file.write_text('config: [unclosed\n')
+    _bump_mtime(config_file)
+    assert em340.reload_config_if_changed() is False
+    assert em340.plan is old_plan
+    # The same broken version is not retried every cycle
+    assert em340.reload_config_if_changed() is False
+
+    import yaml
+    config['sensor'][0]['value_type'] = 'FLOAT'
+    config_file.write_text(yaml.safe_dump(config))
+    _bump_mtime(config_file)
+    assert em340.reload_config_if_changed() is False
+    assert em340.plan is old_plan
+
+
+def _rejecting_reader(unreadable=(), max_registers=20):
+    """A read callable that answers like a meter lacking some registers."""
+    import minimalmodbus
+    calls = []
+
+    def read(address, count):
+        rejected = count > max_registers or any(a in unreadable for a in range(address, address + count))
+        calls.append((address, count, rejected))
+        if rejected:
+            raise minimalmodbus.IllegalRequestError('Slave reported illegal data address')
+        return [0] * count
+    return read, calls
+
+
+def test_plan_limits_isolate_rejected_sensor():
+    from poll_plan import PlanLimits, PollPlan
+    from config_loader import load_yaml_with_env
+    config = load_yaml_with_env('em340.yaml.template')
+    plan = PollPlan.from_config(config)
+    read, calls = _rejecting_reader(unreadable={0x0034})
+    limits = PlanLimits()
+
+    assert limits.diagnose(read, plan, 2) is True
+    assert limits.unreadable == {0x0034, 0x0035} and limits.max_block_size is None
+    # bisection: each rejection costs a response timeout, so only the halves holding it fail
+    assert sum(rejected for _, _, rejected in calls) == 5
+
+    plan = PollPlan.from_config(config, limits=limits)
+    assert plan.unavailable == ['total_energy_import']
+    assert plan.ranges[2] == (0x0028, 12)
+    assert PlanLimits.from_dict(limits.to_dict()).unreadable == limits.unreadable
+
+
+def test_plan_limits_learn_max_block_size_and_gap_registers():
+    from poll_plan import PlanLimits, PollPlan, build_blocks
+    from config_loader import load_yaml_with_env
+    config = load_yaml_with_env('em340.yaml.template')
+    plan = PollPlan.from_config(config)
+
+    limits = PlanLimits()
+    assert limits.diagnose(_rejecting_reader(max_registers=12)[0], plan, 0) is True
+    assert limits.max_block_size == 12 and not limits.unreadable
+    assert max(count for _, count in PollPlan.from_config(config, limits=limits).ranges) <= 12
+
+    # a rejected register in a gap between two sensors splits the block there
+    sensors = [{'id': 'a', 'address': 0, 'register_count': 2, 'value_type': 'INT32', 'multiply': 1},
+               {'id': 'b', 'address': 4, 'register_count': 2, 'value_type': 'INT32', 'multiply': 1}]
+    plan = PollPlan(sensors)
+    limits = PlanLimits()
+    assert limits.diagnose(_rejecting_reader(unreadable={3})[0], plan, 0) is True
+    assert limits.unreadable == {3} and limits.max_block_size is None
+    assert PollPlan(sensors, limits=limits).ranges == [(0, 2), (4, 2)]
+    assert len(build_blocks(sensors, unreadable={2})) == 2
+
+    # a rejection that does not reproduce teaches nothing
+    assert PlanLimits().diagnose(_rejecting_reader()[0], plan, 0) is False
+
+
+def test_rejected_block_probe_survives_serial_errors(tmp_path):
+    """An adapter unplugged while a rejected block is probed leaves the plan alone."""
+    import termios
+    from config_loader import load_yaml_with_env
+    sensors = load_yaml_with_env('em340.yaml.template')['sensor']
+    em340, _, _ = _reload_fixture(tmp_path, sensors)
+    plan = em340.plan
+
+    def unplugged(address, count):
+        raise termios.error(5, 'Input/output error')
+    em340.bus.read_registers = unplugged
+
+    em340._learn_from_rejected_block(plan, 0)
+    assert em340.plan is plan
+    assert em340.plan_limits.max_block_size is None and not em340.plan_limits.unreadable
+
+
+def test_poll_cycle_over_pty(meter, gateway):
+    """The real poller reads the emulated meter and publishes to the stub broker."""
+    import json
+    from modbus_bus import PRIORITY_POLL
+    em340, broker = gateway(meter())
+    data = em340.poll_cycle()
+    assert 225.0 < data['voltage_l1'] < 235.0
+    assert 0.9 < data['power_factor_sys'] <= 1.0
+    assert 'phase_sequence' not in data
+    em340.publish(data)
+    payloads = broker.wait_for_messages('em340/TEST', 1)
+    assert 2.0 < json.loads(payloads[0])['current_l1'] < 8.0
+    # the config manager's startup cache fill shares the bus, so count poll transactions only
+    assert em340.bus.transactions[PRIORITY_POLL] == len(em340.blocks)
+
+
+def test_reconnect_reopens_only_the_transport(tmp_path, meter, gateway):
+    """Unplugging the adapter keeps MQTT sessions and the plan; polling resumes right after replug."""
+    import threading
+    import time
+    emulator = meter(link_path=str(tmp_path / 'ttyEM340'))
+    em340, broker = gateway(emulator)
+    em340.poll_cycle()
+    mqtt_client, config_manager, plan, bus = em340.mqtt_client, em340.config_manager, em340.plan, em340.bus
+
+    emulator.unplug()
+    replugged = []
+    timer = threading.Timer(0.3, lambda: (emulator.replug(), replugged.append(time.monotonic())))
+    timer.start()
+    data = em340.poll_cycle()
+    resumed = time.monotonic()
+    timer.join()
+
+    assert replugged and resumed - replugged[0] < 1.0
+    # the failed block is lost, the remaining blocks of the same cycle are read again
+    assert 0.9 < data['power_factor_sys'] <= 1.0
+    assert 225.0 < em340.poll_cycle()['voltage_l1'] < 235.0
+    assert (em340.mqtt_client, em340.config_manager, em340.plan, em340.bus) == \
+        (mqtt_client, config_manager, plan, bus)
+    assert config_manager.modbus is em340.em340
+    assert broker.client_count == 2
+
+
+def test_single_glitch_is_retried_in_place(meter, gateway):
+    """A CRC error on one block is retried without touching the transport."""
+    import minimalmodbus
+    em340, _ = gateway(meter())
+    instrument = em340.em340
+    read_registers = em340.bus.read_registers
+    failures = []
+
+    def glitch_once(address, count, **kwargs):
+        if address == 0x0028 and not failures:
+            failures.append(address)
+            raise minimalmodbus.InvalidResponseError('CRC error: 1234 instead of 4321')
+        return read_registers(address, count, **kwargs)
+
+    em340.bus.read_registers = glitch_once
+    data = em340.poll_cycle()
+    assert failures and em340.block_retry_count == 1
+    assert data['quality'] == 'good' and 'active_power_sys' in data
+    assert em340.em340 is instrument
+
+
+def test_failing_blocks_publish_partial_cycles_and_trip_breaker(meter, gateway):
+    import time
+    emulator = meter()
+    em340, _ = gateway(emulator)
+    em340.breaker.cooldown = em340.breaker.current_cooldown = 0.2
+    emulator.faults.failing_addresses[0x0014] = 4  # slave device failure on block 2 only
+    data = em340.poll_cycle()
+    assert data['quality'] == 'partial' and data['stale_blocks'] == ['0x0014']
+    assert 'voltage_l1' in data and 'active_power_sys' in data
+    assert em340.breaker.state == 'closed'
+
+    # every block fails: the breaker opens after three in a row and skips the rest
+    for address in (0x0000, 0x0028, 0x004E):
+        emulator.faults.failing_addresses[address] = 4
+    data = em340.poll_cycle()
+    assert data['quality'] == 'unavailable' and data['breaker'] == 'open'
+    assert em340.breaker.trips == 1
+    served = emulator.requests_served
+    assert em340.poll_cycle()['quality'] == 'unavailable'
+    assert emulator.requests_served == served  # open breaker keeps the bus quiet
+
+    emulator.faults.failing_addresses.clear()
+    time.sleep(0.25)
+    data = em340.poll_cycle()
+    assert data['quality'] == 'good' and 'breaker' not in data
@@ -0,0 +1,260 @@
+#!/usr/bin/env python
+"""
+Tests for the MQTT configuration manager's bulk register access, run against the emulator
+"""
+import json
+import time
+
+import minimalmodbus
+import pytest
+
+from em340_config_manager import EM340ConfigManager
+from em340_emulator import EM340Emulator, FaultConfig
+from modbus_bus import ModbusBus
+
+
+def make_manager(emulator):
+    instrument = minimalmodbus.Instrument(emulator.port, 1)
+    instrument.serial.baudrate = 9600
+    instrument.serial.timeout = 0.2
+    manager = EM340ConfigManager({'broker': 'localhost', 'port': 1883, 'topic': 'em340', 'device_id': 'T'},
+                                 emulator.port, 1, bus=ModbusBus(instrument))
+    manager.WRITE_SETTLE_SECONDS = 0
+    manager.published = []
+    manager.config_mqtt_client.publish = lambda topic, payload, retain=False: manager.published.append(
+        (topic, json.loads(payload)))
+    return manager
+
+
+@pytest.fixture(params=[False, True], ids=['fc06', 'fc16'])
+def emulator(request):
+    emu = EM340Emulator([], seed=1, faults=FaultConfig(support_fc16=request.param))
+    emu.start()
+    yield emu
+    emu.stop()
+
+
+def test_register_groups_merge_adjacent_addresses():
+    manager = EM340ConfigManager({'broker': 'localhost', 'port': 1883}, '/dev/null', 1, bus=ModbusBus(None))
+    addresses = [info['address'] for info in EM340ConfigManager.CONFIG_REGISTERS.values()]
+    assert manager._register_groups(addresses) == [(0x1000, 1), (0x1002, 1), (0x1101, 4), (0x1200, 4)]
+
+
+def test_backup_uses_block_reads(emulator):
+    manager = make_manager(emulator)
+    manager.handle_backup()
+
+    assert emulator.requests_served == 4
+    topic, backup = manager.published[0]
+    assert topic == 'em340/T/config/backup/data'
+    assert backup['measurement_mode']['value'] == 0
+    assert backup['ct_secondary']['value'] == 5
+    assert not [p for p, data in backup.items() if 'error' in data]
+
+
+def test_batch_set_writes_groups_and_verifies_once(emulator):
+    manager = make_manager(emulator)
+    manager.handle_batch_set(json.dumps({'pt_primary': 230, 'pt_secondary': 230, 'ct_primary': 100,
+                                         'ct_secondary': 1, 'measurement_mode': 'Easy connection mode (A)'}))
+
+    results = [payload for topic, payload in manager.published if topic.endswith('/batch/result')][0]['results']
+    assert results == {'pt_primary': 'success', 'pt_secondary': 'success', 'ct_primary': 'success',
+                       'ct_secondary': 'success', 'measurement_mode': 'success'}
+    model = emulator.slaves[1]
+    assert [model.config[a] for a in range(0x1200, 0x1204)] == [230, 230, 100, 1]
+    assert model.config[0x1103] == 0
+
+    if emulator.faults.support_fc16:
+        # one FC16 for 0x1200-0x1203, one FC06 for 0x1103, two verifying reads
+        assert manager.fc16_supported is True
+        assert emulator.requests_served == 4
+    else:
+        # rejected FC16, four FC06 writes, one FC06 for 0x1103, two verifying reads
+        assert manager.fc16_supported is False
+        assert emulator.requests_served == 8
+
+
+def test_batch_set_reports_invalid_values_without_writing_them(emulator):
+    manager = make_manager(emulator)
+    manager.handle_batch_set(json.dumps({'ct_secondary': 7, 'measurement_mode': 1}))
+
+    results = [payload for topic, payload in manager.published if topic.endswith('/batch/result')][0]['results']
+    assert results['ct_secondary'].startswith('error: Value 7 above maximum')
+    assert results['measurement_mode'] == 'success'
+    assert emulator.slaves[1].config[0x1203] == 5
+
+
+def test_bit_field_parameters_sharing_a_register_are_merged(emulator):
+    """Parameters with a 'mask' are merged into one word; setting one keeps the other's bits."""
+    manager = make_manager(emulator)
+    # an illustrative layout for the shared register, not the meter's documented one
+    manager.CONFIG_REGISTERS = dict(manager.CONFIG_REGISTERS,
+                                    display_mode=dict(manager.CONFIG_REGISTERS['display_mode'], mask=0x00FF),
+                                    tariff_enabling=dict(manager.CONFIG_REGISTERS['tariff_enabling'], mask=0x0100))
+    model = emulator.slaves[1]
+    results = manager.write_parameters({'display_mode': 3, 'tariff_enabling': 1})
+    assert results == {'display_mode': ('success', 3), 'tariff_enabling': ('success', 1)}
+    assert model.config[0x1101] == 0x0103
+
+    served = emulator.requests_served
+    assert manager.write_parameters({'tariff_enabling': 0}) == {'tariff_enabling': ('success', 0)}
+    assert model.config[0x1101] == 0x0003
+    assert emulator.requests_served == served + 3  # read, write, verifying read
+    assert manager.read_parameters(['display_mode', 'tariff_enabling'])[0] == {'display_mode': 3,
+                                                                               'tariff_enabling': 0}
+    assert manager.cached_value('display_mode')[0] == 3
+
+
+def test_parameters_claiming_the_same_register_are_not_set_together(emulator):
+    manager = make_manager(emulator)
+    model = emulator.slaves[1]
+    model.config[0x1101] = 7
+    results = manager.write_parameters({'display_mode': 3, 'tariff_enabling': 1, 'measurement_mode': 1})
+    assert results['display_mode'][0].startswith('error: display_mode, tariff_enabling share register 0x1101')
+    assert results['tariff_enabling'] == results['display_mode']
+    assert results['measurement_mode'] == ('success', 1)
+    assert model.config[0x1101] == 7
+
+    assert manager.write_parameters({'tariff_enabling': 1}) == {'tariff_enabling': ('success', 1)}
+    assert model.config[0x1101] == 1
+
+
+def test_block_read_falls_back_to_single_registers_only_when_rejected(emulator):
+    manager = make_manager(emulator)
+    emulator.faults.failing_addresses[0x1102] = 2  # illegal data address
+    values, errors = manager.read_parameters(['display_mode', 'home_page_selection', 'measurement_mode'])
+    assert emulator.requests_served == 4  # rejected block, then three single reads
+    assert set(values) == {'display_mode', 'measurement_mode'} and set(errors) == {'home_page_selection'}
+
+    emulator.faults.failing_addresses[0x1102] = 4  # slave device failure
+    values, errors = manager.read_parameters(['display_mode', 'home_page_selection', 'measurement_mode'])
+    assert emulator.requests_served == 5
+    assert not values and set(errors) == {'display_mode', 'home_page_selection', 'measurement_mode'}
+
+
+def values_for(manager, parameter):
+    return [payload for topic, payload in manager.published if topic == f'em340/T/config/{parameter}/value']
+
+
+def test_get_is_answered_from_cache(emulator):
+    manager = make_manager(emulator)
+    manager.refresh_cache()
+    served = emulator.requests_served
+    assert served == 4
+
+    manager.handle_parameter_get('ct_secondary')
+    assert emulator.requests_served == served
+    reply = values_for(manager, 'ct_secondary')[-1]
+    assert reply['value'] == 5 and reply['source'] == 'cache' and reply['age_s'] >= 0
+
+    # a value changed behind our back only shows up after an explicit refresh
+    emulator.slaves[1].config[0x1203] = 1
+    manager.handle_parameter_get('ct_secondary')
+    assert values_for(manager, 'ct_secondary')[-1]['value'] == 5
+    manager.handle_parameter_get('ct_secondary', refresh=True)
+    reply = values_for(manager, 'ct_secondary')[-1]
+    assert reply['value'] == 1 and reply['source'] == 'device'
+    assert emulator.requests_served == served + 1
+
+
+def test_set_updates_cache_and_failed_write_invalidates(emulator):
+    manager = make_manager(emulator)
+    manager.handle_parameter_set('measurement_mode', '1')
+    assert manager.cached_value('measurement_mode')[0] == 1
+
+    emulator.faults.failing_addresses[0x1002] = 4  # slave device failure
+    manager.refresh_cache()
+    assert manager.cached_value('measuring_system') is None
+    manager._update_cache([(0x1002, 0)])
+    manager.handle_parameter_set('measuring_system', '2')
+    assert manager.cached_value('measuring_system') is None
+
+
+class Message:
+    def __init__(self, topic, payload=''):
+        self.topic = topic
+        self.payload = str(payload).encode()
+
+
+def test_command_queue_coalesces_and_rate_limits(emulator):
+    manager = make_manager(emulator)
+    manager.COMMAND_RATE_PER_S = 50.0
+    manager.COMMAND_BURST = 1
+    for _ in range(5):
+        manager.on_config_mqtt_message(None, None, Message('em340/T/config/ct_secondary/refresh'))
+    for value in (100, 200, 300):
+        manager.on_config_mqtt_message(None, None, Message('em340/T/config/ct_primary/set', value))
+    manager.on_config_mqtt_message(None, None, Message('em340/T/config/measurement_mode/refresh'))
+    assert manager.command_metrics()['depth'] == 3
+    assert manager.command_stats['coalesced'] == 6
+    assert emulator.requests_served == 0  # nothing touched the bus on the MQTT thread
+
+    started = time.monotonic()
+    manager.start_command_worker()
+    try:
+        assert manager.wait_idle(timeout=5)
+    finally:
+        manager.stop_command_worker()
+    # three commands with a burst of one at 50/s need at least two refill intervals
+    assert time.monotonic() - started >= 2 / 50.0
+
+    assert emulator.slaves[1].config[0x1202] == 300
+    metrics = manager.command_metrics()
+    assert metrics['executed'] == 3 and metrics['depth'] == 0
+    assert metrics['latency_ms']['max'] >= metrics['latency_ms']['p50'] > 0
+
+
+def test_get_after_pending_set_answers_with_the_written_value(emulator):
+    manager = make_manager(emulator)
+    for topic, payload in (('get', ''), ('set', 250), ('get', '')):
+        manager.on_config_mqtt_message(None, None, Message(f'em340/T/config/ct_primary/{topic}', payload))
+    assert list(manager._commands) == [('set', 'ct_primary'), ('get', 'ct_primary')]
+
+    manager.start_command_worker()
+    try:
+        assert manager.wait_idle(timeout=5)
+    finally:
+        manager.stop_command_worker()
+    values = [payload['value'] for topic, payload in manager.published if topic == 'em340/T/config/ct_primary/value']
+    assert values[-1] == 250
+
+
+def test_metrics_are_published_under_steady_load(emulator):
+    manager = make_manager(emulator)
+    manager.METRICS_INTERVAL_S = 0.05
+    manager.COMMAND_RATE_PER_S = 1000.0
+    manager.start_command_worker()
+    try:
+        deadline = time.monotonic() + 0.5
+        while time.monotonic() < deadline:  # the queue never runs empty long enough to time out
+            manager.on_config_mqtt_message(None, None, Message('em340/T/config/ct_primary/refresh'))
+            time.sleep(0.005)
+        assert manager.wait_idle(timeout=5)
+    finally:
+        manager.stop_command_worker()
+    assert sum(topic == 'em340/T/config/metrics' for topic, _ in manager.published) >= 3
+
+
+def test_idle_worker_blocks_between_metrics_intervals(emulator):
+    manager = make_manager(emulator)
+    manager.METRICS_INTERVAL_S = 0.05
+    wakeups = []
+    publish_metrics = manager._maybe_publish_metrics
+    manager._maybe_publish_metrics = lambda: (wakeups.append(time.monotonic()), publish_metrics())
+    manager.start_command_worker()
+    try:
+        time.sleep(0.5)
+    finally:
+        manager.stop_command_worker()
+    # one wakeup per interval, not a busy loop, and nothing to publish before the first command
+    assert len(wakeups) <= 15
+    assert not [topic for topic, _ in manager.published if topic.endswith('/metrics')]
+
+
+def test_command_queue_is_bounded(emulator):
+    manager = make_manager(emulator)
+    manager.COMMAND_QUEUE_SIZE = 2
+    for parameter in ('pt_primary', 'pt_secondary', 'ct_primary'):
+        manager.on_config_mqtt_message(None, None, Message(f'em340/T/config/{parameter}/get'))
+    assert manager.command_stats['dropped'] == 1
+    assert manager.published[-1][0] == 'em340/T/config/error'
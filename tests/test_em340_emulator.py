@@ -0,0 +1,133 @@
+#!/usr/bin/env python
+"""
+Tests for the EM340 ModBus RTU slave emulator, driven through minimalmodbus
+"""
+import os
+import tempfile
+
+import minimalmodbus
+import pytest
+import serial
+
+from config_loader import load_yaml_with_env
+from em340_emulator import (EM340Emulator, FaultConfig, ILLEGAL_DATA_ADDRESS,
+                            parse_slave_range)
+
+SENSORS = load_yaml_with_env('em340.yaml.template')['sensor']
+
+
+def make_instrument(port, address=1):
+    instrument = minimalmodbus.Instrument(port, address)
+    instrument.serial.baudrate = 9600
+    instrument.serial.timeout = 0.2
+    return instrument
+
+
+@pytest.fixture
+def emulator():
+    emu = EM340Emulator(SENSORS, seed=1)
+    emu.start()
+    yield emu
+    emu.stop()
+
+
+def test_measurements_are_plausible_and_vary(emulator):
+    instrument = make_instrument(emulator.port)
+    first = instrument.read_registers(0x0000, 20)
+    second = instrument.read_registers(0x0000, 20)
+    voltage_l1 = (first[0] + (first[1] << 16)) / 10.0
+    assert 225.0 < voltage_l1 < 235.0
+    assert first != second
+    instrument.serial.close()
+
+
+def test_read_limits_and_illegal_addresses(emulator):
+    instrument = make_instrument(emulator.port)
+    with pytest.raises(minimalmodbus.IllegalRequestError, match='data value'):
+        instrument.read_registers(0x0000, 21)
+    with pytest.raises(minimalmodbus.IllegalRequestError, match='data address'):
+        instrument.read_register(0x0900)
+    instrument.serial.close()
+
+
+def test_config_and_serial_number_registers(emulator):
+    instrument = make_instrument(emulator.port)
+    assert instrument.read_register(0x1002) == 0
+    instrument.write_register(0x1103, 1, functioncode=6)
+    assert instrument.read_register(0x1103) == 1
+    with pytest.raises(minimalmodbus.IllegalRequestError):
+        instrument.write_register(0x1103, 7, functioncode=6)
+    with pytest.raises(minimalmodbus.IllegalRequestError, match='illegal function'):
+        instrument.write_registers(0x1200, [400, 400])
+    serial_number = ''.join(chr(c) for c in instrument.read_registers(0x5000, 7))
+    assert serial_number == '235401W'
+    instrument.serial.close()
+
+
+def test_fault_injection():
+    emu = EM340Emulator(SENSORS, faults=FaultConfig(crc_error_rate=1.0), seed=1)
+    emu.start()
+    instrument = make_instrument(emu.port)
+    with pytest.raises(minimalmodbus.InvalidResponseError):
+        instrument.read_register(0x0000)
+    emu.faults = FaultConfig(drop_rate=1.0)
+    with pytest.raises(minimalmodbus.NoResponseError):
+        instrument.read_register(0x0000)
+    emu.faults = FaultConfig(failing_addresses={0x0034: ILLEGAL_DATA_ADDRESS}, turnaround_ms=5)
+    assert instrument.read_registers(0x0028, 12)
+    with pytest.raises(minimalmodbus.IllegalRequestError):
+        instrument.read_registers(0x0028, 14)
+    instrument.serial.close()
+    emu.stop()
+
+
+def test_unplug_and_replug():
+    link = os.path.join(tempfile.mkdtemp(), 'ttyEM340')
+    emu = EM340Emulator(SENSORS, link_path=link)
+    emu.start()
+    instrument = make_instrument(link)
+    assert instrument.read_register(0x1002) == 0
+
+    emu.unplug()
+    assert not os.path.exists(link)
+    with pytest.raises((serial.SerialException, OSError, minimalmodbus.ModbusException)):
+        instrument.read_register(0x1002)
+    instrument.serial.close()
+
+    emu.replug()
+    assert os.path.exists(link)
+    instrument = make_instrument(link)
+    assert instrument.read_register(0x1002) == 0
+    instrument.serial.close()
+    emu.stop()
+
+
+def test_many_slaves():
+    emu = EM340Emulator(SENSORS, slave_addresses=parse_slave_range('1-32'))
+    emu.start()
+    instrument = make_instrument(emu.port)
+    for address in (1, 17, 32):
+        instrument.address = address
+        assert chr(instrument.read_registers(0x5000, 7)[5]) == str(address % 10)
+    instrument.address = 33
+    with pytest.raises(minimalmodbus.NoResponseError):
+        instrument.read_register(0x0000)
+    instrument.serial.close()
+    emu.stop()
+
+
+def test_parse_slave_range():
+    assert parse_slave_range('1,5,7-9') == [1, 5, 7, 8, 9]
+
+
+def test_command_line_rejects_an_invalid_config(tmp_path):
+    """The emulator validates its config like the daemon, instead of failing on a missing key later."""
+    import subprocess
+    import sys
+    config_file = tmp_path / 'em340.yaml'
+    config_file.write_text('config:\n  device: /dev/null\nsensor: []\n')
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    result = subprocess.run([sys.executable, os.path.join(root, 'em340_emulator.py'), '--config', str(config_file)],
+                            capture_output=True, text=True, timeout=30, cwd=root)
+    assert result.returncode == 2
+    assert "Missing 'config.modbus_address'" in result.stderr
@@ -28,4 +28,218 @@ def test_em340monitor_module_imports():
             assert True, "Module import test placeholder - requires proper mocking setup"
     except Exception as e:
         # For now, we'll mark this as a known limitation
-        assert True, f"Module has complex dependencies: {e}"
\ No newline at end of file
+        assert True, f"Module has complex dependencies: {e}"
+
+def _sniffer():
+    import queue
+    from config_loader import load_yaml_with_env
+    from em340monitor import ModBusParser
+    config = load_yaml_with_env('em340.yaml.template')
+    return ModBusParser(queue.Queue(), queue.Queue(), config), config
+
+
+def _exchange(address, values):
+    """Master request and slave response bytes of one FC 03 read."""
+    from modbus_codec import append_crc
+    request = append_crc(bytes((1, 3, address >> 8, address & 0xFF, 0, len(values))))
+    payload = b''.join(v.to_bytes(2, 'big') for v in values)
+    response = append_crc(bytes((1, 3, len(payload))) + payload)
+    return request, response
+
+
+def test_parser_frames_independent_of_chunking():
+    """Frames are cut by length and CRC, so byte-wise or glued chunks give the same result."""
+    request, response = _exchange(0x0033, [500, 0x1234, 0x0001])  # frequency, energy import
+    stream = b'\x00\x7f' + request + response + request + response
+
+    results = []
+    for chunk_size in (1, 3, 8, len(stream)):
+        parser, _ = _sniffer()
+        t = 0
+        for i in range(0, len(stream), chunk_size):
+            chunk = stream[i:i + chunk_size]
+            t += len(chunk) * parser.sniffer.character_ns  # back-to-back bytes, no silent interval
+            parser.feed(t, chunk)
+        parser.end_cycle()
+        messages = [parser.mqtt_queue.get_nowait() for _ in range(parser.mqtt_queue.qsize())]
+        assert parser.frames == 2 and parser.sniffer.stats.discarded_bytes == 2  # leading garbage
+        results.append([{k: v for k, v in m.items() if k not in ('timestamp', 'age_ms')} for m in messages])
+    assert all(r == results[0] for r in results)
+    assert results[0][0]['frequency'] == 50.0 and 'total_energy_import' in results[0][0]
+
+
+def test_parser_drops_partial_frame_after_silent_interval():
+    parser, _ = _sniffer()
+    request, response = _exchange(0x0033, [500])
+    parser.feed(1_000_000, request + response[:3])
+    # the rest of the response never arrives; a new exchange starts after a long silence
+    parser.feed(50_000_000, request)
+    parser.feed(60_000_000, response)
+    assert parser.frames == 1 and parser.sniffer.stats.discarded_bytes == 3
+    parser.end_cycle()
+    assert parser.mqtt_queue.get_nowait()['frequency'] == 50.0
+
+
+def test_parser_publishes_one_snapshot_per_master_cycle():
+    """Reads of one master cycle are merged; the cycle ends when the master starts over."""
+    parser, _ = _sniffer()
+    t = 0
+
+    def read(address, values):
+        nonlocal t
+        for frame in _exchange(address, values):
+            t += 10_000_000
+            parser.feed(t, frame)
+
+    read(0x0000, [2301, 0])
+    read(0x0033, [500])
+    assert parser.mqtt_queue.empty()
+    read(0x0000, [2302, 0])                                # the next cycle starts
+    first = parser.mqtt_queue.get_nowait()
+    assert first['cycle'] == 1 and first['voltage_l1'] == pytest.approx(230.1) and first['frequency'] == 50.0
+    assert first['age_ms']['voltage_l1'] >= first['age_ms']['frequency']
+
+    parser.end_cycle(now_ns=t + 1_000_000_000)             # the master went quiet
+    second = parser.mqtt_queue.get_nowait()
+    assert second['cycle'] == 2 and second['voltage_l1'] == pytest.approx(230.2)
+    assert second['frequency'] == 50.0                     # not re-read this cycle, but kept with its age
+    assert second['age_ms'] == {'voltage_l1': 1000, 'frequency': 1020}
+    parser.end_cycle()
+    assert parser.mqtt_queue.empty()
+
+
+def test_mqtt_sender_reconnects_and_keeps_only_the_newest_snapshot_while_offline():
+    import json
+    import queue
+    import socket
+    import time
+    from config_loader import load_yaml_with_env
+    from em340monitor import MqttSender
+    from mqtt_stub_broker import StubBroker
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        port = s.getsockname()[1]              # no broker listening here yet
+    config = load_yaml_with_env('em340.yaml.template')
+    config['config']['name'] = 'sniffer'
+    config['mqtt'].update({'broker': '127.0.0.1', 'port': port, 'username': '', 'password': ''})
+    snapshots = queue.Queue()
+    sender = MqttSender(snapshots, config)
+    sender.client.reconnect_delay_set(min_delay=0.1, max_delay=0.2)
+    broker = None
+    try:
+        sender.start()
+        for cycle in (1, 2, 3):
+            snapshots.put({'cycle': cycle})
+        deadline = time.monotonic() + 5
+        while sender.superseded < 2 and time.monotonic() < deadline:
+            time.sleep(0.01)
+        assert sender.superseded == 2
+
+        broker = StubBroker(port=port).start()
+        topic = f'{config["mqtt"]["topic"]}/sniffer'
+        assert [json.loads(p) for p in broker.wait_for_messages(topic, 1, timeout=10)] == [{'cycle': 3}]
+        snapshots.put({'cycle': 4})
+        assert json.loads(broker.wait_for_messages(topic, 2)[-1]) == {'cycle': 4}
+        assert sender.published == 2
+    finally:
+        sender.client.loop_stop()
+        if broker:
+            broker.stop()
+
+
+def test_mqtt_sender_counts_only_accepted_publishes():
+    import queue
+    import paho.mqtt.client as mqtt
+    from config_loader import load_yaml_with_env
+    from em340monitor import MqttSender
+    config = load_yaml_with_env('em340.yaml.template')
+    config['config']['name'] = 'sniffer'
+    config['mqtt'].update({'broker': '127.0.0.1', 'port': 1, 'username': '', 'password': ''})
+    sender = MqttSender(queue.Queue(), config)
+    sender.client.loop_stop()
+    results = []
+
+    def publish(topic, payload):
+        info = mqtt.MQTTMessageInfo(len(results))
+        info.rc = results.pop(0)
+        return info
+    sender.client.publish = publish
+
+    results[:] = [mqtt.MQTT_ERR_SUCCESS, mqtt.MQTT_ERR_QUEUE_SIZE, mqtt.MQTT_ERR_SUCCESS]
+    assert sender.publish_batch([{'cycle': 1}, {'cycle': 2}, {'cycle': 3}]) == []
+    assert (sender.published, sender.publish_errors) == (2, 1)
+
+    # the connection dropped: nothing more is counted as published, the newest snapshot waits
+    sender.connected.set()
+    results[:] = [mqtt.MQTT_ERR_SUCCESS, mqtt.MQTT_ERR_NO_CONN]
+    assert sender.publish_batch([{'cycle': 4}, {'cycle': 5}, {'cycle': 6}, {'cycle': 7}]) == [{'cycle': 7}]
+    assert (sender.published, sender.publish_errors, sender.superseded) == (3, 1, 2)
+    assert not sender.connected.is_set()
+
+
+def test_serial_reader_queues_chunks_not_bytes():
+    import os
+    import queue
+    import time
+    import tty
+    import serial
+    from em340monitor import SerialReader
+    master, slave = os.openpty()
+    tty.setraw(slave)
+    recv = queue.Queue()
+    reader = SerialReader(os.ttyname(slave), 9600, 0.05, serial.STOPBITS_ONE, recv)
+    reader.start()
+    try:
+        time.sleep(0.1)
+        request, response = _exchange(0x0000, list(range(20)))
+        os.write(master, request + response)
+        deadline = time.monotonic() + 2
+        while reader.bytes_read < len(request + response) and time.monotonic() < deadline:
+            time.sleep(0.01)
+        assert reader.bytes_read == len(request + response)
+        assert reader.chunks < 5
+        chunks = [recv.get_nowait() for _ in range(recv.qsize())]
+        assert b''.join(c for _, c in chunks) == request + response
+        assert all(isinstance(t, int) for t, _ in chunks)
+    finally:
+        reader.stop()
+        reader.join(2)
+        os.close(master)
+        os.close(slave)
+
+
+def test_register_map_decodes_lsw_first_and_skips_partial_sensors():
+    from em340monitor import RegisterMap
+    sensors = [
+        {'id': 'u16', 'address': 0x10, 'value_type': 'UINT16', 'multiply': 1},
+        {'id': 'u32', 'address': 0x11, 'value_type': 'UINT32', 'multiply': 1},
+        {'id': 'i32', 'address': 0x14, 'value_type': 'INT32', 'multiply': 0.1},
+        {'id': 'u64', 'address': 0x16, 'value_type': 'UINT64', 'multiply': 1},
+    ]
+    register_map = RegisterMap(sensors)
+    words = [7, 0x5678, 0x1234, 0xFFFF, 0xFFFE, 0xFFFF, 4, 3, 2, 1]  # 0x13 has no sensor
+
+    data = {}
+    register_map.decode(0x10, words, data)
+    assert data == {'u16': 7, 'u32': 0x12345678, 'i32': -0.2, 'u64': 0x0001000200030004}
+
+    # a read starting in the middle of u32 and ending in the middle of u64
+    data = {}
+    register_map.decode(0x12, words[2:8], data)
+    assert data == {'i32': -0.2}
+
+
+def test_register_map_matches_poller_decoding():
+    """The sniffer and the poller decode the same words to the same values."""
+    from em340monitor import RegisterMap
+    from config_loader import load_yaml_with_env
+    from poll_plan import PollPlan
+    sensors = load_yaml_with_env('em340.yaml.template')['sensor']
+    plan = PollPlan(sensors)
+    register_map = RegisterMap(sensors)
+    for index, (start, count) in enumerate(plan.ranges):
+        words = [(start + i) * 977 % 0x10000 for i in range(count)]
+        expected, sniffed = {}, {}
+        plan.decode(index, words, expected)
+        register_map.decode(start, words, sniffed)
+        assert {k: sniffed[k] for k in expected} == expected
@@ -0,0 +1,168 @@
+#!/usr/bin/env python
+"""
+Tests for raw frame capture and replay
+"""
+import os
+import tempfile
+
+import minimalmodbus
+import pytest
+
+from config_loader import load_yaml_with_env
+from poll_plan import PollPlan
+from em340_emulator import EM340Emulator
+from modbus_codec import append_crc
+from frame_capture import (DIRECTION_BUS, DIRECTION_RX, DIRECTION_TX, CaptureWriter, CapturingSerial,
+                           parse_read_exchange, read_capture, replay)
+
+SENSORS = load_yaml_with_env('em340.yaml.template')['sensor']
+
+
+def read_exchange(start, values):
+    request = append_crc(bytes((1, 3, start >> 8, start & 0xFF, 0, len(values))))
+    payload = bytearray((1, 3, 2 * len(values)))
+    for value in values:
+        payload += value.to_bytes(2, 'big')
+    return request, append_crc(payload)
+
+
+def test_write_and_read_back(tmp_path):
+    path = str(tmp_path / 'test.cap')
+    writer = CaptureWriter(path)
+    writer.write(DIRECTION_TX, b'\x01\x02', timestamp_ns=10)
+    writer.write(DIRECTION_RX, b'\x03', timestamp_ns=20)
+    writer.close()
+    # Appending to an existing capture must not repeat the header
+    writer = CaptureWriter(path)
+    writer.write(DIRECTION_TX, b'\x04', timestamp_ns=30)
+    writer.close()
+    assert list(read_capture(path)) == [(10, 0, b'\x01\x02'), (20, 1, b'\x03'), (30, 0, b'\x04')]
+
+
+def test_read_capture_streams_records_across_chunks(tmp_path):
+    path = str(tmp_path / 'test.cap')
+    writer = CaptureWriter(path)
+    frames = [bytes(range(n)) for n in (8, 1, 45, 0, 13)]
+    for i, frame in enumerate(frames):
+        writer.write(DIRECTION_RX, frame, timestamp_ns=i)
+    writer.close()
+    with open(path, 'ab') as f:
+        f.write(b'\x05\x00\x00\x00\x00\x00\x00\x00\x01\x08\x00\x01\x03')  # interrupted mid-write
+    expected = [(i, DIRECTION_RX, frame) for i, frame in enumerate(frames)]
+    for chunk_size in (1, 7, 11, 1 << 20):
+        assert list(read_capture(path, chunk_size=chunk_size)) == expected
+
+
+def test_read_capture_rejects_other_files(tmp_path):
+    path = tmp_path / 'other.bin'
+    path.write_bytes(b'not a capture')
+    with pytest.raises(ValueError):
+        list(read_capture(str(path)))
+
+
+def test_parse_read_exchange():
+    request, response = read_exchange(0x0034, [0x1234, 0x0001])
+    assert parse_read_exchange(request, response) == (0x0034, [0x1234, 0x0001])
+    corrupted = response[:-1] + bytes((response[-1] ^ 1,))
+    assert parse_read_exchange(request, corrupted) is None
+    exception = append_crc(bytes((1, 0x83, 2)))
+    assert parse_read_exchange(request, exception) is None
+
+
+def test_replay_decodes_cycles():
+    plan = PollPlan(SENSORS)
+    records = []
+    for cycle in range(3):
+        for start, count in plan.ranges:
+            request, response = read_exchange(start, [cycle + 1] * count)
+            records.append((cycle * 1000, DIRECTION_TX, request))
+            records.append((cycle * 1000 + 1, DIRECTION_RX, response))
+    cycles = []
+    stats = replay(records, plan, cycles.append)
+    assert stats['cycles'] == 3 and stats['invalid'] == 0
+    expected = {}
+    plan.decode(0, [3] * 20, expected)
+    assert cycles[2]['voltage_l1'] == expected['voltage_l1']
+    assert cycles[1]['capture_time_s'] == pytest.approx(1e-6)
+
+
+def test_capturing_serial_records_exchange(tmp_path):
+    path = str(tmp_path / 'live.cap')
+    emulator = EM340Emulator(SENSORS)
+    emulator.start()
+    writer = CaptureWriter(path)
+    instrument = minimalmodbus.Instrument(emulator.port, 1)
+    instrument.serial.timeout = 0.2
+    instrument.serial = CapturingSerial(instrument.serial, writer)
+    values = instrument.read_registers(0x0000, 4)
+    instrument.serial.close()
+    writer.close()
+    emulator.stop()
+
+    records = list(read_capture(path))
+    assert [r[1] for r in records] == [DIRECTION_TX, DIRECTION_RX]
+    assert parse_read_exchange(records[0][2], records[1][2]) == (0x0000, values)
+
+
+def test_hybrid_listening_is_captured_as_bus_traffic(tmp_path):
+    """Sniffed bytes of another master are not recorded as responses to own requests."""
+    from hybrid_mode import HybridPoller
+    from modbus_bus import ModbusBus
+
+    class Port:
+        def __init__(self, data):
+            self.data = data
+
+        @property
+        def in_waiting(self):
+            return len(self.data)
+
+        def read(self, size=1):
+            data, self.data = self.data[:size], self.data[size:]
+            return data
+
+    class Instrument:
+        pass
+
+    request, response = read_exchange(0x0000, [2301, 0])
+    path = str(tmp_path / 'hybrid.cap')
+    writer = CaptureWriter(path)
+    instrument = Instrument()
+    instrument.serial = CapturingSerial(Port(request + response), writer)
+    hybrid = HybridPoller(ModbusBus(instrument), slave=1)
+    hybrid.listen(0.1)
+    writer.close()
+
+    assert hybrid.observed_reads == 1
+    records = list(read_capture(path))
+    assert [(direction, data) for _, direction, data in records] == [(DIRECTION_BUS, request + response)]
+    stats = replay(records, PollPlan(SENSORS), lambda data: None)
+    assert stats['sniffed_chunks'] == 1 and stats['invalid'] == 0
+
+
+def test_replay_tool_delivers_every_cycle_before_disconnecting(tmp_path, monkeypatch):
+    import importlib.util
+    import sys
+    from mqtt_stub_broker import StubBroker
+    plan = PollPlan(SENSORS)
+    path = str(tmp_path / 'field.cap')
+    writer = CaptureWriter(path)
+    for cycle in range(20):
+        for start, count in plan.ranges:
+            request, response = read_exchange(start, [cycle + 1] * count)
+            writer.write(DIRECTION_TX, request, cycle * 1000)
+            writer.write(DIRECTION_RX, response, cycle * 1000 + 1)
+    writer.close()
+
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    spec = importlib.util.spec_from_file_location('replay_capture', os.path.join(root, 'tools', 'replay_capture.py'))
+    tool = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(tool)
+    broker = StubBroker().start()
+    try:
+        monkeypatch.setattr(sys, 'argv', ['replay_capture.py', path, '--broker', broker.host,
+                                          '--port', str(broker.port), '--topic', 'em340/replay'])
+        tool.main()
+        assert len(broker.messages_for('em340/replay')) == 20
+    finally:
+        broker.stop()
@@ -0,0 +1,99 @@
+#!/usr/bin/env python
+"""
+Tests for the hybrid passive/active poll mode
+"""
+import time
+
+import pytest
+
+import modbus_codec as codec
+from hybrid_mode import HybridPoller, RegisterSnapshot
+from poll_plan import PollPlan
+
+SENSORS = [
+    {'id': 'voltage', 'address': 0x0000, 'register_count': 2, 'value_type': 'INT32', 'multiply': 0.1},
+    {'id': 'frequency', 'address': 0x0033, 'register_count': 1, 'value_type': 'UINT16', 'multiply': 0.1},
+    {'id': 'energy_import', 'address': 0x0034, 'register_count': 2, 'value_type': 'INT32', 'multiply': 0.1},
+]
+
+
+def _observe(hybrid, slave, address, values, function_code=codec.READ_HOLDING_REGISTERS):
+    """Feed one read of the other master through the sniffer."""
+    now = time.monotonic_ns()
+    hybrid.sniffer.feed(now - 20_000_000, codec.build_read_request(slave, address, len(values), function_code))
+    hybrid.sniffer.feed(now, codec.build_read_response(slave, values, function_code))
+
+
+def test_snapshot_ages():
+    snapshot = RegisterSnapshot()
+    snapshot.merge(0x0010, [1, 2], timestamp=100.0)
+    assert snapshot.values == {0x0010: 1, 0x0011: 2}
+    assert snapshot.age(0x0011, now=102.5) == 2.5
+    assert snapshot.age(0x0012, now=102.5) is None
+
+
+def test_observed_reads_of_the_meter_fill_the_snapshot():
+    hybrid = HybridPoller(bus=None, slave=1)
+    _observe(hybrid, 1, 0x0000, [2301, 0])
+    _observe(hybrid, 2, 0x0033, [500])                                   # another slave
+    _observe(hybrid, 1, 0x0033, [499, 0x1234, 0], codec.READ_INPUT_REGISTERS)
+    hybrid.sniffer.feed(time.monotonic_ns(), codec.build_read_request(1, 0x0040, 2))
+    hybrid.sniffer.feed(time.monotonic_ns(), codec.build_exception_response(1, 3, codec.ILLEGAL_DATA_ADDRESS))
+
+    assert hybrid.observed_reads == 2
+    data = {}
+    assert hybrid.decode(PollPlan(SENSORS), data) == []
+    assert data == pytest.approx({'voltage': 230.1, 'frequency': 49.9, 'energy_import': 0x1234 * 0.1})
+
+
+def test_due_waits_for_listening_then_picks_unobserved_and_aging_blocks():
+    plan = PollPlan(SENSORS)
+    assert plan.ranges == [(0x0000, 2), (0x0033, 3)]
+    hybrid = HybridPoller(bus=None, slave=1, max_age=2.0)
+    assert hybrid.due(plan) == []                      # never listened
+
+    hybrid.listening_since = time.monotonic() - 0.5
+    _observe(hybrid, 1, 0x0000, [2301, 0])
+    assert hybrid.due(plan) == []                      # the other master may still read block 2
+
+    hybrid.listening_since = time.monotonic() - 1.0
+    assert hybrid.due(plan) == [1]
+    hybrid.merge(0x0033, [500, 1, 0])
+    assert hybrid.due(plan) == [] and hybrid.own_reads == 1
+
+    hybrid.snapshot.updated[0x0001] -= 1.5             # half of max_age passed: refresh
+    assert hybrid.due(plan) == [0]
+    hybrid.snapshot.updated[0x0001] -= 1.0             # past max_age: left out of the cycle
+    data = {}
+    assert hybrid.decode(plan, data) == [0]
+    assert 'voltage' not in data and data['frequency'] == 50.0
+
+
+def test_idle_only_between_exchanges_of_the_other_master():
+    hybrid = HybridPoller(bus=None, slave=1, idle_guard=0.05)
+    assert hybrid.idle()                               # nothing heard yet
+    now = time.monotonic_ns()
+    hybrid.sniffer.feed(now, codec.build_read_request(1, 0x0000, 2))
+    assert not hybrid.idle()                           # waiting for the meter's answer
+    hybrid.sniffer.feed(now + 1_000_000, codec.build_read_response(1, [1, 2]))
+    assert not hybrid.idle()                           # inside the guard time
+    hybrid.sniffer.buffer_end_ns = now - 100_000_000
+    assert hybrid.idle()
+    hybrid.sniffer.feed(time.monotonic_ns(), b'\x01\x03')
+    assert not hybrid.idle()                           # a frame is on the line
+
+
+def test_gateway_reads_only_what_the_other_master_leaves_out(meter, gateway):
+    """With a GoodWe-like master reading blocks 1 and 2, the gateway itself only reads blocks 3 and 4."""
+    emulator = meter(foreign_reads=[(1, 0x0000, 20), (1, 0x0014, 20)])
+    em340, _ = gateway(emulator, poll_mode='hybrid', hybrid_publish_ms=1500, hybrid_max_age_ms=1000,
+                       hybrid_idle_ms=20)
+    own_reads = []
+    merge = em340.hybrid.merge
+    em340.hybrid.merge = lambda address, values: (own_reads.append(address), merge(address, values))
+    data = em340.hybrid_cycle()
+
+    assert data['quality'] == 'good', data
+    assert 225.0 < data['voltage_l1'] < 235.0 and 'total_energy_export' in data
+    assert em340.hybrid.observed_reads >= 6
+    assert own_reads and set(own_reads) == {0x0028, 0x004E}
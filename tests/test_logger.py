@@ -1,31 +1,88 @@
 #!/usr/bin/env python
 """
 Test module for logger.py
-
-This is a placeholder test file that can be expanded with actual tests later.
 """
 
-import pytest
+import logging
+
+
+def test_logger_import_has_no_side_effects():
+    """Importing logger must not need em340.yaml or add handlers."""
+    import logger
+    assert logger.log is logging.getLogger()
+
 
+def test_setup_logging_replaces_its_handlers(tmp_path):
+    from logger import log, setup_logging
+    before = list(log.handlers)
+    config = {'logger': {'log_level': 'DEBUG', 'log_to_file': True, 'log_file': str(tmp_path / 'test.log'),
+                         'log_to_console': True, 'log_rotate': True, 'log_rotate_size': 1024, 'log_rotate_count': 1}}
+    try:
+        setup_logging(config)
+        assert log.level == logging.DEBUG
+        assert len(log.handlers) == len(before) + 1  # one QueueHandler feeding both outputs
+        setup_logging(config)
+        assert len(log.handlers) == len(before) + 1
+        setup_logging(dict(config, logger=dict(config['logger'], log_async=False)))
+        assert len(log.handlers) == len(before) + 2
 
-def test_logger_placeholder():
-    """Placeholder test for logger module."""
-    assert True
+        setup_logging({'logger': {'log_level': 'bogus', 'log_to_console': False}})
+        assert log.level == logging.INFO
+        assert log.handlers == before
+    finally:
+        setup_logging({'logger': {'log_to_console': False}})
 
 
-def test_logger_module_imports():
-    """Test that the logger module can be imported."""
+def test_async_logging_writes_from_the_listener_thread(tmp_path):
+    from logger import log, setup_logging, shutdown_logging
+    log_file = tmp_path / 'async.log'
+    setup_logging({'logger': {'log_to_file': True, 'log_file': str(log_file), 'log_to_console': False}})
     try:
-        # Import without initializing to avoid dependency issues
-        import sys
-        import os
-        
-        # Mock the logger import to avoid file system dependencies
-        import unittest.mock
-        with unittest.mock.patch('sys.modules') as mock_modules:
-            # We'll skip the import test due to complex dependencies
-            # This is a placeholder that can be expanded when mocking is properly set up
-            assert True, "Module import test placeholder - requires proper mocking setup"
-    except Exception as e:
-        # For now, we'll mark this as a known limitation
-        assert True, f"Module has complex dependencies: {e}"
\ No newline at end of file
+        log.info('block %s read', '0x0000')
+    finally:
+        shutdown_logging()  # drains the queue
+    assert 'INFO: block 0x0000 read' in log_file.read_text()
+
+
+def test_rate_limit_filter_suppresses_repeated_errors_per_call_site():
+    from logger import RateLimitFilter
+    now = [0.0]
+    limiter = RateLimitFilter(burst=2, interval=60.0, clock=lambda: now[0])
+
+    def record(line, level=logging.ERROR, msg='Serial connection failed'):
+        return logging.LogRecord('root', level, '/app/em340.py', line, msg, None, None)
+
+    assert [limiter.filter(record(259)) for _ in range(5)] == [True, True, False, False, False]
+    assert limiter.filter(record(263))                  # another call site
+    assert limiter.filter(record(259, logging.INFO))    # below WARNING always passes
+    assert limiter.suppressed() == {'em340.py:259': 3} and limiter.suppressed_total == 3
+
+    now[0] = 61.0
+    summary = record(259)
+    assert limiter.filter(summary)
+    assert summary.getMessage() == 'Serial connection failed [3 similar messages suppressed]'
+    assert limiter.suppressed() == {}
+
+
+def test_rate_limit_filter_keeps_a_budget_per_message():
+    """Different messages from one line, e.g. one per failing block, are all emitted."""
+    from logger import RateLimitFilter
+    now = [0.0]
+    limiter = RateLimitFilter(burst=1, interval=60.0, clock=lambda: now[0])
+
+    def record(msg, args=None):
+        return logging.LogRecord('root', logging.ERROR, '/app/em340.py', 410, msg, args, None)
+
+    assert limiter.filter(record('Failed to read block 0x0000: timeout'))
+    assert limiter.filter(record('Failed to read block 0x0028: timeout'))
+    assert not limiter.filter(record('Failed to read block 0x0000: timeout'))
+    # %-style records are keyed on the template, so changing arguments share one budget
+    assert limiter.filter(record('Unknown key %s', ('foo',)))
+    assert not limiter.filter(record('Unknown key %s', ('bar',)))
+    assert limiter.suppressed() == {'em340.py:410': 2}
+
+    # expired messages are forgotten once too many are tracked
+    limiter.MAX_TRACKED = 3
+    now[0] = 61.0
+    assert limiter.filter(record('Failed to read block 0x004E: timeout'))
+    assert len(limiter._sites) == 1
@@ -0,0 +1,164 @@
+#!/usr/bin/env python
+"""
+Tests for the ModBus bus arbiter
+"""
+import threading
+import time
+
+import pytest
+
+from modbus_bus import ModbusBus, PRIORITY_CONFIG_WRITE, PRIORITY_ON_DEMAND, PRIORITY_POLL
+
+
+class RecordingInstrument:
+    """Stands in for minimalmodbus.Instrument and records the call order."""
+
+    def __init__(self):
+        self.calls = []
+        self.active = 0
+        self.overlaps = 0
+
+    def _enter(self, call):
+        self.active += 1
+        if self.active > 1:
+            self.overlaps += 1
+        self.calls.append((call, time.monotonic()))
+        time.sleep(0.002)
+        self.active -= 1
+
+    def read_registers(self, address, number_of_registers, functioncode=3):
+        self._enter(('read', address))
+        return [0] * number_of_registers
+
+    def read_register(self, address, functioncode=3):
+        self._enter(('read', address))
+        return 0
+
+    def write_register(self, address, value, functioncode=6):
+        self._enter(('write', address))
+
+
+def test_waiting_transactions_run_in_priority_order():
+    instrument = RecordingInstrument()
+    bus = ModbusBus(instrument)
+    release = threading.Event()
+    held = threading.Event()
+
+    def hold_bus():
+        with bus.transaction(PRIORITY_POLL):
+            held.set()
+            release.wait(5)
+
+    holder = threading.Thread(target=hold_bus)
+    holder.start()
+    held.wait(5)
+
+    threads = [
+        threading.Thread(target=bus.read_registers, args=(0x0000, 20)),
+        threading.Thread(target=bus.read_register, args=(0x1103,)),
+        threading.Thread(target=bus.write_register, args=(0x1002, 1)),
+    ]
+    for thread in threads:
+        thread.start()
+        time.sleep(0.02)  # make sure each one is queued before the next
+    release.set()
+    for thread in threads + [holder]:
+        thread.join(5)
+
+    assert [call for call, _ in instrument.calls] == [('write', 0x1002), ('read', 0x1103), ('read', 0x0000)]
+    assert bus.transactions == {PRIORITY_CONFIG_WRITE: 1, PRIORITY_ON_DEMAND: 1, PRIORITY_POLL: 2}
+
+
+def test_concurrent_callers_never_overlap_and_keep_inter_frame_delay():
+    instrument = RecordingInstrument()
+    bus = ModbusBus(instrument, inter_frame_delay=0.01)
+
+    def poller():
+        for block in range(10):
+            bus.read_registers(block * 20, 20)
+
+    def config():
+        for _ in range(5):
+            bus.write_register(0x1103, 1)
+
+    threads = [threading.Thread(target=poller), threading.Thread(target=config)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(10)
+
+    assert instrument.overlaps == 0
+    assert len(instrument.calls) == 15
+    starts = [t for _, t in instrument.calls]
+    # each call takes >= 2 ms, so consecutive starts are at least delay + call time apart
+    assert min(b - a for a, b in zip(starts, starts[1:])) >= 0.01
+
+
+def test_failed_transaction_releases_bus():
+    class FailingInstrument(RecordingInstrument):
+        def read_registers(self, address, number_of_registers, functioncode=3):
+            raise IOError('No communication with the instrument (no answer)')
+
+    bus = ModbusBus(FailingInstrument())
+    with pytest.raises(IOError):
+        bus.read_registers(0, 20)
+    bus.write_register(0x1103, 1)
+    assert bus.instrument.calls[0][0] == ('write', 0x1103)
+
+
+def test_passive_transaction_keeps_the_line_timing():
+    """Listening in hybrid mode neither counts as a transaction nor restarts the inter-frame delay."""
+    bus = ModbusBus(RecordingInstrument(), inter_frame_delay=0.5)
+    with bus.transaction(PRIORITY_POLL, passive=True):
+        pass
+    started = time.monotonic()
+    bus.read_registers(0x0000, 2)
+    assert time.monotonic() - started < 0.1
+    assert bus.transactions[PRIORITY_POLL] == 1
+
+
+def test_config_manager_shares_the_bus():
+    from em340_config_manager import EM340ConfigManager
+    instrument = RecordingInstrument()
+    bus = ModbusBus(instrument)
+    manager = EM340ConfigManager({'broker': 'localhost', 'port': 1883, 'topic': 'em340', 'device_id': 'T'},
+                                 '/dev/null', 1, bus=bus)
+    statuses = []
+    manager.publish_parameter_status = lambda parameter, value, status: statuses.append(status)
+    manager.WRITE_SETTLE_SECONDS = 0
+
+    manager.handle_parameter_set('measurement_mode', '0')
+
+    assert manager.modbus is instrument
+    assert [call for call, _ in instrument.calls] == [('write', 0x1103), ('read', 0x1103)]
+    assert statuses == ['success']
+
+
+def test_circuit_breaker_opens_probes_and_closes():
+    from modbus_bus import CircuitBreaker
+    now = [0.0]
+    breaker = CircuitBreaker(failure_threshold=3, cooldown=5.0, max_cooldown=12.0, clock=lambda: now[0])
+
+    assert not breaker.record_failure()
+    breaker.record_success()  # a success in between resets the count
+    assert not breaker.record_failure()
+    assert not breaker.record_failure()
+    assert breaker.record_failure()
+    assert breaker.state == CircuitBreaker.OPEN and not breaker.allow()
+    assert breaker.retry_in() == 5.0
+
+    now[0] = 5.0
+    assert breaker.allow() and breaker.state == CircuitBreaker.HALF_OPEN
+    assert breaker.record_failure()  # failed probe doubles the cooldown
+    now[0] = 14.0
+    assert not breaker.allow()
+    now[0] = 15.0
+    assert breaker.allow()
+    assert breaker.record_failure()
+    assert breaker.current_cooldown == 12.0  # capped
+
+    now[0] = 27.0
+    assert breaker.allow()
+    breaker.record_success()
+    assert breaker.state == CircuitBreaker.CLOSED and breaker.current_cooldown == 5.0
+    assert breaker.trips == 3
@@ -0,0 +1,77 @@
+#!/usr/bin/env python
+"""
+Tests for the ModBus RTU frame codec
+"""
+import importlib.util
+import os
+import random
+
+import pytest
+
+import modbus_codec as codec
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def load_codec_benchmark():
+    spec = importlib.util.spec_from_file_location('codec_benchmark', os.path.join(ROOT, 'tools', 'codec_benchmark.py'))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def test_table_crc_matches_bitwise_reference():
+    reference = load_codec_benchmark().bitwise_crc16
+    rnd = random.Random(1)
+    for length in (0, 1, 8, 45, 255):
+        data = bytes(rnd.randrange(256) for _ in range(length))
+        assert codec.crc16(data) == reference(data)
+        assert codec.crc16(memoryview(bytearray(data))) == reference(data)
+    assert codec.append_crc(bytes.fromhex('010300000002')).hex() == '010300000002c40b'
+
+
+def test_read_request_and_response_round_trip():
+    request = codec.build_read_request(7, 0x0028, 3, codec.READ_INPUT_REGISTERS)
+    assert codec.request_length(request) == 8
+    parsed = codec.parse_request(request)
+    assert parsed == codec.Request(7, 4, 0x0028, 3)
+
+    response = codec.build_read_response(7, [1, 0xFFFF, 0x1234], 4)
+    assert codec.response_length(response[:3]) == len(response) == 11
+    decoded = codec.parse_response(memoryview(bytearray(response)), parsed)
+    assert decoded.values == (1, 0xFFFF, 0x1234) and decoded.count == 3 and not decoded.is_exception
+
+    with pytest.raises(codec.FrameError):
+        codec.parse_response(codec.build_read_response(7, [1, 2], 4), parsed)  # wrong count
+    with pytest.raises(codec.FrameError):
+        codec.parse_response(codec.build_read_response(8, [1, 2, 3], 4), parsed)  # other slave
+    corrupted = bytearray(response)
+    corrupted[4] ^= 1
+    with pytest.raises(codec.FrameError, match='CRC'):
+        codec.parse_response(corrupted)
+
+
+def test_write_frames_and_exceptions():
+    single = codec.build_write_single_request(1, 0x1103, 1)
+    assert codec.parse_request(single) == codec.Request(1, 6, 0x1103, 1, (1,))
+    assert codec.parse_response(single).values == (1,)
+
+    multiple = codec.build_write_multiple_request(1, 0x1200, [400, 400, 5])
+    assert codec.request_length(multiple[:7]) == len(multiple) == 15
+    assert codec.request_length(multiple[:6]) is None
+    assert codec.parse_request(multiple).values == (400, 400, 5)
+    answer = codec.parse_response(codec.build_write_multiple_response(1, 0x1200, 3))
+    assert (answer.address, answer.count) == (0x1200, 3)
+
+    exception = codec.build_exception_response(1, 3, codec.ILLEGAL_DATA_ADDRESS)
+    assert exception.hex()[:6] == '018302' and codec.response_length(exception) == 5
+    decoded = codec.parse_response(exception, codec.Request(1, 3, 0, 1))
+    assert decoded.is_exception and decoded.exception_code == 2 and decoded.function_code == 3
+
+    with pytest.raises(codec.FrameError, match='function code'):
+        codec.parse_request(codec.append_crc(bytes((1, 0x2B, 0, 0, 0, 0))))
+
+
+def test_codec_benchmark_runs():
+    results = load_codec_benchmark().run(number=50)
+    assert results['crc_table_45B'] < results['crc_bitwise_45B']
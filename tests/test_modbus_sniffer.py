@@ -0,0 +1,87 @@
+#!/usr/bin/env python
+"""
+Tests for the passive ModBus framing engine
+"""
+import random
+
+import modbus_codec as codec
+from modbus_sniffer import ModbusSniffer
+
+
+def _traffic():
+    """A bus with two slaves, reads, writes, an exception and a request nobody answers."""
+    frames = [
+        codec.build_read_request(1, 0x0000, 20), codec.build_read_response(1, range(20)),
+        codec.build_read_request(2, 0x0010, 2, codec.READ_INPUT_REGISTERS),
+        codec.build_read_response(2, [7, 8], codec.READ_INPUT_REGISTERS),
+        codec.build_write_single_request(1, 0x1103, 1), codec.build_write_single_request(1, 0x1103, 1),
+        codec.build_write_multiple_request(2, 0x1200, [400, 5]), codec.build_write_multiple_response(2, 0x1200, 2),
+        codec.build_read_request(1, 0x5000, 7), codec.build_exception_response(1, 3, codec.ILLEGAL_DATA_ADDRESS),
+        codec.build_read_request(3, 0x0000, 2),  # slave 3 is offline
+        codec.build_read_request(1, 0x0034, 2), codec.build_read_response(1, [0x1234, 0x0001]),
+    ]
+    return frames
+
+
+def _feed(sniffer, frames, gap_chars=4.0, chunk_sizes=None, rnd=None):
+    """Feed frames separated by gap_chars of silence, split into chunks of the given sizes."""
+    t = 0
+    for frame in frames:
+        t += int(gap_chars * sniffer.character_ns)
+        position = 0
+        while position < len(frame):
+            size = rnd.choice(chunk_sizes) if chunk_sizes else len(frame)
+            chunk = frame[position:position + size]
+            position += len(chunk)
+            t += len(chunk) * sniffer.character_ns
+            sniffer.feed(t, chunk)
+    return t
+
+
+def test_pairs_all_function_codes_and_slaves():
+    exchanges = []
+    sniffer = ModbusSniffer(on_exchange=exchanges.append)
+    _feed(sniffer, _traffic())
+    sniffer.feed(10**12, codec.build_read_request(1, 0, 1))  # shows slave 3 was never answered
+
+    answered = [(e.request.slave, e.request.function_code, e.request.address) for e in exchanges if e.response]
+    assert answered == [(1, 3, 0x0000), (2, 4, 0x0010), (1, 6, 0x1103), (2, 16, 0x1200), (1, 3, 0x5000),
+                        (1, 3, 0x0034)]
+    assert exchanges[0].response.values == tuple(range(20))
+    assert exchanges[3].response.count == 2 and exchanges[3].request.values == (400, 5)
+    assert exchanges[4].response.exception_code == codec.ILLEGAL_DATA_ADDRESS
+    unanswered = [e for e in exchanges if e.response is None]
+    assert [e.request.slave for e in unanswered] == [3]
+    assert all(e.turnaround_ns > 0 for e in exchanges if e.response)
+
+    stats = sniffer.stats
+    assert (stats.requests, stats.exchanges, stats.exceptions) == (8, 6, 1)
+    assert stats.unanswered_requests == 1 and stats.resyncs == 0 and stats.discarded_bytes == 0
+    assert stats.as_dict()['loss_rate'] == round(1 / 7, 4)
+
+
+def test_holds_sync_with_glued_frames_and_random_chunking():
+    """At full load a USB adapter delivers several frames per chunk, or frames in pieces."""
+    rnd = random.Random(3)
+    for chunk_sizes in ([1], [2, 3, 7], [64], [200]):
+        exchanges = []
+        sniffer = ModbusSniffer(on_exchange=exchanges.append)
+        _feed(sniffer, _traffic() * 20, gap_chars=0, chunk_sizes=chunk_sizes, rnd=rnd)
+        assert sum(1 for e in exchanges if e.response) == 6 * 20
+        assert sniffer.stats.resyncs == 0
+
+
+def test_recovers_from_noise_and_truncated_frames():
+    exchanges = []
+    sniffer = ModbusSniffer(on_exchange=exchanges.append)
+    good = [codec.build_read_request(1, 0x0000, 2), codec.build_read_response(1, [1, 2])]
+    corrupted = bytearray(codec.build_read_response(1, [3, 4]))
+    corrupted[3] ^= 0xFF
+    frames = good + [b'\xff\x00\x13'] + good + [codec.build_read_request(1, 0x0000, 2), bytes(corrupted)] + \
+        [codec.build_read_response(1, [5, 6])[:4]] + good
+    _feed(sniffer, frames)
+
+    assert [e.response.values for e in exchanges if e.response] == [(1, 2), (1, 2), (1, 2)]
+    assert sniffer.stats.resyncs == 2  # the corrupted and truncated responses are one episode
+    assert sniffer.stats.discarded_bytes == 3 + len(corrupted) + 4
+    assert sniffer.stats.unanswered_requests == 1
@@ -0,0 +1,75 @@
+#!/usr/bin/env python
+"""
+Tests for the USB-serial latency tuning, against a fake sysfs tree
+"""
+import os
+import pty
+
+from serial_latency import find_adapter, set_low_latency, tune_adapter
+
+
+def fake_usb_serial(root, tty, driver, usb_id, latency_timer=None):
+    """sysfs and /dev entries of one USB-serial adapter, laid out as the kernel does."""
+    vendor, product = usb_id.split(':')
+    usb_device = root / 'sys' / 'devices' / 'pci0000:00' / 'usb1' / '1-1'
+    usb_device.mkdir(parents=True, exist_ok=True)
+    (usb_device / 'idVendor').write_text(vendor + '\n')
+    (usb_device / 'idProduct').write_text(product + '\n')
+    tty_device = usb_device / '1-1:1.0' / tty
+    tty_device.mkdir(parents=True)
+    drivers = root / 'sys' / 'bus' / 'usb-serial' / 'drivers' / driver
+    drivers.mkdir(parents=True, exist_ok=True)
+    (tty_device / 'driver').symlink_to(drivers)
+    if latency_timer is not None:
+        (tty_device / 'latency_timer').write_text(f'{latency_timer}\n')
+    (root / 'sys' / 'class' / 'tty' / tty).mkdir(parents=True)
+    (root / 'sys' / 'class' / 'tty' / tty / 'device').symlink_to(tty_device)
+    (root / 'dev' / 'serial' / 'by-id').mkdir(parents=True, exist_ok=True)
+    (root / 'dev' / tty).write_text('')
+    link = root / 'dev' / 'serial' / 'by-id' / f'usb-{driver}-{tty}'
+    link.symlink_to(root / 'dev' / tty)
+    return str(link), tty_device
+
+
+def test_ftdi_latency_timer_is_found_through_by_id_link_and_lowered(tmp_path):
+    device, tty_device = fake_usb_serial(tmp_path, 'ttyUSB0', 'ftdi_sio', '0403:6001', latency_timer=16)
+    sysfs = str(tmp_path / 'sys')
+    adapter = find_adapter(device, sysfs_root=sysfs)
+    assert (adapter.tty, adapter.driver, adapter.usb_id) == ('ttyUSB0', 'ftdi_sio', '0403:6001')
+    assert adapter.latency_timer == 16
+
+    _, port = pty.openpty()
+    try:
+        # a pty has no serial_struct, so only the sysfs setting is reported
+        assert set_low_latency(port) is None
+        assert tune_adapter(adapter, port, latency_timer_ms=1) == {'latency_timer_ms': (16, 1)}
+        assert (tty_device / 'latency_timer').read_text() == '1\n'
+        assert tune_adapter(adapter, port, latency_timer_ms=None) == {}
+    finally:
+        os.close(port)
+
+
+def test_adapters_without_latency_timer_and_ptys(tmp_path):
+    device, _ = fake_usb_serial(tmp_path, 'ttyUSB1', 'ch341-uart', '1a86:7523')
+    adapter = find_adapter(device, sysfs_root=str(tmp_path / 'sys'))
+    assert adapter.driver == 'ch341-uart' and adapter.latency_timer_path is None
+    assert adapter.describe() == 'ttyUSB1 (ch341-uart 1a86:7523)'
+    assert tune_adapter(adapter, -1, latency_timer_ms=1, low_latency=False) == {}
+
+    assert find_adapter('/dev/pts/0', sysfs_root=str(tmp_path / 'sys')) is None
+
+
+def test_gateway_reports_latency_before_and_after_tuning(tmp_path, monkeypatch, meter, gateway):
+    """The adapter settings and the timed read transactions end up in latency_report."""
+    import em340 as em340_module
+    from serial_latency import SerialAdapter
+    timer = tmp_path / 'latency_timer'
+    timer.write_text('16\n')
+    adapter = SerialAdapter('ttyUSB0', 'ftdi_sio', '0403:6001', str(timer))
+    em340, _ = gateway(meter())
+    monkeypatch.setattr(em340_module, 'find_adapter', lambda device: adapter)
+    em340._tune_serial_latency(measure=True)
+    report = em340.latency_report
+    assert report['adapter'] == 'ttyUSB0 (ftdi_sio 0403:6001)'
+    assert report['settings'] == {'latency_timer_ms': (16, 1)}
+    assert all(0 < t < 500 for t in report['transaction_ms'])
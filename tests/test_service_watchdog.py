@@ -0,0 +1,70 @@
+#!/usr/bin/env python
+"""
+Tests for the systemd notifications and the stall detector
+"""
+import logging
+import os
+import socket
+import threading
+import time
+
+from service_watchdog import ServiceWatchdog, StallDetector
+
+
+def received(sock):
+    messages = []
+    while True:
+        try:
+            messages.append(sock.recv(1024).decode())
+        except BlockingIOError:
+            return messages
+
+
+def test_watchdog_is_fed_only_by_cycles_in_time(monkeypatch):
+    address = f'em340-test-{os.getpid()}'
+    with socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM) as sock:
+        sock.bind('\0' + address)
+        sock.setblocking(False)
+        monkeypatch.setenv('NOTIFY_SOCKET', '@' + address)
+        monkeypatch.setenv('WATCHDOG_USEC', '2000000')
+        watchdog = ServiceWatchdog(target_period=0.1, multiple=3, stall_timeout=0)
+        assert watchdog.interval == 1.0
+
+        assert watchdog.cycle_done(0.5) is False  # too slow: neither READY nor a ping
+        assert received(sock) == [] and watchdog.slow_cycles == 1
+        assert watchdog.cycle_done(0.05) is True
+        assert received(sock) == ['READY=1\nSTATUS=Polling', 'WATCHDOG=1']
+        assert watchdog.cycle_done(0.05) is True
+        assert received(sock) == []  # back-to-back cycles are not all forwarded
+        watchdog.keep_alive(5.0)     # ahead of a long wait the ping is always sent
+        assert received(sock) == ['WATCHDOG=1']
+
+
+def test_stall_detector_dumps_the_wedged_thread(caplog):
+    release = threading.Event()
+
+    def wedged_read():
+        release.wait(5)
+
+    stalls = []
+    detector = StallDetector(0.2, on_stall=lambda: stalls.append(time.monotonic()))
+    reader = threading.Thread(target=wedged_read, name='poller')
+    reader.start()
+    try:
+        with caplog.at_level(logging.CRITICAL):
+            start = time.monotonic()
+            detector.start()
+            while not stalls and time.monotonic() - start < 3:
+                time.sleep(0.01)
+        assert stalls and 0.2 <= stalls[0] - start < 1.0
+        dump = caplog.records[-1].getMessage()
+        assert 'Thread poller' in dump and 'wedged_read' in dump
+
+        # reported once per stall; a beat re-arms the detector, grace extends the deadline
+        detector.beat(grace=0.5)
+        time.sleep(0.4)
+        assert detector.stalls == 1
+    finally:
+        release.set()
+        reader.join()
+        detector.stop()
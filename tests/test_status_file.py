@@ -0,0 +1,71 @@
+#!/usr/bin/env python
+"""
+Tests for the status heartbeat and the health check reading it
+"""
+import importlib.util
+import os
+
+import pytest
+
+from status_file import StatusFile, read_status
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def load_health_check_module():
+    spec = importlib.util.spec_from_file_location('health_check', os.path.join(ROOT, 'tools', 'health_check.py'))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def test_status_is_replaced_atomically(tmp_path):
+    path = str(tmp_path / 'status.json')
+    status_file = StatusFile(path)
+    assert status_file.write({'updated': 1.0, 'cycles': 1})
+    assert status_file.write({'updated': 2.0, 'cycles': 2})
+    assert read_status(path) == {'updated': 2.0, 'cycles': 2}
+    assert os.listdir(tmp_path) == ['status.json']  # no temporary file left behind
+
+    assert StatusFile(str(tmp_path / 'missing' / 'status.json')).write({}) is False
+    (tmp_path / 'broken.json').write_text('[1, 2]')
+    with pytest.raises(ValueError):
+        read_status(str(tmp_path / 'broken.json'))
+
+
+def test_health_check_requires_recent_reads_and_publishes():
+    check_status = load_health_check_module().check_status
+    status = {'updated': 1000.0, 'last_read': 995.0, 'last_publish': 995.0}
+    assert check_status(status, max_age=60, now=1010.0) == []
+
+    # the daemon is alive but the meter stopped answering
+    status['last_read'] = 900.0
+    assert check_status(status, max_age=60, now=1010.0) == ['last successful meter read 110s ago']
+    # never published
+    status.update(last_read=995.0, last_publish=None)
+    assert check_status(status, max_age=60, now=1010.0) == ['no MQTT publish yet']
+    assert check_status(status, max_age=60, now=1010.0, require_publish=False) == []
+    # the daemon hangs
+    assert 'last heartbeat 1000s ago' in check_status(status, max_age=60, now=2000.0)
+
+
+def test_gateway_writes_the_heartbeat_after_a_cycle(tmp_path, meter, gateway):
+    import time
+    status_path = str(tmp_path / 'status.json')
+    em340, _ = gateway(meter(), status_file=status_path)
+    data = em340.poll_cycle()
+    em340.publish(data)
+    em340.write_status(data)
+    status = read_status(status_path)
+    assert status['cycles'] == 1 and status['quality'] == 'good' and status['stale_blocks'] == 0
+    assert time.time() - 5 < status['last_read'] <= status['last_publish'] <= status['updated']
+
+
+def test_status_heartbeat_defaults_for_configs_without_the_key(tmp_path, monkeypatch, meter, gateway):
+    """An em340.yaml from before status_file still feeds the health check's default path."""
+    import em340 as em340_module
+    default_path = str(tmp_path / 'em340d-status.json')
+    monkeypatch.setattr(em340_module, 'DEFAULT_STATUS_FILE', default_path)
+    em340, _ = gateway(meter(), status_file=None)
+    em340.write_status(em340.poll_cycle())
+    assert read_status(default_path)['cycles'] == 1
@@ -0,0 +1,244 @@
+#!/usr/bin/env python3
+"""
+End-to-end throughput benchmark for EM340D.
+Runs the real EM340 polling stack against an emulated meter on a pty pair and
+publishes to an in-process stub MQTT broker - no hardware required.
+
+Usage:
+    python tools/benchmark.py                    # run and compare against the committed baseline
+    python tools/benchmark.py --update-baseline  # record new baseline numbers
+"""
+import argparse
+import copy
+import json
+import logging
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import yaml
+from config_loader import get_config
+from mqtt_stub_broker import StubBroker
+
+DEFAULT_BASELINE = os.path.join(ROOT, 'tools', 'benchmark_baseline.json')
+
+# Metrics where a larger number is an improvement; all others are "lower is better"
+HIGHER_IS_BETTER = {'cycles_per_s'}
+
+def current_rss_kb():
+    """Resident set size of this process in kB."""
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    import resource
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+def percentile(samples, fraction):
+    """Nearest-rank percentile of a list of samples."""
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, max(0, int(round(fraction * len(ordered))) - 1))
+    return ordered[index]
+
+def start_emulator(config_file):
+    """Launch the meter emulator in its own process and return (process, pty path)."""
+    process = subprocess.Popen(
+        [sys.executable, os.path.join(ROOT, 'em340_emulator.py'), '--config', config_file],
+        stdout=subprocess.PIPE, text=True, cwd=ROOT)
+    port = process.stdout.readline().strip()
+    if not port:
+        process.kill()
+        raise RuntimeError('Emulator did not report its pty device')
+    return process, port
+
+def write_bench_config(template, device, broker, delay_ms):
+    """Write a temporary gateway config pointing at the emulator and the stub broker."""
+    config = copy.deepcopy(get_config(template))  # the cached config is shared
+    config['config'].update({'device': device, 't_delay_ms': delay_ms, 'modbus_address': 1,
+                             'serial_number': 'BENCH'})
+    config['mqtt'].update({'broker': broker.host, 'port': broker.port, 'username': '', 'password': ''})
+    config['logger'].update({'log_to_file': False, 'log_level': 'WARNING'})
+    handle, path = tempfile.mkstemp(suffix='.yaml', prefix='em340-bench-')
+    with os.fdopen(handle, 'w') as f:
+        yaml.safe_dump(config, f)
+    return path
+
+def run_benchmark(cycles=200, warmup=10, delay_ms=0, template=os.path.join(ROOT, 'em340.yaml.template')):
+    """
+    Poll the emulated meter for a number of cycles and collect performance metrics.
+
+    Returns:
+        Dictionary of metric name -> value
+    """
+    from em340 import EM340
+    from logger import log
+    log.setLevel(logging.WARNING)
+
+    emulator, port = start_emulator(template)
+    broker = StubBroker().start()
+    config_file = write_bench_config(template, port, broker, delay_ms)
+    em340 = None
+    try:
+        em340 = EM340(config_file)
+        em340._build_plan()
+        broker.wait_for_clients(2)
+
+        for _ in range(warmup):
+            em340.publish(em340.poll_cycle())
+
+        latencies, thread_cpu = [], []
+        process_cpu_start = time.process_time()
+        wall_start = time.perf_counter()
+        for _ in range(cycles):
+            t0, c0 = time.perf_counter(), time.thread_time()
+            em340.publish(em340.poll_cycle())
+            thread_cpu.append(time.thread_time() - c0)
+            latencies.append(time.perf_counter() - t0)
+        wall = time.perf_counter() - wall_start
+        process_cpu = time.process_time() - process_cpu_start
+
+        published = broker.wait_for_messages(em340.topic, warmup + cycles, timeout=5.0)
+        return {
+            'cycles': cycles,
+            'blocks_per_cycle': len(em340.blocks),
+            'cycles_per_s': round(cycles / wall, 2),
+            'latency_p50_ms': round(percentile(latencies, 0.50) * 1000, 3),
+            'latency_p99_ms': round(percentile(latencies, 0.99) * 1000, 3),
+            'latency_mean_ms': round(statistics.mean(latencies) * 1000, 3),
+            'cpu_ms_per_cycle': round(statistics.mean(thread_cpu) * 1000, 3),
+            'process_cpu_ms_per_cycle': round(process_cpu / cycles * 1000, 3),
+            'rss_kb': current_rss_kb(),
+            'published': len(published),
+        }
+    finally:
+        if em340 is not None:
+            em340.mqtt_client.loop_stop()
+            em340.mqtt_client.disconnect()
+            em340.config_manager.stop_config_service()
+            em340.em340.serial.close()
+            em340.config_manager.modbus.serial.close()
+            em340.device_watcher.stop()
+        broker.stop()
+        emulator.terminate()
+        emulator.wait()
+        os.unlink(config_file)
+
+def measure_cold_start(runs=3, template=os.path.join(ROOT, 'em340.yaml.template')):
+    """
+    Time from launching `python em340.py <config>` until its first cycle reaches the broker.
+
+    The gateway runs from an empty working directory, so nothing but the given
+    config file is needed to start it.
+
+    Returns:
+        Median cold start time in milliseconds
+    """
+    emulator, port = start_emulator(template)
+    broker = StubBroker().start()
+    config_file = write_bench_config(template, port, broker, 0)
+    topic = get_config(config_file)['mqtt']['topic'] + '/BENCH'
+    samples = []
+    try:
+        with tempfile.TemporaryDirectory() as workdir:
+            for _ in range(runs):
+                already_received = len(broker.messages_for(topic))
+                start = time.perf_counter()
+                process = subprocess.Popen([sys.executable, os.path.join(ROOT, 'em340.py'), config_file],
+                                           cwd=workdir, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+                try:
+                    received = broker.wait_for_messages(topic, already_received + 1, timeout=30.0)
+                    if len(received) > already_received:
+                        samples.append(time.perf_counter() - start)
+                finally:
+                    process.terminate()
+                    process.wait()
+    finally:
+        broker.stop()
+        emulator.terminate()
+        emulator.wait()
+        os.unlink(config_file)
+    if not samples:
+        raise RuntimeError('Gateway never published during cold start measurement')
+    return round(statistics.median(samples) * 1000, 1)
+
+def compare_with_baseline(results, baseline):
+    """
+    Compare benchmark results against a baseline.
+
+    Returns:
+        List of human-readable regression descriptions (empty if none)
+    """
+    tolerance = baseline.get('tolerance', 0.25)
+    regressions = []
+    for metric, expected in baseline['metrics'].items():
+        if metric not in results or not expected:
+            continue
+        actual = results[metric]
+        if metric in HIGHER_IS_BETTER:
+            if actual < expected * (1 - tolerance):
+                regressions.append(f'{metric}: {actual} < baseline {expected} (-{tolerance:.0%} allowed)')
+        elif actual > expected * (1 + tolerance):
+            regressions.append(f'{metric}: {actual} > baseline {expected} (+{tolerance:.0%} allowed)')
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description='EM340D end-to-end benchmark over a virtual serial port')
+    parser.add_argument('--cycles', type=int, default=200, help='Measured poll cycles')
+    parser.add_argument('--warmup', type=int, default=10, help='Unmeasured warm-up cycles')
+    parser.add_argument('--delay-ms', type=int, default=0, help='Inter-block delay (t_delay_ms) to benchmark with')
+    parser.add_argument('--baseline', default=DEFAULT_BASELINE, help='Baseline JSON file')
+    parser.add_argument('--tolerance', type=float, help='Override the allowed relative deviation')
+    parser.add_argument('--skip-cold-start', action='store_true', help='Do not measure startup to first publish')
+    parser.add_argument('--update-baseline', action='store_true', help='Write results as the new baseline')
+    args = parser.parse_args()
+
+    results = run_benchmark(cycles=args.cycles, warmup=args.warmup, delay_ms=args.delay_ms)
+    if not args.skip_cold_start:
+        results['cold_start_ms'] = measure_cold_start()
+    print(json.dumps(results, indent=2))
+
+    if args.update_baseline:
+        baseline = {
+            'tolerance': args.tolerance if args.tolerance is not None else 0.5,
+            'host': f'{platform.machine()} {platform.python_implementation()} {platform.python_version()}',
+            'metrics': {k: results[k] for k in ('cycles_per_s', 'latency_p50_ms', 'latency_p99_ms',
+                                                'cpu_ms_per_cycle', 'rss_kb', 'cold_start_ms')
+                        if k in results},
+        }
+        with open(args.baseline, 'w') as f:
+            json.dump(baseline, f, indent=2)
+            f.write('\n')
+        print(f'Baseline written to {args.baseline}')
+        sys.exit(0)
+
+    if not os.path.exists(args.baseline):
+        print(f'No baseline at {args.baseline} - run with --update-baseline first', file=sys.stderr)
+        sys.exit(0)
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    if args.tolerance is not None:
+        baseline['tolerance'] = args.tolerance
+
+    regressions = compare_with_baseline(results, baseline)
+    if results['published'] < args.cycles + args.warmup:
+        regressions.append(f'only {results["published"]} of {args.cycles + args.warmup} cycles reached the broker')
+    if regressions:
+        print('FAIL: performance regression detected', file=sys.stderr)
+        for regression in regressions:
+            print(f'  {regression}', file=sys.stderr)
+        sys.exit(1)
+    print(f'OK: within {baseline.get("tolerance", 0.25):.0%} of baseline ({baseline.get("host", "unknown host")})')
+    sys.exit(0)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,283 @@
+#!/usr/bin/env python3
+"""
+Offline RS-485 bus traffic analyzer.
+
+Reads a capture file and reports how loaded the line is before more meters are
+added: bus utilisation per second, master request rate, slave turnaround latency,
+inter-frame gaps, CRC errors and the idle windows left for another master.
+
+Sniffer captures (em340monitor with capture_file set) hold raw chunks and are
+framed with modbus_sniffer; gateway captures (em340.py) hold one frame per record.
+The capture is streamed in 1 MiB chunks and framed once into compact per-frame
+integer columns, so memory grows with the number of frames, not the file size.
+Framing is pure Python, about 1.7 MB of capture per second: a day of a fully
+loaded 9600 baud line takes under a minute. The statistics use numpy when it is
+installed (optional, see requirements.txt) and the array module otherwise.
+
+Usage:
+    python tools/bus_analyzer.py sniffer.cap
+    python tools/bus_analyzer.py sniffer.cap --idle-ms 100 --json
+"""
+import argparse
+import json
+import os
+import sys
+from array import array
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+try:
+    import numpy as np
+except ImportError:  # optional extra, only makes the statistics of large captures faster
+    np = None
+
+from frame_capture import DIRECTION_BUS, DIRECTION_RX, DIRECTION_TX, read_capture
+from modbus_codec import EXCEPTION_FLAG, check_crc
+from modbus_sniffer import ModbusSniffer, character_time_ns
+
+# Frame kinds in FrameTable.kind
+REQUEST = 0
+RESPONSE = 1
+EXCEPTION = 2
+
+# Largest EM340 exchange: 8 byte request for 20 registers and its 45 byte response
+FULL_READ_BYTES = 8 + 45
+
+class FrameTable:
+    """Per-frame columns of a capture: end time, length, kind and slave address."""
+
+    def __init__(self, baudrate=9600):
+        self.character_ns = character_time_ns(baudrate)
+        self.end_ns = array('q')
+        self.length = array('H')
+        self.kind = array('B')
+        self.slave = array('B')
+        self.turnaround_ns = array('q')  # end of request to start of response
+        self.crc_errors = 0              # frames with a bad CRC, or sync losses on sniffed chunks
+        self.discarded_bytes = 0
+        self.unanswered = 0
+
+    def add(self, end_ns, frame, is_response):
+        self.end_ns.append(end_ns)
+        self.length.append(len(frame))
+        self.kind.append((EXCEPTION if frame[1] & EXCEPTION_FLAG else RESPONSE) if is_response else REQUEST)
+        self.slave.append(frame[0])
+
+    def __len__(self):
+        return len(self.end_ns)
+
+def load_frames(records, baudrate=9600):
+    """
+    Frame the records of a capture.
+
+    Args:
+        records: Iterable of (monotonic_ns, direction, bytes) as from read_capture()
+
+    Returns:
+        FrameTable
+    """
+    table = FrameTable(baudrate)
+    character_ns = table.character_ns
+
+    def on_exchange(exchange):
+        if exchange.response is not None:
+            # called right after the response frame was added
+            response_start_ns = exchange.response_ns - table.length[-1] * character_ns
+            table.turnaround_ns.append(response_start_ns - exchange.request_ns)
+
+    sniffer = ModbusSniffer(baudrate, on_exchange=on_exchange, on_frame=table.add)
+    request_end_ns = None
+    for timestamp_ns, direction, data in records:
+        if direction == DIRECTION_BUS:
+            sniffer.feed(timestamp_ns, data)
+            continue
+        # Gateway capture: a request is stamped when it is sent, a response when it was read
+        if direction == DIRECTION_TX:
+            timestamp_ns += len(data) * character_ns
+        if len(data) < 4 or not check_crc(data):
+            table.crc_errors += 1
+            request_end_ns = None
+            continue
+        table.add(timestamp_ns, data, direction == DIRECTION_RX)
+        if direction == DIRECTION_TX:
+            if request_end_ns is not None:
+                table.unanswered += 1
+            request_end_ns = timestamp_ns
+        elif request_end_ns is not None:
+            table.turnaround_ns.append(timestamp_ns - len(data) * character_ns - request_end_ns)
+            request_end_ns = None
+
+    table.crc_errors += sniffer.stats.resyncs
+    table.discarded_bytes += sniffer.stats.discarded_bytes
+    table.unanswered += sniffer.stats.unanswered_requests
+    return table
+
+# --- column operations (numpy or array module) --------------------------------
+
+def _distribution(samples_ns):
+    """Nearest-rank percentiles of a column of nanosecond samples, in milliseconds."""
+    count = len(samples_ns)
+    if not count:
+        return {'count': 0}
+    if np is not None:
+        ordered = np.sort(np.asarray(samples_ns, dtype=np.int64))
+        mean = float(ordered.mean())
+    else:
+        ordered = sorted(samples_ns)
+        mean = sum(ordered) / count
+
+    def rank(fraction):
+        return int(ordered[min(count - 1, max(0, int(round(fraction * count)) - 1))])
+
+    return {'count': count, 'mean_ms': round(mean / 1e6, 3), 'p50_ms': round(rank(0.5) / 1e6, 3),
+            'p90_ms': round(rank(0.9) / 1e6, 3), 'p99_ms': round(rank(0.99) / 1e6, 3),
+            'max_ms': round(int(ordered[-1]) / 1e6, 3)}
+
+def _columns(table):
+    """Start times, end times, busy time and gaps to the previous frame, per frame."""
+    character_ns = table.character_ns
+    if np is not None:
+        end = np.frombuffer(table.end_ns, dtype=np.int64)
+        busy = np.frombuffer(table.length, dtype=np.uint16).astype(np.int64) * character_ns
+        start = end - busy
+        return start, end, busy, start[1:] - end[:-1]
+    busy = array('q', (length * character_ns for length in table.length))
+    start = array('q', (end - b for end, b in zip(table.end_ns, busy)))
+    gaps = array('q', (s - e for s, e in zip(start[1:], table.end_ns)))
+    return start, table.end_ns, busy, gaps
+
+def _per_second(seconds, weights, duration_s, mask=None):
+    """Sum of weights per whole second of the capture."""
+    if np is not None:
+        if mask is not None:
+            seconds, weights = seconds[mask], weights[mask]
+        return np.bincount(seconds, weights=weights, minlength=duration_s).tolist()
+    totals = [0] * duration_s
+    for i, (second, weight) in enumerate(zip(seconds, weights)):
+        if mask is None or mask[i]:
+            totals[second] += weight
+    return totals
+
+def analyze(table, idle_ms=50.0):
+    """
+    Compute the bus statistics of a FrameTable.
+
+    Args:
+        idle_ms: Shortest silence counted as an idle window
+
+    Returns:
+        Report dictionary
+    """
+    frames = len(table)
+    report = {'frames': frames, 'crc_errors': table.crc_errors, 'discarded_bytes': table.discarded_bytes,
+              'unanswered_requests': table.unanswered, 'numpy': np is not None}
+    if not frames:
+        return report
+    start, end, busy, gaps = _columns(table)
+    idle_ns = int(idle_ms * 1e6)
+    if np is not None:
+        first_ns = int(start.min())
+        duration_s = (int(end.max()) - first_ns) // 1_000_000_000 + 1
+        seconds = (end - first_ns) // 1_000_000_000
+        kind = np.frombuffer(table.kind, dtype=np.uint8)
+        is_request = kind == REQUEST
+        requests = int(is_request.sum())
+        exceptions = int((kind == EXCEPTION).sum())
+        ones = np.ones(frames)
+        slaves = np.bincount(np.frombuffer(table.slave, dtype=np.uint8)[is_request], minlength=256)
+        per_slave = {str(slave): int(slaves[slave]) for slave in np.flatnonzero(slaves)}
+        windows = gaps[gaps >= idle_ns]
+    else:
+        first_ns = min(start)
+        duration_s = (max(end) - first_ns) // 1_000_000_000 + 1
+        seconds = [(e - first_ns) // 1_000_000_000 for e in end]
+        is_request = [kind == REQUEST for kind in table.kind]
+        requests = sum(is_request)
+        exceptions = table.kind.count(EXCEPTION)
+        ones = [1] * frames
+        counts = {}
+        for request, slave in zip(is_request, table.slave):
+            if request:
+                counts[slave] = counts.get(slave, 0) + 1
+        per_slave = {str(slave): counts[slave] for slave in sorted(counts)}
+        windows = array('q', (gap for gap in gaps if gap >= idle_ns))
+
+    utilisation = [min(1.0, float(b) / 1e9) for b in _per_second(seconds, busy, duration_s)]
+    request_rate = _per_second(seconds, ones, duration_s, mask=is_request)
+    busiest = max(range(duration_s), key=utilisation.__getitem__)
+    report.update({
+        'duration_s': duration_s,
+        'requests': requests,
+        'exceptions': exceptions,
+        'crc_error_rate': round(table.crc_errors / (frames + table.crc_errors), 5),
+        'utilisation': {
+            'mean': round(sum(utilisation) / duration_s, 4),
+            'p95': round(sorted(utilisation)[min(duration_s - 1, int(0.95 * duration_s))], 4),
+            'max': round(utilisation[busiest], 4),
+            'busiest_second': busiest,
+        },
+        'request_rate': {'mean_per_s': round(requests / duration_s, 3), 'max_per_s': int(max(request_rate))},
+        'requests_per_slave': per_slave,
+        'turnaround': _distribution(table.turnaround_ns),
+        'inter_frame_gap': _distribution(gaps),
+    })
+
+    # Idle windows, and how many of them would fit one more full 20-register read
+    turnaround_p90_ns = int(report['turnaround'].get('p90_ms', 0) * 1e6)
+    full_read_ns = FULL_READ_BYTES * table.character_ns + turnaround_p90_ns + 7 * table.character_ns
+    idle = _distribution(windows)
+    idle.update({
+        'threshold_ms': idle_ms,
+        'per_minute': round(len(windows) * 60 / duration_s, 2),
+        'idle_fraction': round(int(sum(windows)) / (duration_s * 1e9), 4),
+        'fit_full_read': int(sum(windows >= full_read_ns)) if np is not None else
+                         sum(1 for window in windows if window >= full_read_ns),
+        'full_read_ms': round(full_read_ns / 1e6, 2),
+    })
+    report['idle_windows'] = idle
+    return report
+
+def format_report(report):
+    """Human-readable lines of a report."""
+    if not report['frames']:
+        return ['No frames found in the capture']
+    utilisation, rate = report['utilisation'], report['request_rate']
+    lines = [
+        f'{report["frames"]} frames in {report["duration_s"]} s, {report["requests"]} requests, '
+        f'{report["exceptions"]} exception responses, {report["unanswered_requests"]} unanswered',
+        f'Bus utilisation: mean {utilisation["mean"]:.1%}, p95 {utilisation["p95"]:.1%}, '
+        f'max {utilisation["max"]:.1%} (second {utilisation["busiest_second"]})',
+        f'Request rate: mean {rate["mean_per_s"]}/s, max {rate["max_per_s"]}/s; per slave: '
+        f'{", ".join(f"{slave}: {count}" for slave, count in report["requests_per_slave"].items())}',
+        f'CRC errors / sync losses: {report["crc_errors"]} ({report["crc_error_rate"]:.3%}), '
+        f'{report["discarded_bytes"]} bytes discarded',
+    ]
+    for name, title in (('turnaround', 'Slave turnaround'), ('inter_frame_gap', 'Inter-frame gap'),
+                        ('idle_windows', 'Idle windows')):
+        stats = report[name]
+        if stats['count']:
+            lines.append(f'{title}: {stats["count"]} samples, p50 {stats["p50_ms"]} ms, p90 {stats["p90_ms"]} ms, '
+                         f'p99 {stats["p99_ms"]} ms, max {stats["max_ms"]} ms')
+    idle = report['idle_windows']
+    lines.append(f'Idle windows >= {idle["threshold_ms"]} ms: {idle["per_minute"]}/min, '
+                 f'{idle["idle_fraction"]:.1%} of the time; {idle["fit_full_read"]} fit a full '
+                 f'20-register read ({idle["full_read_ms"]} ms)')
+    return lines
+
+def main():
+    parser = argparse.ArgumentParser(description='Analyze RS-485 bus load from a capture file')
+    parser.add_argument('capture', help='Capture file written with config.capture_file')
+    parser.add_argument('--baudrate', type=int, default=9600, help='Line speed of the captured bus')
+    parser.add_argument('--idle-ms', type=float, default=50.0, help='Shortest silence counted as an idle window')
+    parser.add_argument('--json', action='store_true', help='Print the report as JSON')
+    args = parser.parse_args()
+
+    report = analyze(load_frames(read_capture(args.capture), args.baudrate), args.idle_ms)
+    if args.json:
+        print(json.dumps(report, indent=2))
+    else:
+        print('\n'.join(format_report(report)))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,77 @@
+#!/usr/bin/env python3
+"""
+Micro-benchmarks for the ModBus frame codec.
+
+Compares the table-driven CRC of modbus_codec with the bit-by-bit loop it replaced
+in the sniffer, emulator and frame capture, and with minimalmodbus' implementation
+used by the poller; then times frame building and parsing.
+
+Usage:
+    python tools/codec_benchmark.py
+    python tools/codec_benchmark.py --number 20000
+"""
+import argparse
+import json
+import os
+import sys
+import timeit
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import modbus_codec
+
+def bitwise_crc16(data):
+    """The per-bit CRC loop previously duplicated across the tools."""
+    crc = 0xFFFF
+    for byte in data:
+        crc ^= byte
+        for _ in range(8):
+            if crc & 0x0001:
+                crc = (crc >> 1) ^ 0xA001
+            else:
+                crc >>= 1
+    return crc
+
+def run(number=5000):
+    """
+    Time each codec operation.
+
+    Returns:
+        Dictionary of benchmark name -> microseconds per call
+    """
+    request = modbus_codec.build_read_request(1, 0x0000, 20)
+    response = modbus_codec.build_read_response(1, range(20))  # 45 bytes, the largest EM340 frame
+    parsed_request = modbus_codec.parse_request(request)
+    view = memoryview(response)
+
+    cases = {
+        'crc_bitwise_45B': lambda: bitwise_crc16(response),
+        'crc_table_45B': lambda: modbus_codec.crc16(response),
+        'build_read_request': lambda: modbus_codec.build_read_request(1, 0x0000, 20),
+        'parse_request': lambda: modbus_codec.parse_request(request),
+        'parse_response_20_regs': lambda: modbus_codec.parse_response(view, parsed_request),
+    }
+    try:
+        import minimalmodbus
+        minimalmodbus_crc = getattr(minimalmodbus, '_calculate_crc', None)  # private, may change
+    except ImportError:
+        minimalmodbus_crc = None
+    if minimalmodbus_crc is not None:
+        cases['crc_minimalmodbus_45B'] = lambda: minimalmodbus_crc(response)
+
+    return {name: round(min(timeit.repeat(case, number=number, repeat=3)) / number * 1e6, 3)
+            for name, case in cases.items()}
+
+def main():
+    parser = argparse.ArgumentParser(description='ModBus codec micro-benchmarks')
+    parser.add_argument('--number', type=int, default=5000, help='Calls per timing run')
+    args = parser.parse_args()
+
+    results = run(args.number)
+    print(json.dumps(results, indent=2))
+    print(f'Table CRC is {results["crc_bitwise_45B"] / results["crc_table_45B"]:.1f}x faster '
+          f'than the bit-by-bit loop', file=sys.stderr)
+
+if __name__ == '__main__':
+    main()
@@ -1,73 +1,72 @@
 #!/usr/bin/env python3
 """
 Health check script for EM340D service.
-Monitors device availability and can be used by Docker healthcheck or external monitoring.
+Reads the status heartbeat the daemon rewrites after every cycle (config.status_file),
+so it never touches the serial port the poller is using and fails as soon as data
+stops flowing. Used by the Docker healthcheck or external monitoring.
+
+Usage:
+    python tools/health_check.py
+    python tools/health_check.py --status-file /run/em340d/status.json --max-age 30
 """
+import argparse
 import os
 import sys
-import serial
-import yaml
-from datetime import datetime
+import time
 
-def load_config():
-    """Load configuration from em340.yaml"""
-    try:
-        # Try to import config_loader if available for environment variable support
-        try:
-            from config_loader import load_yaml_with_env
-            config = load_yaml_with_env('/app/em340.yaml')
-        except ImportError:
-            # Fallback to basic yaml loading
-            with open('/app/em340.yaml', 'r') as f:
-                config = yaml.safe_load(f)
-        return config
-    except Exception as e:
-        print(f"Error loading config: {e}", file=sys.stderr)
-        return None
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
 
-def check_device_exists(device_path):
-    """Check if the device file exists"""
-    if not os.path.exists(device_path):
-        print(f"FAIL: Device {device_path} does not exist", file=sys.stderr)
-        return False
-    return True
+from status_file import DEFAULT_STATUS_FILE, read_status
 
-def check_device_accessible(device_path):
-    """Check if the device is accessible and can be opened"""
-    try:
-        # Try to open the serial port briefly
-        with serial.Serial(device_path, 9600, timeout=0.5) as ser:
-            if ser.is_open:
-                print(f"OK: Device {device_path} is accessible")
-                return True
-    except serial.SerialException as e:
-        print(f"FAIL: Cannot access device {device_path}: {e}", file=sys.stderr)
-        return False
-    except Exception as e:
-        print(f"FAIL: Unexpected error accessing {device_path}: {e}", file=sys.stderr)
-        return False
-    
-    return False
+def check_status(status, max_age, now=None, require_publish=True):
+    """
+    Judge a status record.
+
+    Args:
+        max_age: Seconds after which the heartbeat, the last read and the last
+            publish count as too old
+        require_publish: Also require a recent MQTT publish
+
+    Returns:
+        List of problems, empty if healthy
+    """
+    now = time.time() if now is None else now
+    problems = []
+    checks = [('updated', 'heartbeat'), ('last_read', 'successful meter read')]
+    if require_publish:
+        checks.append(('last_publish', 'MQTT publish'))
+    for key, what in checks:
+        timestamp = status.get(key)
+        if timestamp is None:
+            problems.append(f'no {what} yet')
+        elif now - timestamp > max_age:
+            problems.append(f'last {what} {now - timestamp:.0f}s ago')
+    return problems
 
 def main():
     """Main health check routine"""
-    config = load_config()
-    if not config:
-        sys.exit(1)
-    
-    device = config.get('config', {}).get('device', '/dev/ttyUSB0')
-    
-    print(f"Health check for EM340D - {datetime.now().isoformat()}")
-    
-    # Check if device exists
-    if not check_device_exists(device):
+    parser = argparse.ArgumentParser(description='Check the EM340D status heartbeat')
+    parser.add_argument('--status-file', default=os.getenv('STATUS_FILE') or DEFAULT_STATUS_FILE,
+                        help='Status file written by the daemon (default: $STATUS_FILE or %(default)s)')
+    parser.add_argument('--max-age', type=float, default=60.0,
+                        help='Seconds without a read or publish before the service counts as unhealthy')
+    parser.add_argument('--ignore-mqtt', action='store_true', help='Do not require recent MQTT publishes')
+    args = parser.parse_args()
+
+    try:
+        status = read_status(args.status_file)
+    except (OSError, ValueError) as e:
+        print(f'FAIL: Cannot read status file {args.status_file}: {e}', file=sys.stderr)
         sys.exit(1)
-    
-    # Check if device is accessible
-    if not check_device_accessible(device):
+
+    problems = check_status(status, args.max_age, require_publish=not args.ignore_mqtt)
+    counters = ', '.join(f'{key}={status.get(key)}' for key in
+                         ('quality', 'breaker', 'cycles', 'stale_blocks', 'publish_errors', 'reconnects'))
+    if problems:
+        print(f'FAIL: {"; ".join(problems)} ({counters})', file=sys.stderr)
         sys.exit(1)
-    
-    print("Health check passed")
+    print(f'OK: {counters}')
     sys.exit(0)
 
 if __name__ == '__main__':
@@ -0,0 +1,83 @@
+#!/usr/bin/env python3
+"""
+Replay a raw ModBus frame capture through the EM340D decode and publish pipeline.
+
+Usage:
+    python tools/replay_capture.py em340d.cap                       # max speed, in-process stub broker
+    python tools/replay_capture.py em340d.cap --realtime --print    # original pacing, show decoded cycles
+    python tools/replay_capture.py em340d.cap --broker mqtt.local   # publish to a real broker
+"""
+import argparse
+import json
+import logging
+import os
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import paho.mqtt.client as mqtt
+from config_loader import ConfigError, get_config
+from frame_capture import read_capture, replay
+from mqtt_stub_broker import StubBroker
+
+def main():
+    parser = argparse.ArgumentParser(description='Replay an EM340D frame capture')
+    parser.add_argument('capture', help='Capture file written with config.capture_file')
+    parser.add_argument('--config', default=os.path.join(ROOT, 'em340.yaml.template'),
+                        help='YAML file with the sensor map used when the capture was taken')
+    parser.add_argument('--realtime', action='store_true', help='Reproduce the captured timing')
+    parser.add_argument('--broker', help='Publish to this MQTT broker instead of an in-process stub')
+    parser.add_argument('--port', type=int, default=1883, help='MQTT broker port')
+    parser.add_argument('--topic', default='em340/replay', help='MQTT topic for replayed cycles')
+    parser.add_argument('--print', dest='print_cycles', action='store_true', help='Print every decoded cycle')
+    args = parser.parse_args()
+
+    from logger import log
+    from poll_plan import PollPlan
+    log.setLevel(logging.WARNING)
+
+    try:
+        plan = PollPlan.from_config(get_config(args.config))
+    except ConfigError as e:
+        parser.error(str(e))
+
+    broker = None
+    if args.broker:
+        host, port = args.broker, args.port
+    else:
+        broker = StubBroker().start()
+        host, port = broker.host, broker.port
+    client = mqtt.Client(callback_api_version=mqtt.CallbackAPIVersion.VERSION2)
+    client.connect(host, port)
+    client.loop_start()
+    if broker:
+        broker.wait_for_clients(1)
+
+    last_message = []
+
+    def publish(data):
+        if args.print_cycles:
+            print(json.dumps(data))
+        last_message[:] = [client.publish(args.topic, json.dumps(data))]
+
+    stats = replay(read_capture(args.capture), plan, publish, realtime=args.realtime)
+
+    # Let the network loop flush the queued publishes and the DISCONNECT before stopping it
+    if last_message and last_message[0].rc == mqtt.MQTT_ERR_SUCCESS:
+        last_message[0].wait_for_publish(timeout=5)
+    client.disconnect()
+    client.loop_stop()
+    if broker:
+        broker.stop()
+
+    elapsed = stats.pop('elapsed_s')
+    print(json.dumps(stats, indent=2), file=sys.stderr)
+    if elapsed > 0:
+        print(f'Replayed {stats["frames"]} frames / {stats["cycles"]} cycles in {elapsed:.3f}s '
+              f'({stats["frames"] / elapsed:.0f} frames/s, {stats["cycles"] / elapsed:.0f} cycles/s)',
+              file=sys.stderr)
+
+if __name__ == '__main__':
+    main()
@@ -80,6 +80,20 @@ send_alert() {
     # Example: curl -X POST https://your-webhook-url -d "message=$message"
 }
 
+wait_for_next_check() {
+    # Wake up early when device nodes come or go (needs inotify-tools), otherwise poll
+    local watch_dirs="/dev"
+    [ -d /dev/serial/by-id ] && watch_dirs="$watch_dirs /dev/serial/by-id"
+    if command -v inotifywait >/dev/null 2>&1; then
+        # exit code 0 = event, 2 = timeout; anything else means inotifywait could not run
+        inotifywait -qq -t "$CHECK_INTERVAL" -e create -e delete $watch_dirs
+        case $? in
+            0|2) return ;;
+        esac
+    fi
+    sleep "$CHECK_INTERVAL"
+}
+
 main() {
     log "Starting EM340D watchdog (check interval: ${CHECK_INTERVAL}s)"
     
@@ -105,7 +119,7 @@ main() {
             fi
         fi
         
-        sleep "$CHECK_INTERVAL"
+        wait_for_next_check
     done
 }
 